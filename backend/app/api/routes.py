@@ -1,20 +1,30 @@
-from fastapi import APIRouter, UploadFile, File, Body
-from app.services.ingestion import process_file_content
-from app.services.rag import rag_pipeline
-from app.services.database import get_supabase
+import asyncio
+import json
+
+from fastapi import APIRouter, UploadFile, File, Form, Body
+from fastapi.responses import StreamingResponse
+from app.services.jobs import JobError, job_queue
+from app.services.rag import rag_pipeline_async, rag_pipeline_stream
+from app.services.database import execute, get_supabase
+from app.services.concurrency import run_stage
+from app.services.reranker import RERANKERS
+from app.services.vector_store import get_vector_store
+from app.services.embedding_cache import embedding_cache
+from app.services.answer_cache import answer_cache
+from app.services.telemetry import render_metrics
 
 router = APIRouter()
 
-@router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+@router.post("/upload", status_code=202)
+async def upload_file(file: UploadFile = File(...), replace: bool = Form(False)):
+    """
+    Queues the file for background ingestion; poll /jobs/{job_id} for progress.
+    With `replace`, the stored documents with the same filename are removed
+    once the new one is ingested; by default they are kept.
+    """
     try:
-        # Read file content into memory
-        content_bytes = await file.read()
-        content = content_bytes.decode("utf-8")
-        
-        # Process directly
-        result = process_file_content(content, file.filename)
-        return {"message": "File processed successfully", "data": result}
+        job = await run_stage("ingest", job_queue.submit, file.file, file.filename, replace)
+        return {"message": "File queued for processing", "job_id": job["id"], "job": job}
     except Exception as e:
         print(f"❌ Upload Error: {str(e)}")
         import traceback
@@ -22,18 +32,84 @@ async def upload_file(file: UploadFile = File(...)):
         from fastapi import HTTPException
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
+def job_or_404(job_id: str) -> dict:
+    job = job_queue.get(job_id)
+    if job is None:
+        from fastapi import HTTPException
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+async def job_action(action, job_id: str) -> dict:
+    from fastapi import HTTPException
+    try:
+        return await run_stage("db", action, job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    except JobError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/jobs")
+async def list_jobs(limit: int = 20):
+    return {"jobs": await run_stage("db", job_queue.list, limit)}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status, per-stage progress (bytes read, chunks embedded/inserted) and throughput of an ingestion job."""
+    return await run_stage("db", job_or_404, job_id)
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    return await job_action(job_queue.cancel, job_id)
+
+@router.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    """Continues a failed or cancelled job after the chunks it already stored."""
+    return await job_action(job_queue.resume, job_id)
+
+@router.get("/health")
+async def health():
+    """Readiness info; `bm25_ready` is false while the startup sync is still running."""
+    from app.services.bm25_service import bm25_service
+    return {
+        "status": "ok",
+        "bm25_ready": bm25_service.ready.is_set(),
+        "bm25_chunks": bm25_service.bm25.num_docs if bm25_service.bm25 else 0,
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "vector_store": get_vector_store().stats(),
+    }
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latency histograms, external calls, cache hit ratios, index sizes."""
+    from fastapi.responses import PlainTextResponse
+    body = await asyncio.get_running_loop().run_in_executor(None, render_metrics)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @router.get("/documents")
 async def get_documents():
     """Get list of all uploaded documents"""
     supabase = get_supabase()
-    response = supabase.table("documents").select("*").order("upload_date", desc=True).execute()
+    query = supabase.table("documents").select("*").order("upload_date", desc=True)
+    response = await run_stage("db", execute, query, "list_documents")
     return {"documents": response.data}
 
+def check_reranker(reranker: str = None):
+    if reranker is not None and reranker not in RERANKERS:
+        from fastapi import HTTPException
+        raise HTTPException(status_code=400, detail=f"Unknown reranker '{reranker}'. Available: {', '.join(RERANKERS)}")
+
 @router.post("/query")
-async def query_rag(query: str = Body(..., embed=True)):
+async def query_rag(query: str = Body(..., embed=True), reranker: str = Body(None, embed=True),
+                    timings: bool = Body(False, embed=True)):
+    """
+    `reranker` (optional): "local", "gemini" or "none"; defaults to the RERANKER setting.
+    `timings` (optional): adds a "timings" block (per-stage milliseconds and trace spans).
+    """
+    check_reranker(reranker)
     try:
         print(f"Received query: {query}")
-        result = rag_pipeline(query)
+        result = await rag_pipeline_async(query, reranker, timings=timings)
         return result
     except Exception as e:
         print(f"❌ API Error: {str(e)}")
@@ -42,11 +118,34 @@ async def query_rag(query: str = Body(..., embed=True)):
         from fastapi import HTTPException
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/query/stream")
+async def query_rag_stream(query: str = Body(..., embed=True), reranker: str = Body(None, embed=True),
+                           timings: bool = Body(False, embed=True)):
+    """
+    Server-Sent Events version of /query: a `retrieval` event with the sources,
+    `token` events with answer text as it is generated, then `done` (or `error`).
+    With `timings`, `done` carries the timings block.
+    """
+    check_reranker(reranker)
+    print(f"Received streaming query: {query}")
+
+    async def events():
+        try:
+            async for event, data in rag_pipeline_stream(query, reranker, timings=timings):
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"❌ API Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @router.post("/summarize")
 async def summarize_route(text: str = Body(..., embed=True)):
     from app.services.rag import summarize_text
     try:
-        summary = summarize_text(text)
+        summary = await run_stage("generate", summarize_text, text)
         return {"summary": summary}
     except Exception as e:
         print(f"❌ API Error: {str(e)}")
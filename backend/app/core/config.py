@@ -9,5 +9,95 @@ class Settings:
     SUPABASE_KEY = os.getenv("VITE_SUPABASE_ANON_KEY")
     GEMINI_CHAT_MODEL = os.getenv("VITE_GEMINI_CHAT_MODEL")
     GEMINI_EMBEDDING_MODEL = os.getenv("VITE_GEMINI_EMBEDDING_MODEL")
+    # Embeddings and generation: "gemini" or "fake" (deterministic offline stand-in, see fakes.py)
+    MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "gemini")
+    # Chunk and document tables: "supabase" or "memory" (in-process, for offline runs and benchmarks)
+    DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "supabase")
+    # Fake provider: simulated call latency in seconds and embedding size
+    FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0"))
+    FAKE_EMBEDDING_LATENCY = float(os.getenv("FAKE_EMBEDDING_LATENCY", "0"))
+    FAKE_EMBEDDING_DIM = int(os.getenv("FAKE_EMBEDDING_DIM", "768"))
+    # "sparse" (exact, postings + argpartition) or "maxscore" (early termination)
+    BM25_SEARCH_MODE = os.getenv("BM25_SEARCH_MODE", "sparse")
+    # Tokenizer used for BM25 and lexical scoring: "arabic", "arabic-nostem" or "whitespace"
+    TOKENIZER = os.getenv("TOKENIZER", "arabic")
+    # BM25 startup sync with Supabase: "blocking" (before serving) or "background"
+    BM25_WARMUP = os.getenv("BM25_WARMUP", "blocking")
+    # Threads running blocking pipeline calls (Gemini, Supabase, BM25, ingestion)
+    PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "32"))
+    # Max concurrent calls per pipeline stage (STAGE_LIMIT_<STAGE> overrides)
+    STAGE_CONCURRENCY = {
+        stage: int(os.getenv(f"STAGE_LIMIT_{stage.upper()}", default))
+        for stage, default in {
+            "expand": "8",
+            "embed": "8",
+            "vector": "16",
+            "bm25": "4",
+            "rerank": "8",
+            "generate": "8",
+            "ingest": "2",
+            "db": "8",
+        }.items()
+    }
+
+    # Embedding cache: LRU in memory + SQLite on disk (empty path = memory only)
+    EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "true").lower() in ("1", "true", "yes")
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3")
+    EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+    # Fusion of the vector (per query variant) and BM25 lists: "rrf", "combsum" or "weighted"
+    FUSION_METHOD = os.getenv("FUSION_METHOD", "rrf")
+    FUSION_RRF_K = int(os.getenv("FUSION_RRF_K", "60"))
+    FUSION_VECTOR_WEIGHT = float(os.getenv("FUSION_VECTOR_WEIGHT", "0.3"))
+    FUSION_BM25_WEIGHT = float(os.getenv("FUSION_BM25_WEIGHT", "0.7"))
+    # Candidates passed on to the reranker
+    FUSION_TOP_N = int(os.getenv("FUSION_TOP_N", "15"))
+    # Default reranker: "local" (CPU feature scorer), "gemini" (LLM grading) or "none"
+    RERANKER = os.getenv("RERANKER", "local")
+    # Vector search backend: "supabase" (match_documents RPC) or "local" (in-process index)
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "supabase")
+    # Local backend: store rows as int8 + per-row scale instead of float32
+    VECTOR_QUANTIZE = os.getenv("VECTOR_QUANTIZE", "false").lower() in ("1", "true", "yes")
+    # Local backend: build an IVF index once the corpus reaches this many chunks (0 = always exact)
+    VECTOR_IVF_MIN_ROWS = int(os.getenv("VECTOR_IVF_MIN_ROWS", "100000"))
+    VECTOR_IVF_NPROBE = int(os.getenv("VECTOR_IVF_NPROBE", "16"))
+    # Answer prompt size in estimated tokens (instructions + question + sources); sources are
+    # compressed to their best sentences to fit (0 = no limit, overlap is still removed)
+    CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1600"))
+    # Query expansion of short queries: "local" (related corpus terms, built with the BM25 index),
+    # "hybrid" (local, then the LLM when the corpus knows none of the query terms), "llm" or "none"
+    QUERY_EXPANSION = os.getenv("QUERY_EXPANSION", "local")
+    QUERY_EXPANSION_TERMS = int(os.getenv("QUERY_EXPANSION_TERMS", "6"))
+    QUERY_EXPANSION_MIN_DF = int(os.getenv("QUERY_EXPANSION_MIN_DF", "3"))
+    QUERY_EXPANSION_REBUILD_RATIO = float(os.getenv("QUERY_EXPANSION_REBUILD_RATIO", "0.1"))
+    # LLM expansions kept in memory, keyed by normalized query
+    QUERY_EXPANSION_CACHE_SIZE = int(os.getenv("QUERY_EXPANSION_CACHE_SIZE", "1000"))
+    # Semantic answer cache in front of the RAG pipeline
+    ANSWER_CACHE = os.getenv("ANSWER_CACHE", "true").lower() in ("1", "true", "yes")
+    ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+    ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    # Chunking: "chars" (CHUNK_SIZE characters, CHUNK_OVERLAP of overlap) or "tokens" (CHUNK_TOKENS
+    # estimated model tokens, CHUNK_OVERLAP_TOKENS of overlap, cut at sentence ends)
+    CHUNK_MODE = os.getenv("CHUNK_MODE", "chars")
+    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "150"))
+    CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+    # Streaming ingestion: text is split in blocks of INGEST_BLOCK_CHARS, embedded in batches of
+    # INGEST_EMBED_BATCH chunks with up to INGEST_EMBED_CONCURRENCY batches in flight
+    INGEST_BLOCK_CHARS = int(os.getenv("INGEST_BLOCK_CHARS", "65536"))
+    INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "100"))
+    INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+    INGEST_RETRIES = int(os.getenv("INGEST_RETRIES", "5"))
+    INGEST_RETRY_DELAY = float(os.getenv("INGEST_RETRY_DELAY", "1.0"))
+    # Embedding requests per minute for bulk ingestion (0 = no limit)
+    INGEST_EMBED_RPM = float(os.getenv("INGEST_EMBED_RPM", "0"))
+    # Background ingestion jobs: state in SQLite, uploads spooled to disk until their job completes
+    JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "data/jobs.sqlite3")
+    JOBS_UPLOAD_DIR = os.getenv("JOBS_UPLOAD_DIR", "data/uploads")
+    JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+    # A running job of another host not updated for this long is considered orphaned and re-queued at startup
+    # (on this host, jobs of an earlier run or of a dead worker process are re-queued at once)
+    JOBS_STALE_SECONDS = float(os.getenv("JOBS_STALE_SECONDS", "300"))
 
 settings = Settings()
@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -21,11 +23,24 @@ from fastapi.responses import FileResponse
 # Include API Router
 app.include_router(api_router, prefix="/api")
 
+from app.core.config import settings
 from app.services.bm25_service import bm25_service
+from app.services.vector_store import get_vector_store
+from app.services.jobs import job_queue
 
 @app.on_event("startup")
 async def startup_event():
-    bm25_service.initialize_from_db()
+    vector_store = get_vector_store()
+    if settings.BM25_WARMUP == "background":
+        # Serve traffic from the local snapshot while the indexes catch up with the DB
+        loop = asyncio.get_running_loop()
+        app.state.bm25_warmup = loop.run_in_executor(None, bm25_service.initialize_from_db)
+        app.state.vector_warmup = loop.run_in_executor(None, vector_store.initialize_from_db)
+    else:
+        bm25_service.initialize_from_db()
+        vector_store.initialize_from_db()
+    # Uploads interrupted by a restart continue where they stopped
+    job_queue.recover()
 
 # Mount static files (Frontend)
 # Try to find the frontend directory (assuming it's in ../frontend_new relative to backend/)
@@ -0,0 +1,127 @@
+"""
+Semantic cache of pipeline answers.
+
+A new question is answered from the cache when it matches a previous one
+either exactly after normalization (diacritics, letter variants, punctuation,
+spacing) or by cosine similarity of the query embeddings above
+ANSWER_CACHE_THRESHOLD. Every entry belongs to a corpus version: ingesting
+new chunks calls invalidate(), and a BM25 manifest rewritten by another
+worker changes the version too, so answers never outlive the corpus they
+were built from.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.tokenizer import Tokenizer
+
+# Normalization and tokenization only: stopwords can change the question ("لا", "ما")
+_query_tokenizer = Tokenizer("answer-cache", stem=False, stopwords=False, intern=False)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(_query_tokenizer(query.lower()))
+
+
+def _corpus_version():
+    from app.services.bm25_service import INDEX_DIR
+    from app.services.bm25_store import manifest_mtime
+    return manifest_mtime(INDEX_DIR)
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 1000, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries = OrderedDict()  # normalized query -> (unit embedding or None, result)
+        self._matrix = None            # stacked embeddings of _keys, rebuilt lazily
+        self._keys = []
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self._version = None
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    def version(self):
+        """Current corpus version; pass it back to store() to drop answers built before an ingestion."""
+        return (self._invalidations, _corpus_version())
+
+    def _check_version(self):
+        version = self.version()
+        if version != self._version:
+            self._entries.clear()
+            self._matrix = None
+            self._version = version
+
+    def _hit(self, key: str, query: str) -> dict:
+        self._entries.move_to_end(key)
+        return {**self._entries[key][1], "query": query}
+
+    def get(self, query: str):
+        """Exact match on the normalized query."""
+        key = normalize_query(query)
+        with self._lock:
+            self._check_version()
+            if key in self._entries:
+                self.hits_exact += 1
+                return self._hit(key, query)
+        return None
+
+    def find_similar(self, query: str, embedding):
+        """Closest previous query by cosine similarity, if above the threshold."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        with self._lock:
+            self._check_version()
+            if self._matrix is None:
+                self._keys = [key for key, (emb, _) in self._entries.items() if emb is not None]
+                self._matrix = (np.stack([self._entries[key][0] for key in self._keys])
+                                if self._keys else np.empty((0, len(vector)), dtype=np.float32))
+            if norm and len(self._keys) and self._matrix.shape[1] == len(vector):
+                similarities = self._matrix @ (vector / norm)
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.hits_semantic += 1
+                    return self._hit(self._keys[best], query)
+            self.misses += 1
+        return None
+
+    def store(self, query: str, embedding, result: dict, version=None):
+        key = normalize_query(query)
+        unit = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            unit = vector / norm if norm else None
+        with self._lock:
+            self._check_version()
+            if version is not None and version != self._version:
+                return
+            self._entries[key] = (unit, dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self):
+        with self._lock:
+            self._invalidations += 1
+            self._check_version()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "misses": self.misses,
+            }
+
+
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    threshold=settings.ANSWER_CACHE_THRESHOLD,
+)
@@ -0,0 +1,546 @@
+"""
+Incremental inverted-index BM25 engine.
+
+Scores are computed exactly like rank_bm25.BM25Okapi (same k1/b/epsilon and
+IDF floor), but documents can be appended in O(new tokens) and removed
+without rebuilding the whole index.
+
+The index is a list of immutable, memory-mapped segments (see bm25_store)
+followed by an in-memory tail that receives new documents until save().
+"""
+import math
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services import bm25_store
+from app.services.bm25_store import DiskSegment
+from app.services.chunk_registry import ChunkColumns
+
+# Adjacent segments are merged on save() once there are more than this many
+MAX_SEGMENTS = 8
+
+
+class MemorySegment:
+    """Mutable segment holding the documents added since the last save()."""
+
+    def __init__(self, base: int):
+        self.base = base
+        self.terms = {}              # term -> (doc ids array, term frequencies array)
+        self.doc_len = array("I")
+        self.columns = ChunkColumns()  # texts, chunk ids and metadata
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def chunk_ids(self):
+        return self.columns.chunk_ids
+
+    @property
+    def document_ids(self):
+        return self.columns.document_ids
+
+    def append(self, tokens: List[str], text: str, metadata: dict, chunk_id: int) -> Counter:
+        doc_id = self.base + len(self.doc_len)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            postings = self.terms.get(term)
+            if postings is None:
+                postings = self.terms[term] = (array("I"), array("I"))
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+        self.doc_len.append(len(tokens))
+        self.columns.append(text, metadata, chunk_id)
+        return counts
+
+    def remove_postings(self, doc_id: int, terms: Iterable[str]):
+        for term in terms:
+            postings = self.terms.get(term)
+            if postings is None:
+                continue
+            docs, tfs = postings
+            pos = bisect_left(docs, doc_id)
+            if pos < len(docs) and docs[pos] == doc_id:
+                del docs[pos]
+                del tfs[pos]
+        # The text stays in the append-only buffer until the next save()
+
+    def postings(self, term: str):
+        postings = self.terms.get(term)
+        if not postings or not postings[0]:
+            return None
+        return np.frombuffer(postings[0], dtype=np.uint32), np.frombuffer(postings[1], dtype=np.uint32)
+
+    def items(self):
+        for term, (docs, tfs) in self.terms.items():
+            yield term, np.frombuffer(docs, dtype=np.uint32), np.frombuffer(tfs, dtype=np.uint32)
+
+    def doc_lengths(self) -> np.ndarray:
+        return np.frombuffer(self.doc_len, dtype=np.uint32)
+
+    def text(self, local_id: int) -> str:
+        return self.columns.text(local_id)
+
+    def metadata(self, local_id: int) -> dict:
+        return self.columns.metadata(local_id)
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self.segments = []           # DiskSegment list ordered by base doc id
+        self.tail = MemorySegment(0)
+        self.doc_freq = {}           # term -> number of live docs containing it
+        self.deleted = bytearray()   # doc id -> 1 if removed
+
+        self.num_docs = 0            # live documents
+        self.total_len = 0           # live tokens
+        self.info = {}               # free-form values persisted in the manifest (e.g. tokenizer)
+        self.directory = None
+        self.generation = 0          # generation of the manifest this index was opened from / saved as
+        self._manifest_mtime = None
+        self._removed = {}           # chunk id -> terms of saved docs removed since then (replayed by _rebase)
+        self._average_idf = None     # cached, invalidated on every mutation
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        """Number of doc id slots (including removed documents)."""
+        return self.tail.base + len(self.tail)
+
+    def memory_usage(self) -> int:
+        """Approximate heap size in bytes (term dictionaries, unsaved postings, tables); mapped files excluded."""
+        size = sys.getsizeof(self.doc_freq) + sum(sys.getsizeof(term) for term in self.doc_freq)
+        size += sys.getsizeof(self.deleted)
+        for segment in self.segments:
+            size += sys.getsizeof(segment.term_index)
+        tail = self.tail
+        size += sys.getsizeof(tail.terms)
+        size += sum(sys.getsizeof(docs) + sys.getsizeof(tfs) for docs, tfs in tail.terms.values())
+        size += sys.getsizeof(tail.doc_len) + tail.columns.nbytes()
+        return size
+
+    def mapped_bytes(self) -> int:
+        """Size of the memory-mapped segment files."""
+        return sum(segment.nbytes for segment in self.segments)
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.num_docs if self.num_docs else 0.0
+
+    def _locate(self, doc_id: int):
+        """Returns (segment, local id) holding a doc id."""
+        if doc_id >= self.tail.base:
+            return self.tail, doc_id - self.tail.base
+        i = bisect_right([s.base for s in self.segments], doc_id) - 1
+        segment = self.segments[i]
+        return segment, doc_id - segment.base
+
+    def text(self, doc_id: int) -> str:
+        segment, local = self._locate(doc_id)
+        return segment.text(local)
+
+    def metadata(self, doc_id: int) -> dict:
+        segment, local = self._locate(doc_id)
+        return segment.metadata(local)
+
+    def chunk_id(self, doc_id: int) -> int:
+        segment, local = self._locate(doc_id)
+        return int(segment.chunk_ids[local])
+
+    def is_deleted(self, doc_id: int) -> bool:
+        return bool(self.deleted[doc_id])
+
+    def find_document(self, document_id: int) -> List[int]:
+        """Live doc ids belonging to a source document."""
+        with self._lock:
+            found = []
+            for segment in self.segments + [self.tail]:
+                ids = np.asarray(segment.document_ids)
+                found.extend(int(i) + segment.base for i in np.nonzero(ids == document_id)[0])
+            return [doc_id for doc_id in found if not self.deleted[doc_id]]
+
+    def chunk_table(self):
+        """(chunk ids, document ids) of every live doc, as int64 arrays ordered by doc id."""
+        with self._lock:
+            segments = self.segments + [self.tail]
+            chunk_ids = np.concatenate([np.array(s.chunk_ids, dtype=np.int64) for s in segments])
+            document_ids = np.concatenate([np.array(s.document_ids, dtype=np.int64) for s in segments])
+            live = np.frombuffer(self.deleted, dtype=np.uint8) == 0
+            return chunk_ids[live], document_ids[live]
+
+    def chunk_slots(self):
+        """(chunk ids, doc ids) of every live doc that has a chunk id, for ChunkRegistry."""
+        with self._lock:
+            segments = self.segments + [self.tail]
+            chunk_ids = np.concatenate([np.array(s.chunk_ids, dtype=np.int64) for s in segments])
+            slots = np.arange(len(chunk_ids), dtype=np.int64)
+            keep = (np.frombuffer(self.deleted, dtype=np.uint8) == 0) & (chunk_ids >= 0)
+            return chunk_ids[keep], slots[keep]
+
+    def add(self, tokenized_docs: Iterable[List[str]], texts: Iterable[str] = None,
+            metadatas: Iterable[dict] = None, chunk_ids: Iterable[int] = None) -> List[int]:
+        """Appends documents and returns their doc ids."""
+        with self._lock:
+            texts = iter(texts) if texts is not None else None
+            metadatas = iter(metadatas) if metadatas is not None else None
+            chunk_ids = iter(chunk_ids) if chunk_ids is not None else None
+            new_ids = []
+            for tokens in tokenized_docs:
+                doc_id = len(self)
+                counts = self.tail.append(
+                    tokens,
+                    next(texts) if texts is not None else "",
+                    next(metadatas) if metadatas is not None else {},
+                    next(chunk_ids) if chunk_ids is not None else -1,
+                )
+                for term in counts:
+                    self.doc_freq[term] = self.doc_freq.get(term, 0) + 1
+                self.deleted.append(0)
+                self.num_docs += 1
+                self.total_len += len(tokens)
+                new_ids.append(doc_id)
+            self._average_idf = None
+            return new_ids
+
+    def remove(self, doc_ids: List[int], tokenized_docs: Iterable[List[str]]):
+        """
+        Removes documents from the index.
+        `tokenized_docs` must be the tokens the documents were indexed with,
+        so only their own postings and document frequencies are touched.
+        Documents in saved segments are tombstoned and dropped on the next merge.
+        """
+        with self._lock:
+            for doc_id, tokens in zip(doc_ids, tokenized_docs):
+                if doc_id >= len(self) or self.deleted[doc_id]:
+                    continue
+                terms = set(tokens)
+                for term in terms:
+                    if self.doc_freq.get(term, 0) > 0:
+                        self.doc_freq[term] -= 1
+                segment, local = self._locate(doc_id)
+                if segment is self.tail:
+                    self.tail.remove_postings(doc_id, terms)
+                elif int(segment.chunk_ids[local]) >= 0:
+                    self._removed[int(segment.chunk_ids[local])] = terms
+                self.deleted[doc_id] = 1
+                self.num_docs -= 1
+                self.total_len -= int(segment.doc_lengths()[local])
+            self._average_idf = None
+
+    def _average_idf_value(self) -> float:
+        if self._average_idf is None:
+            df = np.fromiter(self.doc_freq.values(), dtype=np.float64, count=len(self.doc_freq))
+            df = df[df > 0]
+            if len(df) == 0:
+                self._average_idf = 0.0
+            else:
+                idf = np.log(self.num_docs - df + 0.5) - np.log(df + 0.5)
+                self._average_idf = float(idf.mean())
+        return self._average_idf
+
+    def idf(self, term: str) -> float:
+        """IDF with the BM25Okapi epsilon floor for very common terms."""
+        df = self.doc_freq.get(term, 0)
+        if df == 0:
+            return 0.0
+        value = math.log(self.num_docs - df + 0.5) - math.log(df + 0.5)
+        if value < 0:
+            value = self.epsilon * self._average_idf_value()
+        return value
+
+    def _postings(self, term: str):
+        """Live (doc ids, term frequencies, doc lengths) of a term across all segments, ascending by doc id."""
+        deleted = np.frombuffer(self.deleted, dtype=np.uint8)
+        pieces = []
+        for segment in self.segments + [self.tail]:
+            found = segment.postings(term)
+            if found is None:
+                continue
+            docs, tfs = found
+            if segment is not self.tail:
+                live = deleted[docs] == 0
+                if not live.all():
+                    docs, tfs = docs[live], tfs[live]
+            pieces.append((docs, tfs, segment.doc_lengths()[docs - segment.base]))
+        if not pieces:
+            return None
+        if len(pieces) == 1:
+            return pieces[0]
+        return tuple(np.concatenate(column) for column in zip(*pieces))
+
+    def _term_scores(self, weight: float, tfs: np.ndarray, dl: np.ndarray) -> np.ndarray:
+        k1, b = self.k1, self.b
+        tf = tfs.astype(np.float64)
+        norm = k1 * (1 - b + b * dl / self.avgdl)
+        return weight * (tf * (k1 + 1) / (tf + norm))
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        """BM25 score of every doc id for the query (removed docs score 0)."""
+        with self._lock:
+            scores = np.zeros(len(self))
+            if not self.num_docs:
+                return scores
+            for term in query_tokens:
+                idf = self.idf(term)
+                if idf == 0.0:
+                    continue
+                docs, tfs, dl = self._postings(term)
+                scores[docs] += self._term_scores(idf, tfs, dl)
+            return scores
+
+    def top_k(self, query_tokens: List[str], k: int = 5, mode: str = "sparse") -> List[Tuple[int, float]]:
+        """
+        Returns the k best (doc id, score) pairs with a positive score, best first.
+
+        Only the postings of the query terms are read, so the cost follows the
+        document frequency of the query terms rather than the corpus size.
+        mode="maxscore" additionally skips full scans of low-impact terms
+        (typically very common words) once they can no longer change the top k.
+        """
+        with self._lock:
+            if not self.num_docs or k <= 0:
+                return []
+
+            terms = []
+            for term, count in Counter(query_tokens).items():
+                idf = self.idf(term)
+                postings = self._postings(term) if idf != 0.0 else None
+                if postings is not None:
+                    terms.append((count * idf,) + postings)
+            if not terms:
+                return []
+
+            maxscore = mode == "maxscore" and all(t[0] > 0 for t in terms)
+            if maxscore:
+                # Highest-impact terms first; tf / (tf + norm) < 1 bounds each term by weight * (k1 + 1)
+                terms.sort(key=lambda t: t[0], reverse=True)
+                remaining = np.cumsum([t[0] * (self.k1 + 1) for t in terms][::-1])[::-1]
+
+            acc = self._accumulator()
+            touched = []
+            candidates = None
+            threshold = 0.0
+            for i, (weight, docs, tfs, dl) in enumerate(terms):
+                if maxscore and touched and remaining[i] <= threshold:
+                    # No unseen doc can reach the current k-th score any more:
+                    # only probe this term's postings for docs already scored.
+                    if candidates is None:
+                        candidates = np.unique(np.concatenate(touched))
+                    pos = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                    pos = pos[docs[pos] == candidates]
+                    docs, tfs, dl = docs[pos], tfs[pos], dl[pos]
+                else:
+                    touched.append(docs)
+                    candidates = None
+                acc[docs] += self._term_scores(weight, tfs, dl)
+                if maxscore and len(docs) >= k:
+                    # k-th best partial score of distinct docs is a lower bound of the final k-th score
+                    threshold = max(threshold, np.partition(acc[docs], -k)[-k])
+
+            docs = np.concatenate(touched)
+            scores = acc[docs]
+            acc[docs] = 0.0
+            # A doc appears once per matching term, so the k distinct best are among the k * len(touched) best
+            limit = k * len(touched)
+            if len(scores) > limit:
+                part = np.argpartition(-scores, limit - 1)[:limit]
+                docs, scores = docs[part], scores[part]
+            docs, first = np.unique(docs, return_index=True)
+            scores = scores[first]
+
+            positive = scores > 0
+            docs, scores = docs[positive], scores[positive]
+            order = np.argsort(-scores, kind="stable")[:k]
+            return [(int(docs[i]), float(scores[i])) for i in order]
+
+    def _accumulator(self) -> np.ndarray:
+        """Zeroed score buffer sized to the doc ids, reused across queries (callers reset touched slots)."""
+        acc = getattr(self, "_acc", None)
+        if acc is None or len(acc) < len(self):
+            acc = np.zeros(max(len(self), 1024) * 2)
+            self._acc = acc
+        return acc
+
+    # --- Persistence -----------------------------------------------------
+
+    def save(self, directory: str, replace: bool = False):
+        """
+        Flushes the in-memory tail as a new segment, merges small segments,
+        writes the tombstones and atomically swaps the manifest.
+        Only new data is written; existing segments are left untouched.
+
+        Runs under the directory's inter-process lock. If another process
+        saved since this index was opened (or last saved), the changes made
+        here are replayed on top of its index first (see _rebase), so
+        concurrent writers never drop each other's chunks. `replace` skips
+        that and overwrites the directory (full rebuilds).
+        """
+        with self._lock, bm25_store.directory_lock(directory):
+            os.makedirs(directory, exist_ok=True)
+            if directory != self.directory and self.segments:
+                raise ValueError("Cannot save an index with on-disk segments into another directory")
+            on_disk = bm25_store.manifest_generation(directory)
+            if not replace and on_disk and (directory != self.directory or on_disk != self.generation):
+                self._rebase(directory)
+            else:
+                # Never reuse an existing generation (file names derive from it)
+                self.generation = max(self.generation, on_disk)
+            self.generation += 1
+            gen = self.generation
+
+            if len(self.tail):
+                path = os.path.join(directory, f"seg-{gen:06d}.bin")
+                self._write_segment(path, [self.tail])
+                self.segments.append(DiskSegment(path))
+                self.tail = MemorySegment(len(self))
+
+            merge = 0
+            while len(self.segments) > MAX_SEGMENTS:
+                sizes = [len(a) + len(b) for a, b in zip(self.segments, self.segments[1:])]
+                i = sizes.index(min(sizes))
+                merge += 1
+                path = os.path.join(directory, f"seg-{gen:06d}-{merge}.bin")
+                self._write_segment(path, self.segments[i:i + 2])
+                self.segments[i:i + 2] = [DiskSegment(path)]
+
+            deleted_file = None
+            if any(self.deleted):
+                deleted_file = f"deleted-{gen:06d}.bin"
+                bm25_store.atomic_write(os.path.join(directory, deleted_file), [bytes(self.deleted)])
+
+            segment_files = [os.path.basename(s.path) for s in self.segments]
+            bm25_store.write_manifest(directory, {
+                "generation": gen,
+                "k1": self.k1, "b": self.b, "epsilon": self.epsilon,
+                "num_slots": len(self),
+                "segments": segment_files,
+                "deleted": deleted_file,
+                "info": self.info,
+            })
+            self.directory = directory
+            self._manifest_mtime = bm25_store.manifest_mtime(directory)
+            self._removed = {}
+            bm25_store.remove_unreferenced(directory, set(segment_files) | {deleted_file})
+
+    def _tail_documents(self):
+        """(tokens, text, metadata, chunk id) of the live tail docs; tokens rebuilt from the tail postings."""
+        tail = self.tail
+        counts = [Counter() for _ in range(len(tail))]
+        for term, docs, tfs in tail.items():
+            for doc_id, tf in zip(docs.tolist(), tfs.tolist()):
+                counts[doc_id - tail.base][term] = tf
+        for local, terms in enumerate(counts):
+            if not self.deleted[tail.base + local]:
+                yield list(terms.elements()), tail.text(local), tail.metadata(local), int(tail.chunk_ids[local])
+
+    def _rebase(self, directory: str):
+        """
+        Moves the unsaved changes of this index (tail docs, removals of saved
+        docs) onto the index another process saved in `directory`, and adopts
+        it. Chunks are matched by chunk id: a tail chunk already there is not
+        added twice. Doc ids change, so callers must not keep them across a save.
+        """
+        base = BM25Index._open(directory)
+        segments = base.segments + [base.tail]
+        chunk_ids = np.concatenate([np.asarray(s.chunk_ids, dtype=np.int64) for s in segments])
+        live = np.frombuffer(base.deleted, dtype=np.uint8) == 0
+
+        removed = np.fromiter(self._removed, dtype=np.int64, count=len(self._removed))
+        doc_ids = np.flatnonzero(live & np.isin(chunk_ids, removed))
+        base.remove(doc_ids.tolist(), [self._removed[int(chunk_ids[i])] for i in doc_ids])
+
+        present = set(chunk_ids[live].tolist())
+        added = [doc for doc in self._tail_documents() if doc[3] < 0 or doc[3] not in present]
+        if added:
+            tokens, texts, metadatas, ids = zip(*added)
+            base.add(tokens, texts, metadatas, ids)
+        print(f"🔀 BM25 index was saved by another process (generation {base.generation}): "
+              f"replaying {len(added)} new and {len(doc_ids)} removed chunks on top of it")
+
+        for name in ("segments", "tail", "doc_freq", "deleted", "num_docs", "total_len",
+                     "directory", "generation", "_manifest_mtime"):
+            setattr(self, name, getattr(base, name))
+        self.info = {**base.info, **self.info}
+        self._average_idf = None
+        self._acc = None
+
+    def _write_segment(self, path: str, segments: list):
+        """Writes the live content of consecutive segments as one segment file."""
+        deleted = np.frombuffer(self.deleted, dtype=np.uint8)
+        terms = {}
+        for segment in segments:
+            for term, docs, tfs in segment.items():
+                live = deleted[docs] == 0
+                docs, tfs = docs[live], tfs[live]
+                if len(docs):
+                    terms.setdefault(term, []).append((docs, tfs))
+        terms = {
+            term: (np.concatenate([d for d, _ in parts]), np.concatenate([t for _, t in parts]))
+            for term, parts in terms.items()
+        }
+        doc_len, columns = [], ChunkColumns()
+        for segment in segments:
+            doc_len.append(np.array(segment.doc_lengths()))
+            for local in range(len(segment)):
+                chunk_id = int(segment.chunk_ids[local])
+                if self.deleted[segment.base + local]:
+                    columns.append("", {}, chunk_id)
+                else:
+                    columns.append(segment.text(local), segment.metadata(local), chunk_id)
+        bm25_store.write_segment(path, segments[0].base, np.concatenate(doc_len), terms, columns)
+
+    @classmethod
+    def open(cls, directory: str) -> Optional["BM25Index"]:
+        """Opens a saved index (memory-mapped). Returns None if the directory has no manifest."""
+        with bm25_store.directory_lock(directory, shared=True):
+            return cls._open(directory)
+
+    @classmethod
+    def _open(cls, directory: str) -> Optional["BM25Index"]:
+        manifest = bm25_store.read_manifest(directory)
+        if manifest is None:
+            return None
+        index = cls(k1=manifest["k1"], b=manifest["b"], epsilon=manifest["epsilon"])
+        index.info = manifest.get("info", {})
+        index.directory = directory
+        index.generation = manifest["generation"]
+        index._manifest_mtime = bm25_store.manifest_mtime(directory)
+        index.segments = [DiskSegment(os.path.join(directory, name)) for name in manifest["segments"]]
+
+        num_slots = manifest["num_slots"]
+        index.deleted = bytearray(num_slots)
+        if manifest.get("deleted"):
+            with open(os.path.join(directory, manifest["deleted"]), "rb") as f:
+                stored = f.read()
+            index.deleted[:len(stored)] = stored
+        index.tail = MemorySegment(num_slots)
+
+        deleted = np.frombuffer(index.deleted, dtype=np.uint8)
+        for segment in index.segments:
+            live = deleted[segment.base:segment.base + len(segment)] == 0
+            index.num_docs += int(live.sum())
+            index.total_len += int(segment.doc_len[live].sum())
+            counts = np.diff(segment.post_offsets).astype(np.int64)
+            if not live.all() and len(segment.post_docs):
+                live_postings = live[segment.post_docs - segment.base].astype(np.int64)
+                counts = np.add.reduceat(live_postings, segment.post_offsets[:-1].astype(np.int64))
+            doc_freq = index.doc_freq
+            for term, count in zip(segment.term_index, counts.tolist()):
+                doc_freq[term] = doc_freq.get(term, 0) + count
+        return index
+
+    def is_stale(self) -> bool:
+        """True when another process has saved a newer manifest to this index's directory."""
+        if self.directory is None:
+            return False
+        return bm25_store.manifest_mtime(self.directory) != self._manifest_mtime
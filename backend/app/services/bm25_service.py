@@ -1,139 +1,249 @@
 import pickle
 import os
-from rank_bm25 import BM25Okapi
-from typing import List, Tuple
+import threading
+from typing import List, Optional
 
-from app.services.database import get_supabase
+import numpy as np
+
+from app.core.config import settings
+from app.services.bm25_index import BM25Index
+from app.services.database import PAGE_SIZE, fetch_all, get_supabase
+from app.services.term_expansion import TermExpansion
+from app.services.tokenizer import get_tokenizer
+
+INDEX_DIR = "data/bm25_index"
+LEGACY_INDEX_FILE = "data/bm25_index.pkl"
+CHUNK_COLUMNS = "id,document_id,content,metadata"
+
+
+def _chunk_columns(chunks: list):
+    """Splits `chunk` rows into (texts, metadatas, chunk ids) for the index."""
+    corpus = [chunk['content'] for chunk in chunks]
+    metadatas = [{**(chunk['metadata'] or {}), "document_id": chunk['document_id']} for chunk in chunks]
+    chunk_ids = [chunk['id'] for chunk in chunks]
+    return corpus, metadatas, chunk_ids
 
-INDEX_FILE = "data/bm25_index.pkl"
 
 class BM25Service:
     def __init__(self):
-        self.bm25 = None
-        self.corpus = [] # List of texts (chunks)
-        self.metadatas = [] # List of metadata corresponding to chunks
+        self.bm25 = None # BM25Index: postings plus chunk texts, metadata and chunk ids
+        self.expansion = None # TermExpansion: related terms for local query expansion
+        self.tokenizer = get_tokenizer()
+        self.ready = threading.Event() # Set once the startup sync with the DB has finished
+        self.replace_on_save = False # Next save overwrites the index on disk (rebuild) instead of merging into it
         # Try to load from disk first (for local dev speed), but we will also support DB init
         self.load_index()
 
     def initialize_from_db(self):
         """
-        Fetches all chunks from Supabase and builds the BM25 index in-memory.
+        Brings the local index in line with Supabase.
+        If a local snapshot exists, only the difference is fetched (see sync_with_db);
+        otherwise every chunk is fetched and the index is built from scratch.
         Crucial for cloud deployments (stateless).
         """
-        print("🔄 Building BM25 index from database...")
+        self.ready.clear()
         try:
-            supabase = get_supabase()
-            
-            all_chunks = []
-            page_size = 1000
-            start = 0
-            
-            print(f"🔄 Fetching chunks from DB in batches of {page_size}...")
-            
-            while True:
-                end = start + page_size - 1
-                response = supabase.table("chunk").select("content,metadata").range(start, end).execute()
-                
-                batch = response.data
-                if not batch:
-                    break
-                
-                all_chunks.extend(batch)
-                print(f"   - Fetched batch {start}-{end} (Total: {len(all_chunks)})")
-                
-                if len(batch) < page_size:
-                    break
-                    
-                start += page_size
-            
-            if not all_chunks:
-                print("⚠️ No chunks found in database. BM25 index will be empty.")
+            if self.bm25 is not None and len(self.bm25) and self.sync_with_db():
                 return
-
-            chunks = all_chunks
-            corpus = [chunk['content'] for chunk in chunks]
-            metadatas = [chunk['metadata'] for chunk in chunks]
-            
-            print(f"✅ Fetched TOTAL {len(corpus)} chunks from DB. Building index...")
-            
-            # Build index
-            tokenized_corpus = [doc.split(" ") for doc in corpus]
-            self.bm25 = BM25Okapi(tokenized_corpus)
-            self.corpus = corpus
-            self.metadatas = metadatas
-            
-            # Save to disk (optional, but good for local cache if persistence is enabled)
-            self.save_index()
-            print("✅ BM25 index built successfully.")
-            
+            self.rebuild_from_db()
         except Exception as e:
             print(f"❌ Error building BM25 from DB: {e}")
+        finally:
+            self.ready.set()
+
+    def rebuild_from_db(self):
+        """Fetches all chunks from Supabase and rebuilds the index."""
+        print("🔄 Building BM25 index from database...")
+        supabase = get_supabase()
+        print(f"🔄 Fetching chunks from DB in batches of {PAGE_SIZE}...")
+        chunks = fetch_all(lambda: supabase.table("chunk").select(CHUNK_COLUMNS))
+
+        if not chunks:
+            print("⚠️ No chunks found in database. BM25 index will be empty.")
+            return
+
+        print(f"✅ Fetched TOTAL {len(chunks)} chunks from DB. Building index...")
+        
+        # Build index (written as a fresh segment; the old files are dropped once the manifest is swapped)
+        self.build_index(*_chunk_columns(chunks))
+        print("✅ BM25 index built successfully.")
+
+    def sync_with_db(self) -> bool:
+        """
+        Validates the local snapshot against the database and applies only the delta:
+        - documents deleted from the DB are removed locally,
+        - documents whose local chunk count differs from `documents.total_chunks` are re-fetched,
+        - chunks with an id above the local watermark (max chunk id) are appended.
+        Returns False when the snapshot cannot be validated (e.g. it has no chunk ids)
+        and a full rebuild is needed.
+        """
+        chunk_ids, document_ids = self.bm25.chunk_table()
+        if len(chunk_ids) and chunk_ids.min() < 0:
+            print("⚠️ Local BM25 snapshot has no chunk ids, full rebuild needed.")
+            return False
+        watermark = int(chunk_ids.max()) if len(chunk_ids) else 0
+        local_docs, local_counts = np.unique(document_ids, return_counts=True)
+        local_counts = dict(zip(local_docs.tolist(), local_counts.tolist()))
+
+        supabase = get_supabase()
+        db_counts = {
+            row['id']: row['total_chunks']
+            for row in fetch_all(lambda: supabase.table("documents").select("id,total_chunks"))
+        }
+
+        removed = [doc for doc in local_counts if doc not in db_counts]
+        stale = [doc for doc, count in local_counts.items() if doc in db_counts and db_counts[doc] != count]
+        for document_id in removed + stale:
+            self.remove_document(document_id, save=False)
 
-    def build_index(self, corpus: List[str], metadatas: List[dict]):
+        new_chunks = []
+        if stale:
+            new_chunks.extend(fetch_all(lambda: supabase.table("chunk").select(CHUNK_COLUMNS).in_("document_id", stale)))
+        stale_set = set(stale)
+        new_chunks.extend(
+            chunk for chunk in fetch_all(lambda: supabase.table("chunk").select(CHUNK_COLUMNS).gt("id", watermark))
+            if chunk['document_id'] not in stale_set
+        )
+
+        if new_chunks:
+            self.add_documents(*_chunk_columns(new_chunks))
+        elif removed or stale:
+            self.save_index()
+        print(f"✅ BM25 index synced: +{len(new_chunks)} chunks, "
+              f"{len(removed)} documents removed, {len(stale)} re-fetched (watermark id {watermark}).")
+        return True
+
+    def tokenize(self, text: str) -> List[str]:
+        return self.tokenizer(text)
+
+    def _new_index(self) -> BM25Index:
+        index = BM25Index()
+        index.info["tokenizer"] = self.tokenizer.name
+        return index
+
+    def build_index(self, corpus: List[str], metadatas: List[dict], chunk_ids: Optional[List[int]] = None):
         """Builds and saves the BM25 index."""
-        tokenized_corpus = [doc.split(" ") for doc in corpus]
-        self.bm25 = BM25Okapi(tokenized_corpus)
-        self.corpus = corpus
-        self.metadatas = metadatas
+        index = self._new_index()
+        index.add((self.tokenize(doc) for doc in corpus), corpus, metadatas, chunk_ids)
+        self.bm25 = index
+        self.replace_on_save = True
         self.save_index()
 
-    def add_documents(self, new_corpus: List[str], new_metadatas: List[dict]):
-        """Adds new documents to the existing index and rebuilds it."""
-        # Extend existing data
-        self.corpus.extend(new_corpus)
-        self.metadatas.extend(new_metadatas)
-        
-        # Rebuild index with all data
-        tokenized_corpus = [doc.split(" ") for doc in self.corpus]
-        self.bm25 = BM25Okapi(tokenized_corpus)
+    def add_documents(self, new_corpus: List[str], new_metadatas: List[dict], chunk_ids: Optional[List[int]] = None,
+                      save: bool = True):
+        """Appends new documents to the index (only the new chunks are tokenized and written)."""
+        if self.bm25 is None:
+            self.bm25 = self._new_index()
+        self.bm25.add((self.tokenize(doc) for doc in new_corpus), new_corpus, new_metadatas, chunk_ids)
         
         # Save updated index
-        self.save_index()
+        if save:
+            self.save_index()
+
+    def remove_document(self, document_id, save: bool = True) -> int:
+        """Removes every chunk of a document from the index. Returns the number of chunks removed."""
+        if self.bm25 is None:
+            return 0
+        doc_ids = self.bm25.find_document(document_id)
+        if not doc_ids:
+            return 0
+        self.bm25.remove(doc_ids, [self.tokenize(self.bm25.text(i)) for i in doc_ids])
+        if save:
+            self.save_index()
+        return len(doc_ids)
+
+    def clear(self):
+        """Drops the in-memory index; the next save replaces the one on disk."""
+        self.bm25 = None
+        self.expansion = None
+        self.replace_on_save = True
 
     def save_index(self):
-        """Saves the index and corpus to disk."""
-        os.makedirs(os.path.dirname(INDEX_FILE), exist_ok=True)
-        with open(INDEX_FILE, "wb") as f:
-            pickle.dump({
-                "bm25": self.bm25,
-                "corpus": self.corpus,
-                "metadatas": self.metadatas
-            }, f)
+        """
+        Flushes new chunks to a new on-disk segment and swaps the manifest
+        (merged with whatever another process saved meanwhile, unless rebuilding).
+        """
+        self.bm25.save(INDEX_DIR, replace=self.replace_on_save)
+        self.replace_on_save = False
+        self.refresh_expansion()
+
+    def refresh_expansion(self, force: bool = False):
+        """
+        Rebuilds the query expansion table when local expansion is enabled and the
+        number of live chunks changed by QUERY_EXPANSION_REBUILD_RATIO since it was built.
+        """
+        if self.bm25 is None or not self.bm25.num_docs:
+            return
+        if not force:
+            if settings.QUERY_EXPANSION not in ("local", "hybrid"):
+                return
+            built = self.expansion.num_docs if self.expansion is not None else 0
+            if built and abs(self.bm25.num_docs - built) < settings.QUERY_EXPANSION_REBUILD_RATIO * built:
+                return
+        index = self.bm25
+        try:
+            expansion = TermExpansion.build(
+                lambda: (index.text(i) for i in range(len(index)) if not index.is_deleted(i)),
+                min_df=settings.QUERY_EXPANSION_MIN_DF,
+            )
+            expansion.save(INDEX_DIR)
+            self.expansion = expansion
+        except Exception as e:
+            print(f"❌ Error building the query expansion table: {e}")
+
+    def expansion_terms(self, query: str, limit: int = None) -> List[str]:
+        """Corpus terms related to the query (empty until the expansion table is built)."""
+        if self.expansion is None:
+            return []
+        return self.expansion.expand(query, limit or settings.QUERY_EXPANSION_TERMS)
 
     def load_index(self):
-        """Loads the index from disk if it exists."""
-        if os.path.exists(INDEX_FILE):
-            try:
-                with open(INDEX_FILE, "rb") as f:
+        """Opens the memory-mapped index if it exists, migrating a legacy pickle if needed."""
+        try:
+            index = BM25Index.open(INDEX_DIR)
+            if index is not None:
+                if index.info.get("tokenizer") != self.tokenizer.name:
+                    print(f"🔄 BM25 index was built with tokenizer '{index.info.get('tokenizer')}', re-tokenizing...")
+                    self._rebuild_from(index)
+                else:
+                    self.bm25 = index
+                    self.expansion = TermExpansion.load(INDEX_DIR)
+            elif os.path.exists(LEGACY_INDEX_FILE):
+                print("🔄 Migrating legacy BM25 pickle to the segment format...")
+                with open(LEGACY_INDEX_FILE, "rb") as f:
                     data = pickle.load(f)
-                    self.bm25 = data["bm25"]
-                    self.corpus = data["corpus"]
-                    self.metadatas = data.get("metadatas", [])
-            except Exception as e:
-                print(f"Error loading BM25 index: {e}")
+                self.build_index(data["corpus"], data.get("metadatas", []))
+                os.remove(LEGACY_INDEX_FILE)
+        except Exception as e:
+            print(f"Error loading BM25 index: {e}")
+
+    def _rebuild_from(self, old: BM25Index):
+        live = [i for i in range(len(old)) if not old.is_deleted(i)]
+        self.build_index(
+            [old.text(i) for i in live],
+            [old.metadata(i) for i in live],
+            [old.chunk_id(i) for i in live],
+        )
 
-    def search(self, query: str, top_k: int = 5) -> List[Tuple[str, float, dict]]:
+    def search(self, query: str, top_k: int = 5, with_ids: bool = False) -> List[tuple]:
         """
         Search the corpus using BM25.
-        Returns a list of (chunk, score, metadata) tuples.
+        Returns a list of (chunk, score, metadata) tuples, or
+        (chunk id, chunk, score, metadata) with `with_ids` (-1 when unknown).
         """
+        if self.bm25 is not None and self.bm25.is_stale() and not len(self.bm25.tail):
+            # Another worker saved new segments: pick them up (segments are shared via mmap)
+            self.bm25 = BM25Index.open(INDEX_DIR)
+            self.expansion = TermExpansion.load(INDEX_DIR)
         if not self.bm25:
             return []
 
-        tokenized_query = query.split(" ")
-        # Get scores for all documents
-        scores = self.bm25.get_scores(tokenized_query)
-        
-        # Pair scores with docs and metadata
-        results = []
-        for i, score in enumerate(scores):
-            if score > 0:
-                results.append((self.corpus[i], score, self.metadatas[i] if i < len(self.metadatas) else {}))
-        
-        # Sort by score descending
-        results.sort(key=lambda x: x[1], reverse=True)
-        
-        return results[:top_k]
+        tokenized_query = self.tokenize(query)
+        hits = self.bm25.top_k(tokenized_query, top_k, mode=settings.BM25_SEARCH_MODE)
+
+        if with_ids:
+            return [(self.bm25.chunk_id(i), self.bm25.text(i), score, self.bm25.metadata(i)) for i, score in hits]
+        return [(self.bm25.text(i), score, self.bm25.metadata(i)) for i, score in hits]
 
 # Global instance
 bm25_service = BM25Service()
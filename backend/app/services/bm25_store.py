@@ -0,0 +1,246 @@
+"""
+Versioned on-disk format for the BM25 index.
+
+An index directory holds immutable segment files plus a small JSON manifest:
+
+    manifest.json          format version, BM25 parameters, live segment list
+    seg-000007.bin         one segment per flush: term dictionary, postings,
+                           doc lengths, chunk-id table, texts and metadata
+    deleted-000007.bin     tombstone bitmap, one byte per doc id
+
+Segments are opened with mmap, so startup only parses the term dictionary and
+all uvicorn workers share the same page cache. Files are never modified in
+place: they are written under a temporary name and renamed, and the manifest
+is swapped last, so readers always see a consistent index.
+
+Several processes (uvicorn workers, bulk ingest, rebuild_database.py) may
+write the same directory. Writers hold an exclusive lock on `index.lock`
+(fcntl) while they save, and readers a shared one while they open: a writer
+re-reads the manifest generation under the lock and, when another process
+saved since it opened its index, replays its own changes on top of that
+index instead of overwriting it (see BM25Index.save / VectorIndex.save).
+
+write_sections/SectionFile and the manifest helpers are format-agnostic and
+also back the local vector index (vector_index.py).
+"""
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, a single writer process is assumed
+    fcntl = None
+
+import numpy as np
+
+from app.services.chunk_registry import ColumnsView, read_filenames
+
+FORMAT = "nibrasse-bm25"
+FORMAT_VERSION = 2
+MAGIC = b"NBM25SEG"
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "index.lock"
+
+_PREAMBLE = struct.Struct("<8sII")  # magic, version, header length
+
+
+def _pad(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def atomic_write(path: str, chunks):
+    """Writes bytes-like chunks to a temporary file, fsyncs it and renames it over `path`."""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def encode_blob(items):
+    """Concatenates byte strings into (offsets uint64[n + 1], blob uint8)."""
+    offsets = np.zeros(len(items) + 1, dtype=np.uint64)
+    np.cumsum([len(item) for item in items], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(items), dtype=np.uint8)
+
+
+def write_segment(path: str, base: int, doc_len, terms: dict, columns):
+    """
+    Writes one immutable segment.
+    `terms` maps term -> (doc ids, term frequencies); doc ids are global and ascending.
+    `columns` is the ChunkColumns table of the segment's chunks (texts and metadata).
+    """
+    names = sorted(term for term, (docs, _) in terms.items() if len(docs))
+    term_offsets, term_blob = encode_blob([name.encode("utf-8") for name in names])
+    post_offsets = np.zeros(len(names) + 1, dtype=np.uint64)
+    np.cumsum([len(terms[name][0]) for name in names], out=post_offsets[1:])
+    if names:
+        post_docs = np.concatenate([np.asarray(terms[name][0], dtype=np.uint32) for name in names])
+        post_tfs = np.concatenate([np.asarray(terms[name][1], dtype=np.uint32) for name in names])
+    else:
+        post_docs = post_tfs = np.empty(0, dtype=np.uint32)
+    write_sections(path, MAGIC, FORMAT_VERSION, {"base": base, "num_docs": len(doc_len)}, [
+        ("term_offsets", term_offsets),
+        ("term_blob", term_blob),
+        ("post_offsets", post_offsets),
+        ("post_docs", post_docs),
+        ("post_tfs", post_tfs),
+        ("doc_len", np.asarray(doc_len, dtype=np.uint32)),
+        *columns.sections(),
+    ])
+
+
+def write_sections(path: str, magic: bytes, version: int, header: dict, sections):
+    """
+    Writes a file of named, 8-byte aligned NumPy arrays after a JSON header
+    (atomically). SectionFile maps it back.
+    """
+    layout = {}
+    offset = 0
+    for name, data in sections:
+        layout[name] = [offset, data.dtype.str, len(data)]
+        offset = _pad(offset + data.nbytes)
+    header = json.dumps({**header, "sections": layout}).encode("utf-8")
+
+    def chunks():
+        yield _PREAMBLE.pack(magic, version, len(header))
+        yield header + b"\0" * (_pad(len(header)) - len(header))
+        for _, data in sections:
+            yield data.tobytes()
+            yield b"\0" * (_pad(data.nbytes) - data.nbytes)
+
+    atomic_write(path, chunks())
+
+
+class SectionFile:
+    """Read-only, memory-mapped view of a file written by write_sections: one array attribute per section."""
+
+    MAGIC = MAGIC
+    VERSION = FORMAT_VERSION
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not a {self.MAGIC.decode()} file")
+        if version != self.VERSION:
+            raise ValueError(f"{path} has format v{version}, expected v{self.VERSION}")
+        start = _PREAMBLE.size
+        self.header = json.loads(self._mmap[start:start + header_len])
+        data_start = start + _pad(header_len)
+        for name, (offset, dtype, count) in self.header["sections"].items():
+            setattr(self, name, np.frombuffer(self._mmap, dtype=dtype, count=count, offset=data_start + offset))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._mmap)
+
+
+def blob_item(offsets, blob, i: int) -> bytes:
+    start, end = int(offsets[i]), int(offsets[i + 1])
+    return blob[start:end].tobytes()
+
+
+class DiskSegment(SectionFile, ColumnsView):
+    """Read-only, memory-mapped view of a segment file."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.base = self.header["base"]
+        self.num_docs = self.header["num_docs"]
+
+        raw = self.term_blob.tobytes()
+        bounds = self.term_offsets.tolist()
+        self.term_index = {raw[bounds[i]:bounds[i + 1]].decode("utf-8"): i for i in range(len(bounds) - 1)}
+        self.filenames = read_filenames(self.filename_offsets, self.filename_blob)
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def postings(self, term: str):
+        i = self.term_index.get(term)
+        if i is None:
+            return None
+        start, end = int(self.post_offsets[i]), int(self.post_offsets[i + 1])
+        return self.post_docs[start:end], self.post_tfs[start:end]
+
+    def items(self):
+        """Yields (term, doc ids, term frequencies) for every term in the segment."""
+        offsets = self.post_offsets
+        for term, i in self.term_index.items():
+            start, end = int(offsets[i]), int(offsets[i + 1])
+            yield term, self.post_docs[start:end], self.post_tfs[start:end]
+
+    def doc_lengths(self) -> np.ndarray:
+        return self.doc_len
+
+
+def manifest_generation(directory: str) -> int:
+    """Generation of the manifest in `directory` (0 if none), whatever its format version."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+            return int(json.load(f).get("generation", 0))
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def read_manifest(directory: str, fmt: str = FORMAT, version: int = FORMAT_VERSION):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != fmt or manifest.get("version") != version:
+        raise ValueError(f"Unsupported index format in {directory}: "
+                         f"{manifest.get('format')} v{manifest.get('version')}, expected {fmt} v{version}")
+    return manifest
+
+
+def write_manifest(directory: str, manifest: dict, fmt: str = FORMAT, version: int = FORMAT_VERSION):
+    manifest = {"format": fmt, "version": version, **manifest}
+    atomic_write(os.path.join(directory, MANIFEST_FILE),
+                 [json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")])
+
+
+@contextmanager
+def directory_lock(directory: str, shared: bool = False):
+    """
+    Inter-process lock on an index directory: exclusive for a save, shared to
+    open the manifest and its files without a concurrent save deleting them.
+    flock locks open files, so threads of one process exclude each other too.
+    """
+    if fcntl is None or (shared and not os.path.isdir(directory)):
+        yield
+        return
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a+b") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def manifest_mtime(directory: str):
+    try:
+        return os.stat(os.path.join(directory, MANIFEST_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def remove_unreferenced(directory: str, referenced: set):
+    """Deletes segment/tombstone files no longer listed in the manifest."""
+    for name in os.listdir(directory):
+        if name.startswith(("seg-", "deleted-")) and ".tmp-" not in name and name not in referenced:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                # Still mapped by another process on Windows; the next save retries
+                pass
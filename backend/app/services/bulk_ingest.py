@@ -0,0 +1,262 @@
+"""
+Bulk ingestion of many text files (used by rebuild_database.py).
+
+    files --(process pool: decode + chunk)--> chunked documents
+          --(thread pool: rate-limited, retried embedding batches)--> embedded chunks
+          --(writer thread: inserts of `insert_batch` rows, across files)--> Supabase
+          --> BM25 / local vector index in memory, saved once at the end
+
+Chunking is CPU-bound and runs in worker processes. The embedding workers
+share one RateLimiter, so raising their number never exceeds the provider
+quota. Only a bounded window of files and batches is in flight at a time.
+Like uploads, a run is idempotent by content: unchanged files are skipped,
+stored chunk embeddings are reused by hash, and with `replace` a
+re-ingested file replaces the previous documents with the same filename
+(by default documents sharing a filename are kept). A document is created with
+total_chunks=0 and only gets its count once its last chunk is stored, so
+a file is never skipped as unchanged while its chunks are missing. When a
+run fails, the documents it left incomplete are deleted before the error
+is raised.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, List
+
+from app.core.config import settings
+from app.services import ingestion
+from app.services.concurrency import RateLimiter, retry
+from app.services.database import (
+    delete_all_documents, find_document_by_hash, insert_document_record, update_document_total_chunks,
+)
+
+
+def chunk_file(path: str) -> dict:
+    """Decodes and chunks one file (runs in a worker process)."""
+    start = time.perf_counter()
+    chars = 0
+
+    def counted(pieces):
+        nonlocal chars
+        for piece in pieces:
+            chars += len(piece)
+            yield piece
+
+    with open(path, "rb") as f:
+        file_content_hash = ingestion.file_hash(f)
+        chunks = list(ingestion.iter_chunks(counted(ingestion.iter_text(f))))
+    return {
+        "filename": os.path.basename(path),
+        "content_hash": file_content_hash,
+        "chars": chars,
+        "chunks": chunks,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def chunked_files(paths: List[str], processes: int) -> Iterator[tuple]:
+    """Yields (path, chunk_file result or exception) in order, at most 2 * processes files ahead."""
+    if not processes:
+        for path in paths:
+            try:
+                yield path, chunk_file(path)
+            except Exception as e:
+                yield path, e
+        return
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        window = deque()
+        paths = iter(paths)
+        for path in paths:
+            window.append((path, pool.submit(chunk_file, path)))
+            if len(window) >= 2 * processes:
+                break
+        while window:
+            path, future = window.popleft()
+            try:
+                yield path, future.result()
+            except Exception as e:
+                yield path, e
+            next_path = next(paths, None)
+            if next_path is not None:
+                window.append((next_path, pool.submit(chunk_file, next_path)))
+
+
+def bulk_ingest(paths: List[str], processes: int = None, embed_workers: int = None,
+                requests_per_minute: float = None, insert_batch: int = 500, reset: bool = False,
+                replace: bool = False) -> dict:
+    """
+    Ingests `paths` as one document each and returns the run statistics
+    (see format_report). With `reset`, the chunk/documents tables and the
+    local indexes are emptied first. With `replace`, the documents stored
+    before the run under the filename of an ingested file are removed.
+    """
+    from app.services.bm25_service import bm25_service
+    from app.services.vector_store import get_vector_store
+
+    processes = os.cpu_count() if processes is None else processes
+    embed_workers = max(1, embed_workers or settings.INGEST_EMBED_CONCURRENCY)
+    limiter = RateLimiter(settings.INGEST_EMBED_RPM if requests_per_minute is None else requests_per_minute,
+                          burst=embed_workers)
+    vector_store = get_vector_store()
+    stats = {
+        "files": 0, "failed_files": 0, "unchanged_files": 0, "chars": 0, "chunks": 0, "embedding_requests": 0,
+        "embeddings": 0, "embeddings_reused": 0, "inserted": 0, "insert_requests": 0,
+        "chunk_seconds": 0.0, "embed_seconds": 0.0, "insert_seconds": 0.0, "index_seconds": 0.0,
+    }
+    start = time.perf_counter()
+
+    if reset:
+        print("🗑️  Clearing the chunk/documents tables and the local indexes...")
+        delete_all_documents()
+        bm25_service.clear()
+        vector_store.clear()
+    elif bm25_service.bm25 is None:
+        bm25_service.load_index()
+
+    def call(texts):
+        limiter.acquire()
+        return ingestion.get_batch_embeddings(texts)
+
+    def embed(texts):
+        began = time.perf_counter()
+        vectors, reused = ingestion.embed_chunks(
+            texts, embed=lambda missing: retry(call, missing, attempts=settings.INGEST_RETRIES,
+                                               base_delay=settings.INGEST_RETRY_DELAY))
+        return vectors, reused, time.perf_counter() - began
+
+    remaining = {}     # document_id -> chunks not stored yet
+    completed = set()  # documents of this run whose chunks are all stored
+
+    def insert(rows):
+        began = time.perf_counter()
+        ingestion.store_rows(rows)
+        for row in rows:
+            remaining[row["document_id"]] -= 1
+        for document_id in {row["document_id"] for row in rows}:
+            if not remaining[document_id]:
+                # Only now is the document complete: find_document_by_hash may skip its file
+                update_document_total_chunks(document_id, totals[document_id])
+                completed.add(document_id)
+        stats["insert_seconds"] += time.perf_counter() - began
+        stats["inserted"] += len(rows)
+        stats["insert_requests"] += 1
+        print(f"   - Inserted {stats['inserted']}/{stats['chunks']} chunks")
+
+    embed_pool = ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix="bulk-embed")
+    insert_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bulk-insert")
+    pending = deque()  # (chunk rows without embeddings, embedding future), oldest first
+    buffer = []        # embedded rows waiting for the next insert
+    inserting = None
+    ingested = []      # (document_id, filename) of the documents created by this run
+    totals = {}        # document_id -> chunk count
+
+    def submit_insert(rows):
+        nonlocal inserting
+        if inserting is not None:
+            inserting.result()  # one insert in flight, in order
+        inserting = insert_pool.submit(insert, rows)
+
+    def drain_oldest():
+        items, future = pending.popleft()
+        vectors, reused, seconds = future.result()
+        stats["embed_seconds"] += seconds
+        stats["embedding_requests"] += reused < len(vectors)
+        stats["embeddings"] += len(vectors) - reused
+        stats["embeddings_reused"] += reused
+        for (document_id, filename, chunk), vector in zip(items, vectors):
+            buffer.append(ingestion.chunk_row(document_id, filename, chunk, vector))
+        while len(buffer) >= insert_batch:
+            submit_insert(buffer[:insert_batch])
+            del buffer[:insert_batch]
+
+    try:
+        for path, result in chunked_files(paths, processes):
+            if isinstance(result, Exception):
+                print(f"❌ {path}: {result}")
+                stats["failed_files"] += 1
+                continue
+            stats["files"] += 1
+            stats["chars"] += result["chars"]
+            stats["chunk_seconds"] += result["seconds"]
+            chunks = result["chunks"]
+            if not chunks:
+                print(f"⚠️ {path}: no text, skipped")
+                continue
+            existing = None if reset else find_document_by_hash(result["content_hash"])
+            if existing is not None:
+                print(f"⏭️  {result['filename']} is unchanged (document {existing['id']}), skipped")
+                stats["unchanged_files"] += 1
+                continue
+            stats["chunks"] += len(chunks)
+            document_id = insert_document_record(result["filename"], 0, result["content_hash"])['id']
+            ingested.append((document_id, result["filename"]))
+            totals[document_id] = remaining[document_id] = len(chunks)
+            print(f"📄 [{stats['files']}/{len(paths)}] {result['filename']}: {len(chunks)} chunks (document {document_id})")
+
+            for batch in ingestion.batches(chunks, settings.INGEST_EMBED_BATCH):
+                items = [(document_id, result["filename"], chunk) for chunk in batch]
+                pending.append((items, embed_pool.submit(embed, [chunk['text'] for chunk in batch])))
+                while len(pending) >= 2 * embed_workers:
+                    drain_oldest()
+        while pending:
+            drain_oldest()
+        if buffer:
+            submit_insert(list(buffer))
+            buffer.clear()
+        if inserting is not None:
+            inserting.result()
+    except Exception as e:
+        for _, future in pending:
+            future.cancel()
+        insert_pool.shutdown(wait=True)  # no insert may land after the cleanup
+        partial = [document_id for document_id, _ in ingested if document_id not in completed]
+        print(f"❌ Bulk ingestion stopped ({e}), removing {len(partial)} incomplete document(s): {partial}")
+        for document_id in partial:
+            ingestion.remove_document(document_id)
+        ingested = [(document_id, filename) for document_id, filename in ingested if document_id in completed]
+        save_indexes(bm25_service, vector_store, ingested, replace and not reset)
+        raise
+    finally:
+        for _, future in pending:
+            future.cancel()
+        embed_pool.shutdown(wait=True)
+        insert_pool.shutdown(wait=True)
+
+    began = time.perf_counter()
+    save_indexes(bm25_service, vector_store, ingested, replace and not reset)
+    stats["index_seconds"] = time.perf_counter() - began
+    stats["wall_seconds"] = time.perf_counter() - start
+    return stats
+
+
+def save_indexes(bm25_service, vector_store, ingested: list, replace: bool):
+    """With `replace`, removes the previous versions of the stored documents, then saves the local indexes once."""
+    if replace:
+        # Files of this run that share a filename do not replace each other
+        run_ids = {document_id for document_id, _ in ingested}
+        for document_id, filename in ingested:
+            ingestion.replace_previous_versions(document_id, filename, keep=run_ids)
+
+    # One BM25 segment (and one vector segment) for the whole run
+    if bm25_service.bm25 is not None:
+        bm25_service.save_index()
+    vector_store.save()
+
+
+def format_report(stats: dict) -> str:
+    wall = stats["wall_seconds"] or 1e-9
+    lines = [
+        f"Files:       {stats['files']} ({stats['failed_files']} failed, {stats['unchanged_files']} unchanged), "
+        f"{stats['chars']:,} characters",
+        f"Chunks:      {stats['chunks']:,} chunked, {stats['inserted']:,} inserted in {stats['insert_requests']} requests",
+        f"Embeddings:  {stats['embeddings']:,} in {stats['embedding_requests']} requests, "
+        f"{stats['embeddings_reused']:,} reused by chunk hash",
+        f"Wall time:   {stats['wall_seconds']:.1f}s",
+        f"Throughput:  {stats['files'] / wall:.2f} files/s, {stats['inserted'] / wall:.1f} chunks/s, "
+        f"{stats['embeddings'] / wall:.1f} embeddings/s",
+        f"Stage time:  chunking {stats['chunk_seconds']:.1f}s (summed over processes), "
+        f"embedding {stats['embed_seconds']:.1f}s (summed over workers), "
+        f"inserts {stats['insert_seconds']:.1f}s, index save {stats['index_seconds']:.1f}s",
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,236 @@
+"""
+Compact chunk storage shared by the retrieval indexes.
+
+ChunkColumns keeps chunk texts in one UTF-8 buffer addressed by offsets and
+the chunk metadata in typed columns (document id, chunk index, page number,
+flags, filename id into a per-table list of interned filenames), instead of
+one str plus one dict per chunk. Keys outside that schema, or values that do
+not fit it, are kept as a small JSON side blob. The same columns are written
+into the BM25 segment files and read back through mmap (ColumnsView).
+
+ChunkRegistry maps Supabase chunk ids to BM25 doc slots, so vector search and
+fusion can carry integer ids and resolve text/metadata only for the few
+chunks that are returned.
+"""
+import json
+import sys
+import threading
+from array import array
+from typing import List, Optional
+
+import numpy as np
+
+# flags bits: which schema keys are present, plus has_page_marker's value
+HAS_DOCUMENT_ID = 1
+HAS_CHUNK_INDEX = 2
+HAS_FILENAME = 4
+HAS_PAGE = 8
+HAS_MARKER = 16
+MARKER_TRUE = 32
+PAGE_EMPTY = 64
+
+SCHEMA_KEYS = ("document_id", "chunk_index", "filename", "page_number", "has_page_marker")
+
+
+def _int_value(value) -> Optional[int]:
+    # Only values that round-trip exactly are stored as columns
+    if isinstance(value, int) and not isinstance(value, bool) and -2**31 < value < 2**31:
+        return value
+    return None
+
+
+def _page_value(value):
+    if value == "":
+        return "empty"
+    if isinstance(value, str) and value.isdigit() and str(int(value)) == value and int(value) < 2**31:
+        return int(value)
+    return None
+
+
+class ColumnsView:
+    """
+    Read access shared by the in-memory columns and their memory-mapped copy.
+    Expects text_offsets/text_blob, document_ids, chunk_index, page, flags,
+    filename_ids, extra_offsets/extra_blob and a `filenames` list.
+    """
+
+    def text(self, i: int) -> str:
+        start, end = int(self.text_offsets[i]), int(self.text_offsets[i + 1])
+        return bytes(memoryview(self.text_blob)[start:end]).decode("utf-8")
+
+    def metadata(self, i: int) -> dict:
+        flags = int(self.flags[i])
+        meta = {}
+        if flags & HAS_DOCUMENT_ID:
+            meta["document_id"] = int(self.document_ids[i])
+        if flags & HAS_CHUNK_INDEX:
+            meta["chunk_index"] = int(self.chunk_index[i])
+        if flags & HAS_FILENAME:
+            meta["filename"] = self.filenames[int(self.filename_ids[i])]
+        if flags & HAS_PAGE:
+            meta["page_number"] = "" if flags & PAGE_EMPTY else str(int(self.page[i]))
+        if flags & HAS_MARKER:
+            meta["has_page_marker"] = bool(flags & MARKER_TRUE)
+        start, end = int(self.extra_offsets[i]), int(self.extra_offsets[i + 1])
+        if end > start:
+            meta.update(json.loads(bytes(memoryview(self.extra_blob)[start:end])))
+        return meta
+
+    def filename(self, i: int) -> Optional[str]:
+        return self.filenames[int(self.filename_ids[i])] if int(self.flags[i]) & HAS_FILENAME else None
+
+
+class ChunkColumns(ColumnsView):
+    """Append-only chunk table held in typed arrays."""
+
+    def __init__(self):
+        self.text_blob = bytearray()
+        self.text_offsets = array("Q", [0])
+        self.chunk_ids = array("q")
+        self.document_ids = array("q")
+        self.chunk_index = array("i")
+        self.page = array("i")
+        self.flags = bytearray()
+        self.filename_ids = array("i")
+        self.filenames: List[str] = []
+        self._filename_ids = {}
+        self.extra_blob = bytearray()
+        self.extra_offsets = array("Q", [0])
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    def _filename_id(self, name: str) -> int:
+        fid = self._filename_ids.get(name)
+        if fid is None:
+            fid = self._filename_ids[name] = len(self.filenames)
+            self.filenames.append(sys.intern(name))
+        return fid
+
+    def append(self, text: str, metadata: dict, chunk_id: int = -1):
+        metadata = metadata or {}
+        flags = 0
+        extra = {key: value for key, value in metadata.items() if key not in SCHEMA_KEYS}
+
+        document_id = _int_value(metadata.get("document_id"))
+        if document_id is not None:
+            flags |= HAS_DOCUMENT_ID
+        elif "document_id" in metadata:
+            extra["document_id"] = metadata["document_id"]
+            try:
+                # Still index the chunk under its document (e.g. an id sent as a string)
+                document_id = int(metadata["document_id"])
+            except (TypeError, ValueError):
+                pass
+
+        chunk_index = _int_value(metadata.get("chunk_index"))
+        if chunk_index is not None:
+            flags |= HAS_CHUNK_INDEX
+        elif "chunk_index" in metadata:
+            extra["chunk_index"] = metadata["chunk_index"]
+
+        filename = metadata.get("filename")
+        if isinstance(filename, str):
+            flags |= HAS_FILENAME
+        elif "filename" in metadata:
+            extra["filename"] = filename
+
+        page = _page_value(metadata.get("page_number"))
+        if page is not None:
+            flags |= HAS_PAGE | (PAGE_EMPTY if page == "empty" else 0)
+        elif "page_number" in metadata:
+            extra["page_number"] = metadata["page_number"]
+
+        marker = metadata.get("has_page_marker")
+        if isinstance(marker, bool):
+            flags |= HAS_MARKER | (MARKER_TRUE if marker else 0)
+        elif "has_page_marker" in metadata:
+            extra["has_page_marker"] = marker
+
+        self.text_blob += text.encode("utf-8")
+        self.text_offsets.append(len(self.text_blob))
+        self.chunk_ids.append(chunk_id)
+        self.document_ids.append(document_id if document_id is not None else -1)
+        self.chunk_index.append(chunk_index if chunk_index is not None else -1)
+        self.page.append(page if isinstance(page, int) else -1)
+        self.flags.append(flags)
+        self.filename_ids.append(self._filename_id(filename) if flags & HAS_FILENAME else -1)
+        if extra:
+            self.extra_blob += json.dumps(extra, ensure_ascii=False).encode("utf-8")
+        self.extra_offsets.append(len(self.extra_blob))
+
+    def sections(self):
+        """(name, array) sections for bm25_store.write_sections."""
+        from app.services.bm25_store import encode_blob
+        filename_offsets, filename_blob = encode_blob([name.encode("utf-8") for name in self.filenames])
+        return [
+            ("chunk_ids", np.frombuffer(self.chunk_ids, dtype=np.int64)),
+            ("document_ids", np.frombuffer(self.document_ids, dtype=np.int64)),
+            ("chunk_index", np.frombuffer(self.chunk_index, dtype=np.int32)),
+            ("page", np.frombuffer(self.page, dtype=np.int32)),
+            ("flags", np.frombuffer(self.flags, dtype=np.uint8)),
+            ("filename_ids", np.frombuffer(self.filename_ids, dtype=np.int32)),
+            ("filename_offsets", filename_offsets),
+            ("filename_blob", filename_blob),
+            ("text_offsets", np.frombuffer(self.text_offsets, dtype=np.uint64)),
+            ("text_blob", np.frombuffer(bytes(self.text_blob), dtype=np.uint8)),
+            ("extra_offsets", np.frombuffer(self.extra_offsets, dtype=np.uint64)),
+            ("extra_blob", np.frombuffer(bytes(self.extra_blob), dtype=np.uint8)),
+        ]
+
+    def nbytes(self) -> int:
+        arrays = (self.text_offsets, self.chunk_ids, self.document_ids, self.chunk_index,
+                  self.page, self.filename_ids, self.extra_offsets)
+        return (len(self.text_blob) + len(self.flags) + len(self.extra_blob)
+                + sum(a.itemsize * len(a) for a in arrays))
+
+
+def read_filenames(offsets: np.ndarray, blob: np.ndarray) -> List[str]:
+    raw = blob.tobytes()
+    bounds = offsets.tolist()
+    return [sys.intern(raw[bounds[i]:bounds[i + 1]].decode("utf-8")) for i in range(len(bounds) - 1)]
+
+
+class ChunkRegistry:
+    """
+    Chunk id -> BM25 doc slot, over the index currently held by `get_index`
+    (rebuilt lazily whenever that index changes). Lookups are a searchsorted
+    on a sorted int64 array rather than a dict keyed by chunk text.
+    """
+
+    def __init__(self, get_index):
+        self._get_index = get_index
+        self._key = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._slots = np.empty(0, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def _table(self):
+        index = self._get_index()
+        if index is None:
+            return None, self._ids, self._slots
+        # A save can rebase the index onto another process's copy (new doc ids): the generation changes too
+        key = (id(index), index.generation, len(index), index.num_docs)
+        with self._lock:
+            if key != self._key:
+                ids, slots = index.chunk_slots()
+                order = np.argsort(ids, kind="stable")
+                self._ids, self._slots, self._key = ids[order], slots[order], key
+            return index, self._ids, self._slots
+
+    def slots(self, chunk_ids) -> np.ndarray:
+        """BM25 doc slot of each chunk id, -1 when the chunk is unknown."""
+        _, ids, slots = self._table()
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        if not len(ids):
+            return np.full(len(chunk_ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(ids, chunk_ids), len(ids) - 1)
+        return np.where(ids[pos] == chunk_ids, slots[pos], -1)
+
+    def get(self, chunk_id: int):
+        """(text, metadata) of a chunk, or None if it is not in the index."""
+        index, _, _ = self._table()
+        slot = int(self.slots([chunk_id])[0])
+        if index is None or slot < 0:
+            return None
+        return index.text(slot), index.metadata(slot)
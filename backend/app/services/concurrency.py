@@ -0,0 +1,136 @@
+"""
+Runs the blocking pipeline stages (Gemini and Supabase calls, BM25, ingestion)
+off the event loop, with a concurrency limit per stage.
+
+The limits keep one slow dependency from taking every worker thread: e.g.
+many questions can wait on generation while embeddings and vector RPCs of
+newer questions still get threads.
+
+Every call runs inside a telemetry span named after its stage, in a copy of
+the caller's context so the span joins the caller's trace.
+"""
+import asyncio
+import contextvars
+import functools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import settings
+from app.services.telemetry import span
+
+executor = ThreadPoolExecutor(max_workers=settings.PIPELINE_WORKERS, thread_name_prefix="pipeline")
+
+# asyncio.Semaphore is bound to the loop it is first used on, so keep one set per loop
+_semaphores = {}
+
+
+def _semaphore(stage: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    per_loop = _semaphores.setdefault(loop, {})
+    if stage not in per_loop:
+        limit = settings.STAGE_CONCURRENCY.get(stage, settings.PIPELINE_WORKERS)
+        per_loop[stage] = asyncio.Semaphore(limit)
+    return per_loop[stage]
+
+
+def retry(func, *args, attempts: int = 3, base_delay: float = 1.0, max_delay: float = 30.0, **kwargs):
+    """
+    Calls `func(*args, **kwargs)`, retrying failures with exponential backoff
+    and jitter (base_delay, 2*base_delay, ... capped at max_delay).
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = min(max_delay, base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            print(f"⚠️ {getattr(func, '__name__', 'call')} failed ({e}), retry {attempt}/{attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by threads: on average at most `per_minute` acquire()
+    calls per minute, with bursts of up to `burst`. per_minute <= 0 disables it.
+    """
+
+    def __init__(self, per_minute: float, burst: int = 1):
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def _traced(stage: str, queued: float, func, *args, **kwargs):
+    with span(stage, queued_ms=round(queued * 1000, 3)):
+        return func(*args, **kwargs)
+
+
+def submit(stage: str, func, *args, **kwargs):
+    """executor.submit for synchronous callers: runs in a `stage` span of the caller's trace."""
+    return executor.submit(contextvars.copy_context().run, _traced, stage, 0.0, func, *args, **kwargs)
+
+
+async def run_stage(stage: str, func, *args, **kwargs):
+    """Runs `func(*args, **kwargs)` on the shared executor, at most STAGE_CONCURRENCY[stage] at a time."""
+    waiting = time.perf_counter()
+    async with _semaphore(stage):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(_traced, stage, time.perf_counter() - waiting, func, *args, **kwargs)
+        return await loop.run_in_executor(executor, contextvars.copy_context().run, call)
+
+
+async def iterate_stage(stage: str, func, *args, **kwargs):
+    """
+    Async iterator over a blocking generator `func(*args, **kwargs)` that runs on the
+    shared executor under the stage limit (e.g. a streamed Gemini response).
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+    end = object()
+
+    def produce():
+        try:
+            with span(stage):
+                for item in func(*args, **kwargs):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (end, e))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (end, None))
+
+    async with _semaphore(stage):
+        future = loop.run_in_executor(executor, contextvars.copy_context().run, produce)
+        try:
+            while True:
+                item, error = await queue.get()
+                if item is end:
+                    if error is not None:
+                        raise error
+                    break
+                yield item
+        finally:
+            # Consumer gone (e.g. client disconnected): let the producer stop early
+            stopped.set()
+        await future
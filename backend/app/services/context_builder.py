@@ -0,0 +1,178 @@
+"""
+Context assembly between reranking and generation.
+
+The reranked chunks are turned into the context of the answer prompt:
+
+1. Overlap removal: consecutive chunks of a document repeat up to
+   CHUNK_OVERLAP characters of each other. A lower-ranked chunk loses the
+   text it shares with a higher-ranked chunk of the same document, and is
+   dropped when nothing is left.
+2. Token budget: the prompt (instructions, question and sources) must fit in
+   CONTEXT_TOKEN_BUDGET estimated tokens. When the chunks do not fit, each
+   sentence is scored against the query (idf of the query terms it holds,
+   computed over the candidate sentences) and the best sentences are kept:
+   first the best one of every chunk, so no source disappears, then the rest
+   by score; a sentence repeated in several chunks is kept once. Kept
+   sentences stay in their original order and are copied verbatim, so quotes
+   remain exact; a gap is marked with "…".
+
+Everything runs locally: the tokenizer is the BM25 one and token counts are
+estimates (tokenizer.estimate_tokens).
+"""
+import math
+import re
+from typing import List, Tuple
+
+from app.core.config import settings
+from app.services.tokenizer import estimate_tokens, get_tokenizer
+
+# A sentence ends after . ! ? ؟ 。 … or at a line break
+_SENTENCE = re.compile(r"[^\n.!?؟。…]+(?:[.!?؟。…]+|$)", re.MULTILINE)
+# Shortest shared text considered an overlap rather than a coincidence
+MIN_OVERLAP = 20
+# Tokens of the "### [مصدر N: title]" header added to each source
+SOURCE_HEADER_TOKENS = 12
+GAP = " … "
+
+
+def _document_key(meta: dict):
+    meta = meta or {}
+    return meta.get("document_id") or meta.get("filename")
+
+
+def _overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of `first` that is a prefix of `second` (0 below MIN_OVERLAP)."""
+    head = second[:MIN_OVERLAP]
+    if len(head) < MIN_OVERLAP:
+        return 0
+    i = first.find(head)
+    while i != -1:
+        if second.startswith(first[i:]):
+            return len(first) - i
+        i = first.find(head, i + 1)
+    return 0
+
+
+def remove_overlap(documents: List[str], metadatas: List[dict]) -> Tuple[List[str], List[dict]]:
+    """Strips from each chunk the text it shares with a better-ranked chunk of the same document."""
+    kept_docs, kept_metas = [], []
+    for text, meta in zip(documents, metadatas):
+        key = _document_key(meta)
+        for other, other_meta in zip(kept_docs, kept_metas):
+            if key is None or _document_key(other_meta) != key:
+                continue
+            text = text[_overlap(other, text):]
+            shared = _overlap(text, other)
+            if shared:
+                text = text[:len(text) - shared]
+            if text.strip() in other:
+                text = ""
+                break
+        text = text.strip()
+        if text:
+            kept_docs.append(text)
+            kept_metas.append(meta)
+    return kept_docs, kept_metas
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """(start, end) offsets of the sentences of `text`, surrounding whitespace excluded."""
+    spans = []
+    for match in _SENTENCE.finditer(text):
+        start, end = match.span()
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            spans.append((start, end))
+    return spans
+
+
+def _normalized(sentence: str) -> str:
+    return " ".join(sentence.split())
+
+
+def compress(query: str, documents: List[str], budget: int) -> List[str]:
+    """
+    Keeps the sentences of `documents` that best match `query` within
+    `budget` tokens (SOURCE_HEADER_TOKENS per chunk included). Every chunk
+    keeps at least its best sentence; a chunk made only of sentences seen in
+    earlier chunks becomes "".
+    """
+    tokenizer = get_tokenizer()
+    query_terms = set(tokenizer(query))
+    sentences = []  # (chunk, start, end, tokens, terms)
+    seen = set()
+    for c, text in enumerate(documents):
+        for start, end in split_sentences(text):
+            normalized = _normalized(text[start:end])
+            if normalized in seen:
+                continue
+            seen.add(normalized)
+            sentences.append((c, start, end, estimate_tokens(text[start:end]), set(tokenizer(text[start:end]))))
+
+    df = {}
+    for *_, terms in sentences:
+        for term in terms & query_terms:
+            df[term] = df.get(term, 0) + 1
+    idf = {term: math.log(1 + len(sentences) / count) for term, count in df.items()}
+    # Higher score first, then better-ranked chunk, then earlier in the chunk
+    scores = [(-sum(idf[t] for t in terms & query_terms), c, start)
+              for c, start, _, _, terms in sentences]
+    order = sorted(range(len(sentences)), key=scores.__getitem__)
+
+    best_of_chunk = {}
+    for i in order:
+        best_of_chunk.setdefault(sentences[i][0], i)
+    required = set(best_of_chunk.values())
+    used = SOURCE_HEADER_TOKENS * len(best_of_chunk)
+    kept = set()
+    for i in list(best_of_chunk.values()) + order:
+        if i in kept:
+            continue
+        tokens = sentences[i][3]
+        if i not in required and used + tokens > budget:
+            continue
+        kept.add(i)
+        used += tokens
+
+    compressed = []
+    for c, text in enumerate(documents):
+        spans = sorted((sentences[i][1], sentences[i][2]) for i in kept if sentences[i][0] == c)
+        if not spans:
+            compressed.append("")
+            continue
+        parts = [text[spans[0][0]:spans[0][1]]]
+        for (_, previous_end), (start, end) in zip(spans, spans[1:]):
+            gap = text[previous_end:start]
+            # Adjacent sentences keep their original separator, a gap becomes "…"
+            parts.append((gap if not gap.strip() else GAP) + text[start:end])
+        if spans[0][0] > 0 and text[:spans[0][0]].strip():
+            parts.insert(0, GAP.lstrip())
+        if text[spans[-1][1]:].strip():
+            parts.append(GAP.rstrip())
+        compressed.append("".join(parts))
+    return compressed
+
+
+def assemble_context(query: str, documents: List[str], metadatas: List[dict],
+                     budget: int = None, overhead: int = 0) -> Tuple[List[str], List[dict]]:
+    """
+    Final context for the answer prompt: overlap removed, then compressed to
+    `budget` (default CONTEXT_TOKEN_BUDGET, 0 = no limit) minus `overhead`
+    tokens (the rest of the prompt).
+    """
+    budget = settings.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    documents, metadatas = remove_overlap(documents, metadatas)
+    if not budget:
+        return documents, metadatas
+    available = budget - overhead
+    total = sum(estimate_tokens(text) + SOURCE_HEADER_TOKENS for text in documents)
+    if total <= available:
+        return documents, metadatas
+
+    kept = [(text, meta) for text, meta in zip(compress(query, documents, available), metadatas) if text]
+    after = sum(estimate_tokens(text) + SOURCE_HEADER_TOKENS for text, _ in kept)
+    print(f"✂️  Context compressed from {total} to {after} tokens (budget {available})")
+    return [text for text, _ in kept], [meta for _, meta in kept]
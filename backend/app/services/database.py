@@ -1,21 +1,102 @@
 from supabase import create_client, Client
 from app.core.config import settings
+from app.services.telemetry import external_call
 
 _supabase = None
 
+PAGE_SIZE = 1000
+
 def get_supabase() -> Client:
     global _supabase
+    if settings.DATABASE_BACKEND == "memory":
+        # In-process tables for offline runs and benchmarks (see fakes.py)
+        from app.services.fakes import memory_database
+        return memory_database
     if _supabase is None:
         _supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
     return _supabase
 
-def insert_document_record(filename: str, total_chunks: int):
+def execute(query, operation: str):
+    """Runs a query builder, counted and timed as an external call (see telemetry)."""
+    with external_call(settings.DATABASE_BACKEND, operation):
+        return query.execute()
+
+def fetch_all(build_query, page_size: int = PAGE_SIZE) -> list:
+    """Pages through a Supabase query ordered by id, `page_size` rows at a time."""
+    rows = []
+    start = 0
+    while True:
+        batch = execute(build_query().order("id").range(start, start + page_size - 1), "fetch_page").data
+        if not batch:
+            break
+        rows.extend(batch)
+        if len(batch) < page_size:
+            break
+        start += page_size
+        print(f"   - Fetched {len(rows)} rows...")
+    return rows
+
+def insert_document_record(filename: str, total_chunks: int, content_hash: str = None):
     supabase = get_supabase()
     data = {"filename": filename, "total_chunks": total_chunks}
-    response = supabase.table("documents").insert(data).execute()
+    if content_hash:
+        data["content_hash"] = content_hash
+    response = execute(supabase.table("documents").insert(data), "insert_document")
     return response.data[0]
 
+def find_document_by_hash(content_hash: str):
+    """
+    A fully ingested document with this content hash, or None: its
+    total_chunks is set and that many chunk rows are stored (a run that
+    died between the two must not make the file look unchanged).
+    """
+    supabase = get_supabase()
+    response = execute(supabase.table("documents").select("*").eq("content_hash", content_hash)
+                       .gt("total_chunks", 0), "find_document_by_hash")
+    for document in response.data:
+        if len(fetch_document_chunks(document['id'], "id")) == document['total_chunks']:
+            return document
+    return None
+
+def find_documents_by_filename(filename: str) -> list:
+    supabase = get_supabase()
+    return execute(supabase.table("documents").select("id,content_hash").eq("filename", filename),
+                   "find_documents_by_filename").data
+
+def fetch_embeddings_by_hash(content_hashes: list[str]) -> dict:
+    """{chunk content hash: embedding} for the hashes already stored in the chunk table."""
+    supabase = get_supabase()
+    rows = execute(supabase.table("chunk").select("content_hash,embedding").in_("content_hash", content_hashes),
+                   "fetch_embeddings_by_hash").data
+    return {row['content_hash']: row['embedding'] for row in rows if row.get('embedding') is not None}
+
+def delete_all_documents():
+    """Empties the chunk and documents tables."""
+    supabase = get_supabase()
+    execute(supabase.table("chunk").delete().neq("id", 0), "delete_chunks")
+    execute(supabase.table("documents").delete().neq("id", 0), "delete_documents")
+
+def update_document_total_chunks(document_id: int, total_chunks: int):
+    supabase = get_supabase()
+    execute(supabase.table("documents").update({"total_chunks": total_chunks}).eq("id", document_id), "update_document")
+
+def delete_document_record(document_id: int):
+    """Deletes a document and its chunk rows."""
+    supabase = get_supabase()
+    execute(supabase.table("chunk").delete().eq("document_id", document_id), "delete_chunks")
+    execute(supabase.table("documents").delete().eq("id", document_id), "delete_documents")
+
+def fetch_document_chunks(document_id: int, columns: str = "*") -> list:
+    supabase = get_supabase()
+    return fetch_all(lambda: supabase.table("chunk").select(columns).eq("document_id", document_id))
+
+def delete_chunks_from(document_id: int, chunk_index: int):
+    """Deletes the chunk rows of a document from `chunk_index` on."""
+    supabase = get_supabase()
+    execute(supabase.table("chunk").delete().eq("document_id", document_id).gte("chunk_index", chunk_index),
+            "delete_chunks")
+
 def insert_chunks_records(chunks_data: list[dict]):
     supabase = get_supabase()
-    response = supabase.table("chunk").insert(chunks_data).execute()
+    response = execute(supabase.table("chunk").insert(chunks_data), "insert_chunks")
     return response.data
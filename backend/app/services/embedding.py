@@ -1,32 +1,25 @@
-import google.generativeai as genai
 from app.core.config import settings
+from app.services.embedding_cache import cache_key, embedding_cache
+from app.services.providers import get_provider
 
-_gemini_configured = False
-
-def configure_gemini():
-    global _gemini_configured
-    if not _gemini_configured:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        _gemini_configured = True
+def _embed(texts: list[str], task_type: str) -> list[list[float]]:
+    return get_provider().embed(texts, task_type)
 
 def get_embedding(text: str, is_query: bool = False) -> list[float]:
-    configure_gemini()
+    return get_batch_embeddings([text], is_query=is_query)[0]
+
+def get_batch_embeddings(texts: list[str], is_query: bool = False) -> list[list[float]]:
     # Use different task_type for queries vs documents
     task_type = "retrieval_query" if is_query else "retrieval_document"
-    result = genai.embed_content(
-        model=settings.GEMINI_EMBEDDING_MODEL,
-        content=text,
-        task_type=task_type
-    )
-    return result['embedding']
+    if not settings.EMBEDDING_CACHE:
+        return _embed(texts, task_type)
 
-def get_batch_embeddings(texts: list[str]) -> list[list[float]]:
-    configure_gemini()
-    # Gemini API supports batch embedding, but for simplicity and error handling we might loop or use batch if supported well.
-    # embed_content supports a list of content.
-    result = genai.embed_content(
-        model=settings.GEMINI_EMBEDDING_MODEL,
-        content=texts,
-        task_type="retrieval_document"
-    )
-    return result['embedding']
+    model = get_provider().embedding_model
+    keys = [cache_key(model, task_type, text) for text in texts]
+    found = embedding_cache.get_many(keys)
+    # Only embed texts not cached yet, each distinct text once
+    missing = {key: text for key, text in zip(keys, texts) if key not in found}
+    if missing:
+        vectors = _embed(list(missing.values()), task_type)
+        found.update(embedding_cache.put_many(dict(zip(missing, vectors))))
+    return [found[key] for key in keys]
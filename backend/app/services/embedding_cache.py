@@ -0,0 +1,177 @@
+"""
+Content-addressed cache for Gemini embeddings.
+
+Entries are keyed by sha256(model, task_type, text), so a repeated question,
+a re-expanded query variant or a re-uploaded file never pays for the same
+embedding twice. Two tiers:
+
+    memory   LRU of the most recently used vectors (per process)
+    disk     SQLite table of float32 blobs, shared by every worker and
+             kept across restarts; least recently used rows are evicted
+             once it holds more than `max_entries`
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.core.config import settings
+
+
+def cache_key(model: str, task_type: str, text: str) -> str:
+    h = hashlib.sha256()
+    for part in (model or "", task_type, text):
+        data = part.encode("utf-8")
+        # Length-prefix each part so ("a", "bc") and ("ab", "c") differ
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = None, memory_items: int = 10000, max_entries: int = 200000):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._disk_entries = 0
+        self._clock = 0.0
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _db(self):
+        # Opened lazily so importing the module never touches the filesystem
+        if self._conn is None and self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            self._disk_entries = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def _now(self) -> float:
+        # Strictly increasing, so LRU order is exact even within one clock tick
+        self._clock = max(time.time(), self._clock + 1e-6)
+        return self._clock
+
+    def _remember(self, key: str, vector: list[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: list[str]) -> dict:
+        """Returns {key: vector} for the keys found in either tier."""
+        found = {}
+        with self._lock:
+            missing = []
+            for key in dict.fromkeys(keys):
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                    self.hits_memory += 1
+
+            db = self._db()
+            if missing and db is not None:
+                now = self._now()
+                # Stay under SQLite's bound-parameter limit
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    marks = ",".join("?" * len(batch))
+                    rows = db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch).fetchall()
+                    if rows:
+                        db.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(rows))})",
+                                   [now, *(key for key, _ in rows)])
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                        self._remember(key, vector)
+                        found[key] = vector
+                        self.hits_disk += 1
+                db.commit()
+            self.misses += sum(1 for key in missing if key not in found)
+        return found
+
+    def put_many(self, items: dict):
+        """Stores {key: vector}; returns the vectors as they will be served from cache (float32)."""
+        stored = {key: np.asarray(vector, dtype=np.float32) for key, vector in items.items()}
+        result = {key: array.tolist() for key, array in stored.items()}
+        with self._lock:
+            for key, vector in result.items():
+                self._remember(key, vector)
+            db = self._db()
+            if db is not None and stored:
+                now = self._now()
+                db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, array.tobytes(), now) for key, array in stored.items()],
+                )
+                self._disk_entries += len(stored)
+                if self._disk_entries > self.max_entries:
+                    self._evict(db)
+                db.commit()
+        return result
+
+    def _evict(self, db):
+        # The running count over-estimates (replaced keys), so recount before deleting
+        count = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            db.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self.evictions += excess
+        self._disk_entries = min(count, self.max_entries)
+
+    def _existing_db(self):
+        # Reporting and clearing must not create the database file (e.g. /health before any embedding)
+        return self._db() if self.path and os.path.exists(self.path) else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            db = self._existing_db()
+            disk_entries = self._disk_entries if db is not None else 0
+            lookups = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_memory + self.hits_disk) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._existing_db()
+            if db is not None:
+                db.execute("DELETE FROM embeddings")
+                db.commit()
+                self._disk_entries = 0
+
+
+embedding_cache = EmbeddingCache(
+    path=settings.EMBEDDING_CACHE_PATH or None,
+    memory_items=settings.EMBEDDING_CACHE_MEMORY_ITEMS,
+    max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+)
@@ -0,0 +1,257 @@
+"""
+Retrieval evaluation against the golden dataset (see test_golden_dataset.py).
+
+Metrics
+    Relevance is binary, per source file: each question names its expected
+    source(s) in `context_file`, and a ranking is the de-duplicated filenames
+    of the reranked chunks, in rank order. recall@k, reciprocal rank (MRR
+    once averaged over the questions) and nDCG@k are computed on it.
+
+StageCache
+    Retrieval outputs (query variants, one vector list per variant, the BM25
+    list) are kept in a JSON file, keyed by the question and everything that
+    changes them: expansion mode, embedding model, vector backend, tokenizer,
+    BM25 mode, candidate count and corpus version. Fusion and the local
+    reranker then run on the cached lists, so sweeping FUSION_RRF_K, the
+    fusion weights or the candidate count replays without calling Gemini or
+    Supabase. Gemini reranker outputs are cached too, keyed by their input
+    chunks.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.fusion import fuse_results
+from app.services.providers import get_provider
+from app.services.reranker import get_reranker
+from app.services.telemetry import span, start_trace
+
+DEFAULT_KS = (1, 3, 5, 10)
+PERCENTILES = (50, 90, 95, 99)
+# Not a fusion setting, but sweepable: keep the first N hits of every cached list
+CANDIDATES = "candidates"
+
+
+# --- Metrics -----------------------------------------------------------------
+
+def expected_sources(value) -> List[str]:
+    """Expected filenames of a dataset row ("a.txt" or "a.txt; b.txt")."""
+    if not value:
+        return []
+    return [part.strip() for part in str(value).replace("|", ";").split(";") if part.strip()]
+
+
+def source_ranking(metadatas: Iterable[dict]) -> List[str]:
+    """Filenames in rank order, each kept at its best position."""
+    ranking = []
+    for meta in metadatas:
+        filename = (meta or {}).get("filename")
+        if filename and filename not in ranking:
+            ranking.append(filename)
+    return ranking
+
+
+def recall_at_k(ranking: Sequence[str], relevant: Sequence[str], k: int) -> float:
+    if not relevant:
+        return 0.0
+    return len(set(ranking[:k]) & set(relevant)) / len(set(relevant))
+
+
+def reciprocal_rank(ranking: Sequence[str], relevant: Sequence[str]) -> float:
+    for rank, source in enumerate(ranking, start=1):
+        if source in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranking: Sequence[str], relevant: Sequence[str], k: int) -> float:
+    relevant = set(relevant)
+    if not relevant:
+        return 0.0
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, source in enumerate(ranking[:k], start=1) if source in relevant)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(k, len(relevant)) + 1))
+    return dcg / ideal
+
+
+def retrieval_metrics(ranking: Sequence[str], relevant: Sequence[str], ks: Sequence[int] = DEFAULT_KS) -> Dict[str, float]:
+    metrics = {f"recall@{k}": recall_at_k(ranking, relevant, k) for k in ks}
+    metrics["mrr"] = reciprocal_rank(ranking, relevant)
+    metrics.update({f"ndcg@{k}": ndcg_at_k(ranking, relevant, k) for k in ks})
+    return metrics
+
+
+def percentiles(values: Sequence[float], qs: Sequence[int] = PERCENTILES) -> Dict[str, float]:
+    """{"p50": ..., "p90": ...} (linear interpolation), empty for no values."""
+    if not len(values):
+        return {}
+    return {f"p{q}": float(v) for q, v in zip(qs, np.percentile(np.asarray(values, dtype=float), qs))}
+
+
+# --- Stage cache ----------------------------------------------------------------
+
+class StageCache:
+    """Stage outputs by (stage, key parts) in a JSON file; `path=None` keeps them in memory only."""
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def key(stage: str, parts) -> str:
+        data = json.dumps([stage, parts], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, stage: str, parts):
+        with self._lock:
+            value = self._entries.get(self.key(stage, parts))
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def put(self, stage: str, parts, value):
+        with self._lock:
+            self._entries[self.key(stage, parts)] = value
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+
+def retrieval_fingerprint(fetch_k: int) -> list:
+    """Everything besides the question that changes the retrieval output."""
+    from app.services.answer_cache import _corpus_version
+    return [settings.QUERY_EXPANSION, settings.QUERY_EXPANSION_TERMS, get_provider().embedding_model,
+            settings.VECTOR_BACKEND, settings.TOKENIZER, settings.BM25_SEARCH_MODE, fetch_k, _corpus_version()]
+
+
+# --- Settings sweeps -------------------------------------------------------------
+
+def parse_sweep(spec: str):
+    """
+    "FUSION_RRF_K=30,60,90" -> ("FUSION_RRF_K", [30, 60, 90]), values typed like
+    the current setting. "rrf_k=..." is accepted for FUSION_RRF_K, "candidates"
+    for the candidate count.
+    """
+    name, _, values = spec.partition("=")
+    name = name.strip()
+    if not values:
+        raise ValueError(f"Invalid sweep '{spec}', expected NAME=v1,v2")
+    if name.lower() == CANDIDATES:
+        return CANDIDATES, [int(v) for v in values.split(",")]
+    for candidate in (name.upper(), f"FUSION_{name.upper()}"):
+        if hasattr(settings, candidate):
+            kind = type(getattr(settings, candidate))
+            convert = (lambda v: v.lower() in ("1", "true", "yes")) if kind is bool else kind
+            return candidate, [convert(v.strip()) for v in values.split(",")]
+    raise ValueError(f"Unknown setting '{name}'")
+
+
+@contextmanager
+def override_settings(values: dict):
+    """Sets attributes of `settings` for the duration of the block (the candidate count is not one)."""
+    values = {name: value for name, value in values.items() if name != CANDIDATES}
+    previous = {name: getattr(settings, name) for name in values}
+    for name, value in values.items():
+        setattr(settings, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(settings, name, value)
+
+
+# --- One question ------------------------------------------------------------------
+
+def cached_candidates(question: str, fetch_k: int, cache: StageCache = None, limiter=None):
+    """search_candidates(question, fetch_k), from the cache when possible."""
+    from app.services.rag import search_candidates
+
+    with span("candidates") as current:
+        parts = [question] + retrieval_fingerprint(fetch_k)
+        cached = cache.get("candidates", parts) if cache is not None else None
+        current.set_attribute("cached", cached is not None)
+        if cached is not None:
+            return cached["queries"], cached["vector"], cached["bm25"]
+        if limiter is not None:
+            limiter.acquire()
+        queries, vector_results, bm25_results = search_candidates(question, match_count=fetch_k)
+        bm25_results = [list(hit) for hit in bm25_results]
+        if cache is not None:
+            cache.put("candidates", parts, {"queries": queries, "vector": vector_results, "bm25": bm25_results})
+        return queries, vector_results, bm25_results
+
+
+def cached_rerank(question: str, ids: List[int], chunks: List[str], signals: dict, top_k: int, reranker: str = None,
+                  cache: StageCache = None, limiter=None):
+    """Reranks like the pipeline; only Gemini outputs are cached (the others are local and cheap)."""
+    reranker = get_reranker(reranker)
+    if reranker.name != "gemini":
+        return reranker.rerank(question, chunks, top_k=top_k, signals=signals, ids=ids)
+    parts = [reranker.name, settings.GEMINI_CHAT_MODEL, question, ids, chunks, top_k]
+    cached = cache.get("rerank", parts) if cache is not None else None
+    if cached is not None:
+        return [tuple(item) for item in cached]
+    if limiter is not None:
+        limiter.acquire()
+    reranked = reranker.rerank(question, chunks, top_k=top_k, signals=signals, ids=ids)
+    if cache is not None:
+        cache.put("rerank", parts, [list(item) for item in reranked])
+    return reranked
+
+
+def evaluate_question(question: str, relevant: Sequence[str], ks: Sequence[int] = DEFAULT_KS, fetch_k: int = 20,
+                      candidates: int = None, reranker: str = None, cache: StageCache = None, limiter=None,
+                      generate: bool = False) -> dict:
+    """
+    Runs the retrieval half of the pipeline on one question (the answer too
+    with `generate`) and scores its source ranking. `candidates` keeps the
+    first N hits of every retrieved list. Returns metrics, sources, answer,
+    context and the trace timings.
+    """
+    from app.services.rag import build_context, generate_answer, select_context
+
+    with start_trace("evaluation", reranker=reranker or settings.RERANKER) as trace:
+        queries, vector_results, bm25_results = cached_candidates(question, fetch_k, cache, limiter)
+        if candidates:
+            vector_results = [results[:candidates] for results in vector_results]
+            bm25_results = bm25_results[:candidates]
+        with span("fusion"):
+            top_ids, top_documents, chunk_to_meta, signals = fuse_results(vector_results, bm25_results)
+        with span("rerank"):
+            # Deep enough for the largest k; the pipeline keeps the first 5 as context
+            reranked = cached_rerank(question, top_ids, top_documents, signals, max(max(ks), 5), reranker, cache,
+                                     limiter)
+        ranking = source_ranking(chunk_to_meta.get(chunk_id, {}) for chunk_id, _, _ in reranked)
+        result = {"metrics": retrieval_metrics(ranking, relevant, ks), "sources": ranking,
+                  "queries": queries, "answer": None, "context": []}
+        if generate:
+            with span("context"):
+                documents, metadatas = build_context(question, *select_context(reranked[:5], chunk_to_meta))
+            if limiter is not None:
+                limiter.acquire()
+            with span("generate"):
+                result["answer"] = generate_answer(question, "\n\n---\n\n".join(documents), metadatas)
+            result["context"] = documents
+    result["timings"] = trace.timings()
+    return result
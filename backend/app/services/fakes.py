@@ -0,0 +1,303 @@
+"""
+Offline stand-ins for Gemini and Supabase (MODEL_PROVIDER=fake, DATABASE_BACKEND=memory).
+
+FakeProvider
+    Embeddings are hashed bags of terms: every BM25 token of a text adds ±1
+    to one of FAKE_EMBEDDING_DIM dimensions (crc32 of the token, so the same
+    text gives the same vector in every process), then the vector is
+    normalized. Texts sharing terms are close, which is enough for vector
+    search to return sensible neighbours. Answers are canned: the first
+    (marker, text) of `responses` whose marker is in the prompt, or
+    DEFAULT_ANSWER. Every call waits FAKE_LLM_LATENCY / FAKE_EMBEDDING_LATENCY
+    seconds to stand in for the network.
+
+MemoryDatabase
+    The `documents` and `chunk` tables in process memory behind the subset of
+    the Supabase query builder the services use (select/insert/update/delete,
+    eq/neq/gt/gte/lt/lte/in_, order, range, limit) and the match_documents RPC
+    (cosine similarity over the chunk embeddings, as in the migration SQL).
+
+Neither is meant for production: they exist to test and benchmark our own
+code (chunking, indexes, fusion, context assembly) without API calls or quota.
+"""
+import json
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Iterator, List
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.telemetry import external_call
+from app.services.tokenizer import get_tokenizer
+
+DEFAULT_ANSWER = "هذه إجابة تجريبية من المزوّد المحلي، مبنية على المصدر الأول. [1]"
+_WORD = re.compile(r"\S+\s*")
+
+
+@lru_cache(maxsize=1 << 18)
+def _bucket(token: str) -> int:
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def hash_embeddings(texts: List[str], dim: int) -> np.ndarray:
+    """(len(texts), dim) float32 matrix of unit-norm hashed bag-of-terms vectors."""
+    tokenizer = get_tokenizer()
+    rows, cols, signs = [], [], []
+    for row, text in enumerate(texts):
+        for token in tokenizer(text):
+            h = _bucket(token)
+            rows.append(row)
+            cols.append(h % dim)
+            signs.append(1.0 if h & 0x80000000 else -1.0)
+    flat = np.bincount(np.array(rows, dtype=np.int64) * dim + np.array(cols, dtype=np.int64),
+                       weights=np.array(signs), minlength=len(texts) * dim)
+    matrix = flat.reshape(len(texts), dim).astype(np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # A text without tokens gets a fixed unit vector rather than zeros (cosine is undefined on zero)
+    matrix[norms[:, 0] == 0, 0] = 1.0
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class FakeProvider:
+    name = "fake"
+
+    def __init__(self, responses=(), latency: float = None, embedding_latency: float = None, dim: int = None):
+        self.responses = list(responses)
+        self.latency = settings.FAKE_LLM_LATENCY if latency is None else latency
+        self.embedding_latency = settings.FAKE_EMBEDDING_LATENCY if embedding_latency is None else embedding_latency
+        self.dim = dim or settings.FAKE_EMBEDDING_DIM
+        self.calls = {"embed": 0, "generate": 0}
+
+    @property
+    def embedding_model(self) -> str:
+        return f"fake-hash-{self.dim}"
+
+    def embed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        self.calls["embed"] += 1
+        with external_call(self.name, "embed"):
+            if self.embedding_latency:
+                time.sleep(self.embedding_latency)
+            return hash_embeddings(texts, self.dim).tolist()
+
+    def answer(self, prompt: str) -> str:
+        for marker, text in self.responses:
+            if marker in prompt:
+                return text
+        return DEFAULT_ANSWER
+
+    def generate(self, prompt: str) -> str:
+        self.calls["generate"] += 1
+        with external_call(self.name, "generate"):
+            if self.latency:
+                time.sleep(self.latency)
+            return self.answer(prompt)
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        """The canned answer word by word, the latency spread over the words."""
+        self.calls["generate"] += 1
+        words = _WORD.findall(self.answer(prompt))
+        with external_call(self.name, "generate_stream"):
+            for word in words:
+                if self.latency:
+                    time.sleep(self.latency / len(words))
+                yield word
+
+
+# --- In-memory database ------------------------------------------------------
+
+_FILTERS = {
+    "eq": lambda value, arg: value == arg,
+    "neq": lambda value, arg: value != arg,
+    "gt": lambda value, arg: value is not None and value > arg,
+    "gte": lambda value, arg: value is not None and value >= arg,
+    "lt": lambda value, arg: value is not None and value < arg,
+    "lte": lambda value, arg: value is not None and value <= arg,
+    "in_": lambda value, arg: value in arg,
+}
+
+
+class MemoryQuery:
+    """One query on a MemoryDatabase table, built like a Supabase query and run by execute()."""
+
+    def __init__(self, db: "MemoryDatabase", table: str):
+        self.db = db
+        self.table_name = table
+        self.action = "select"
+        self.columns = "*"
+        self.payload = None
+        self.filters = []
+        self.ordering = None
+        self.bounds = None
+        self.max_rows = None
+
+    def select(self, columns: str = "*"):
+        self.action, self.columns = "select", columns
+        return self
+
+    def insert(self, data):
+        self.action, self.payload = "insert", data
+        return self
+
+    def update(self, data: dict):
+        self.action, self.payload = "update", data
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    def _filter(self, op: str, column: str, arg):
+        self.filters.append((op, column, tuple(arg) if op == "in_" else arg))
+        return self
+
+    def eq(self, column, value):
+        return self._filter("eq", column, value)
+
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+
+    def in_(self, column, values):
+        return self._filter("in_", column, values)
+
+    def order(self, column: str, desc: bool = False):
+        self.ordering = (column, desc)
+        return self
+
+    def range(self, start: int, end: int):
+        self.bounds = (start, end + 1)
+        return self
+
+    def limit(self, count: int):
+        self.max_rows = count
+        return self
+
+    def execute(self):
+        return SimpleNamespace(data=self.db.run(self))
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self.tables = {"documents": {}, "chunk": {}}
+        self.next_id = {"documents": 1, "chunk": 1}
+        self.versions = {"documents": 0, "chunk": 0}
+        self.lock = threading.RLock()
+        self._scan = None      # (key, rows) of the last select: fetch_all pages through the same query
+        self._vectors = None   # (chunk table version, ids, normalized embedding matrix)
+
+    def table(self, name: str) -> MemoryQuery:
+        if name not in self.tables:
+            raise ValueError(f"Unknown table '{name}'")
+        return MemoryQuery(self, name)
+
+    def clear(self):
+        with self.lock:
+            for name in self.tables:
+                self.tables[name].clear()
+                self.versions[name] += 1
+
+    def _matching(self, query: MemoryQuery) -> list:
+        key = (query.table_name, self.versions[query.table_name], tuple(query.filters), query.ordering)
+        if self._scan is not None and self._scan[0] == key:
+            return self._scan[1]
+        rows = [row for row in self.tables[query.table_name].values()
+                if all(_FILTERS[op](row.get(column), arg) for op, column, arg in query.filters)]
+        if query.ordering is not None:
+            column, desc = query.ordering
+            # Rows are kept in id order already
+            if column != "id" or desc:
+                rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        self._scan = (key, rows)
+        return rows
+
+    @staticmethod
+    def _project(row: dict, columns: str) -> dict:
+        if columns.strip() == "*":
+            return dict(row)
+        return {column: row.get(column) for column in (c.strip() for c in columns.split(","))}
+
+    def run(self, query: MemoryQuery) -> list:
+        with self.lock:
+            table = self.tables[query.table_name]
+            if query.action == "insert":
+                inserted = []
+                for data in (query.payload if isinstance(query.payload, list) else [query.payload]):
+                    row = {"id": self.next_id[query.table_name], **data}
+                    if query.table_name == "documents":
+                        row.setdefault("upload_date", datetime.now(timezone.utc).isoformat())
+                    self.next_id[query.table_name] = max(self.next_id[query.table_name], row["id"]) + 1
+                    table[row["id"]] = row
+                    inserted.append(dict(row))
+                self.versions[query.table_name] += 1
+                return inserted
+
+            rows = self._matching(query)
+            if query.action == "select":
+                if query.bounds is not None:
+                    rows = rows[query.bounds[0]:query.bounds[1]]
+                if query.max_rows is not None:
+                    rows = rows[:query.max_rows]
+                return [self._project(row, query.columns) for row in rows]
+
+            self.versions[query.table_name] += 1
+            if query.action == "update":
+                for row in rows:
+                    row.update(query.payload)
+                return [dict(row) for row in rows]
+            for row in rows:
+                del table[row["id"]]
+            return [dict(row) for row in rows]
+
+    # --- match_documents RPC ----------------------------------------------
+
+    def _vector_table(self):
+        version = self.versions["chunk"]
+        if self._vectors is None or self._vectors[0] != version:
+            rows = [row for row in self.tables["chunk"].values() if row.get("embedding") is not None]
+            ids = np.array([row["id"] for row in rows], dtype=np.int64)
+            matrix = np.array([json.loads(row["embedding"]) if isinstance(row["embedding"], str) else row["embedding"]
+                               for row in rows], dtype=np.float32).reshape(len(rows), -1 if rows else 0)
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+            self._vectors = (version, ids, matrix)
+        return self._vectors[1], self._vectors[2]
+
+    def match_documents(self, query_embedding, match_threshold: float = 0.5, match_count: int = 10) -> list:
+        with self.lock:
+            ids, matrix = self._vector_table()
+            if not len(ids):
+                return []
+            query = np.asarray(query_embedding, dtype=np.float32)
+            scores = matrix @ (query / (np.linalg.norm(query) + 1e-12))
+            candidates = np.flatnonzero(scores > match_threshold)
+            if len(candidates) > match_count:
+                candidates = candidates[np.argpartition(-scores[candidates], match_count - 1)[:match_count]]
+            candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+            chunks = self.tables["chunk"]
+            return [{"id": int(ids[i]), "content": chunks[ids[i]]["content"], "metadata": chunks[ids[i]].get("metadata"),
+                     "similarity": float(scores[i])} for i in candidates]
+
+    def rpc(self, name: str, params: dict):
+        if name != "match_documents":
+            raise ValueError(f"Unknown RPC '{name}'")
+        return SimpleNamespace(execute=lambda: SimpleNamespace(data=self.match_documents(**params)))
+
+
+memory_database = MemoryDatabase()
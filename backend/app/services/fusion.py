@@ -0,0 +1,152 @@
+"""
+Fusion of the ranked lists produced by retrieval: one vector list per query
+variant plus the BM25 list.
+
+Candidates are keyed by chunk id, so a chunk returned by several variants is
+one candidate with one rank per list (rank 1 = top of that list), instead of
+one entry per occurrence ranked by its position in the concatenated results.
+The fused candidates keep that id through reranking and context selection:
+metadata and signals are looked up by id, never by the chunk text.
+Scores are accumulated with bincount over flat (list, candidate, rank, score)
+arrays, so fusing hundreds of hits costs a few NumPy calls.
+
+Methods:
+    rrf       sum over lists of weight / (k + rank)
+    combsum   sum over lists of the min-max normalized score
+    weighted  weighted sum, per source (vector / bm25), of the best
+              normalized score across that source's lists
+"""
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+
+FUSION_METHODS = ("rrf", "combsum", "weighted")
+
+VECTOR = 0
+BM25 = 1
+
+
+def candidate_table(vector_results: List[List[dict]], bm25_results: list):
+    """
+    Flattens the ranked lists.
+    Returns (ids, texts, metadatas, hits) where ids/texts/metadatas have one
+    entry per distinct chunk (first-seen order) and hits holds the flat arrays
+    list id, source, candidate, rank and raw score.
+    """
+    ids_by_text = None
+
+    def key(chunk_id, text):
+        nonlocal ids_by_text
+        if chunk_id is not None and chunk_id >= 0:
+            return chunk_id
+        # No chunk id (legacy BM25 snapshot): join on the text of a vector hit if
+        # there is one, else a negative stand-in id. Only these rows are matched by text.
+        if ids_by_text is None:
+            ids_by_text = {}
+            for results in vector_results:
+                for res in results:
+                    if res.get('id') is not None:
+                        ids_by_text.setdefault(res['content'], res['id'])
+        return ids_by_text.setdefault(text, -1 - len(ids_by_text))
+
+    columns = {}
+    ids, texts, metadatas = [], [], []
+    list_ids, sources, candidates, ranks, scores = [], [], [], [], []
+
+    def collect(list_id, source, entries):
+        seen = set()
+        for chunk_id, text, score, meta in entries:
+            chunk_key = key(chunk_id, text)
+            if chunk_key in seen:
+                continue  # a list ranks a chunk once, at its best position
+            seen.add(chunk_key)
+            column = columns.get(chunk_key)
+            if column is None:
+                column = columns[chunk_key] = len(texts)
+                ids.append(chunk_key)
+                texts.append(text)
+                metadatas.append(meta)
+            list_ids.append(list_id)
+            sources.append(source)
+            candidates.append(column)
+            ranks.append(len(seen))
+            scores.append(score)
+
+    for list_id, results in enumerate(vector_results):
+        collect(list_id, VECTOR, ((res.get('id'), res['content'], res.get('similarity') or 0.0, res['metadata'])
+                                  for res in results))
+    collect(len(vector_results), BM25, (
+        (hit[0], hit[1], hit[2], hit[3]) if len(hit) == 4 else (None, hit[0], hit[1], hit[2])
+        for hit in bm25_results
+    ))
+
+    hits = {
+        "list": np.array(list_ids, dtype=np.int64),
+        "source": np.array(sources, dtype=np.int64),
+        "candidate": np.array(candidates, dtype=np.int64),
+        "rank": np.array(ranks, dtype=np.float64),
+        "score": np.array(scores, dtype=np.float64),
+    }
+    return ids, texts, metadatas, hits
+
+
+def _normalized_scores(hits: dict, num_lists: int) -> np.ndarray:
+    """Min-max normalizes raw scores within each list (a list with one distinct score maps to 1)."""
+    lists, score = hits["list"], hits["score"]
+    low = np.full(num_lists, np.inf)
+    high = np.full(num_lists, -np.inf)
+    np.minimum.at(low, lists, score)
+    np.maximum.at(high, lists, score)
+    span = (high - low)[lists]
+    return np.where(span > 0, (score - low[lists]) / np.where(span > 0, span, 1.0), 1.0)
+
+
+def fuse_scores(hits: dict, num_candidates: int, method: str = "rrf", k: int = 60,
+                vector_weight: float = 0.3, bm25_weight: float = 0.7) -> np.ndarray:
+    """Fused score per candidate."""
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method '{method}'. Available: {', '.join(FUSION_METHODS)}")
+    if not num_candidates:
+        return np.zeros(0)
+    weights = np.where(hits["source"] == VECTOR, vector_weight, bm25_weight)
+    if method == "rrf":
+        return np.bincount(hits["candidate"], weights=weights / (k + hits["rank"]), minlength=num_candidates)
+
+    num_lists = int(hits["list"].max()) + 1
+    normalized = _normalized_scores(hits, num_lists)
+    if method == "combsum":
+        return np.bincount(hits["candidate"], weights=normalized, minlength=num_candidates)
+
+    best = np.zeros((2, num_candidates))
+    np.maximum.at(best, (hits["source"], hits["candidate"]), normalized)
+    return vector_weight * best[VECTOR] + bm25_weight * best[BM25]
+
+
+def fuse_results(vector_results: List[List[dict]], bm25_results: list, method: str = None,
+                 top_n: int = None) -> Tuple[List[int], List[str], Dict[int, dict], Dict[int, dict]]:
+    """
+    Hybrid Search (Vector + BM25) fusion.
+    `vector_results` holds one match_documents result list per query variant,
+    `bm25_results` (chunk id, text, score, metadata) or (text, score, metadata) tuples.
+    Returns the ids and texts (parallel lists) of the top chunks for re-ranking,
+    a chunk id -> metadata map and the retrieval signals of each chunk id
+    (fusion score, best BM25 score, best vector similarity) for the reranker.
+    """
+    method = method or settings.FUSION_METHOD
+    top_n = top_n or settings.FUSION_TOP_N
+    ids, texts, metadatas, hits = candidate_table(vector_results, bm25_results)
+    fused = fuse_scores(hits, len(texts), method, settings.FUSION_RRF_K,
+                        settings.FUSION_VECTOR_WEIGHT, settings.FUSION_BM25_WEIGHT)
+
+    best_raw = np.zeros((2, len(texts)))
+    np.maximum.at(best_raw, (hits["source"], hits["candidate"]), np.maximum(hits["score"], 0.0))
+
+    # Stable: ties keep first-seen order (variants in order, then BM25)
+    order = np.argsort(-fused, kind="stable")[:top_n]
+    top_ids = [ids[i] for i in order]
+    chunk_to_meta = {ids[i]: metadatas[i] for i in order}
+    signals = {ids[i]: {"fusion": float(fused[i]), "bm25": float(best_raw[BM25, i]), "vector": float(best_raw[VECTOR, i])}
+               for i in order}
+    return top_ids, [texts[i] for i in order], chunk_to_meta, signals
@@ -1,12 +1,26 @@
+import codecs
+import hashlib
 import shutil
 import os
 import uuid
 import re
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Iterable, Iterator
 from fastapi import UploadFile, HTTPException
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from app.core.config import settings
+from app.services.concurrency import retry
+from app.services.tokenizer import TOKEN_PIECE
 from app.services.embedding import get_batch_embeddings
-# from app.services.vector_store import add_documents_to_chroma (Removed)
-from app.services.database import insert_document_record, insert_chunks_records
+from app.services.vector_store import get_vector_store
+from app.services.database import (
+    delete_chunks_from, delete_document_record, fetch_document_chunks, fetch_embeddings_by_hash,
+    find_document_by_hash, find_documents_by_filename, insert_document_record, insert_chunks_records,
+    update_document_total_chunks,
+)
 
 def extract_page_number(text: str) -> str:
     """
@@ -26,105 +40,504 @@ def extract_page_number(text: str) -> str:
             return match.group(1)
     return None
 
-def chunk_text(text: str) -> list[dict]:
+# Preferred cut points, best first; the cut is made after the separator.
+# Separators of one level are equivalent: the one closest to the limit wins.
+SEPARATORS = (("\n\n",), ("\n",), ("。",), (". ",), (" ",))
+# Token mode: sentence then clause ends, Arabic punctuation included
+SENTENCE_SEPARATORS = (
+    ("\n\n",),
+    ("\n",),
+    (". ", "؟ ", "? ", "! ", "。", "… "),
+    ("؛ ", "; ", "، ", ", ", ": "),
+    (" ",),
+)
+# Page markers written by the converters ("--- صفحة 12 (OCR) ---", "--- Page 12 ---"),
+# or a line holding only a page heading ("صفحة 12", "ص. 12"). One pass per block.
+PAGE_MARKER = re.compile(
+    r'---\s*(?:صفحة|Page|page|PAGE)\s+(\d+)\s*(?:\(OCR\)\s*)?---'
+    r'|^[ \t]*(?:صفحة\s+|ص\s*\.?\s*)(\d+)[ \t]*$',
+    re.MULTILINE,
+)
+
+def _cut(text: str, low: int, limit: int, separators=SEPARATORS) -> int:
+    """Cut point in text[low:limit]: after the last separator of the best level present."""
+    for level in separators:
+        found = [i + len(separator) for separator in level for i in (text.rfind(separator, low, limit),) if i != -1]
+        if found:
+            return max(found)
+    return limit
+
+def _overlap_start(text: str, low: int, end: int, cut: int, separators=SEPARATORS) -> int:
+    """Start of the next chunk: the first boundary after `low`, so the overlap holds whole sentences or words."""
+    for level in separators:
+        found = [i + len(separator) for separator in level for i in (text.find(separator, low, end),) if i != -1]
+        if found:
+            return min(found)
+    return cut
+
+def _strip_end(text: str, start: int, end: int) -> int:
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
+
+def split_spans(text: str, chunk_size: int = 512, overlap: int = 150) -> Iterator[tuple]:
     """
-    Split text into chunks and extract page numbers.
+    (start, end) offsets of the chunks of `text`, in one left-to-right pass.
+    Each chunk is at most `chunk_size` characters, cut at the best separator
+    in its window, and repeats up to `overlap` characters (but at most half)
+    of the previous chunk. Whitespace around chunks is excluded.
+    """
+    n = len(text)
+    start = 0
+    while start < n:
+        while start < n and text[start].isspace():
+            start += 1
+        if start >= n:
+            return
+        cut = n if n - start <= chunk_size else _cut(text, start + 1, start + chunk_size)
+        end = _strip_end(text, start, cut)
+        yield start, end
+        if cut >= n:
+            return
+        start = _overlap_start(text, max(cut - overlap, (start + cut + 1) // 2), end, cut)
+
+def token_spans(text: str, max_tokens: int = 256, overlap_tokens: int = 32) -> Iterator[tuple]:
+    """
+    Like split_spans, with sizes in estimated model tokens: each chunk holds
+    at most `max_tokens` tokens and is cut at the last paragraph, line,
+    sentence or clause end of the second half of its window, so chunks are
+    neither split mid-sentence nor much smaller than the budget. The next
+    chunk repeats about `overlap_tokens` tokens, starting at a boundary.
+    """
+    starts = [match.start() for match in TOKEN_PIECE.finditer(text)]
+    n = len(starts)
+    i = 0
+    while i < n:
+        start = starts[i]
+        j = i + max_tokens
+        if j >= n:
+            yield start, _strip_end(text, start, len(text))
+            return
+        half = starts[i + max(1, max_tokens // 2)]
+        cut = _cut(text, half, starts[j], SENTENCE_SEPARATORS)
+        end = _strip_end(text, start, cut)
+        yield start, end
+        k = bisect_left(starts, cut)
+        low = starts[max(k - overlap_tokens, (i + k + 1) // 2)] if overlap_tokens else cut
+        i = max(i + 1, bisect_left(starts, _overlap_start(text, low, end, cut, SENTENCE_SEPARATORS)))
+
+def get_splitter(mode: str = None, size: int = None, overlap: int = None):
+    """span splitter for a chunking mode ("chars" or "tokens"); unset values come from the settings."""
+    mode = mode or settings.CHUNK_MODE
+    if mode == "chars":
+        return partial(split_spans, chunk_size=size or settings.CHUNK_SIZE,
+                       overlap=settings.CHUNK_OVERLAP if overlap is None else overlap)
+    if mode == "tokens":
+        return partial(token_spans, max_tokens=size or settings.CHUNK_TOKENS,
+                       overlap_tokens=settings.CHUNK_OVERLAP_TOKENS if overlap is None else overlap)
+    raise ValueError(f"Unknown chunk mode '{mode}'. Available: chars, tokens")
+
+def iter_text(stream, read_size: int = 1 << 16) -> Iterator[str]:
+    """
+    Decodes a binary file object as UTF-8, `read_size` bytes at a time
+    (multi-byte characters split across reads are handled by the decoder).
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+def _block_end(buffer: str, limit: int) -> int:
+    """End of the next block: after the last paragraph (or line, or word) break before `limit`."""
+    for separator in ("\n\n", "\n", " "):
+        cut = buffer.rfind(separator, 0, limit)
+        if cut > 0:
+            return cut + len(separator)
+    return limit
+
+def iter_chunks(pieces: Iterable[str], block_chars: int = None, splitter=None) -> Iterator[dict]:
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=512,
-        chunk_overlap=150,
-        separators=["\n\n", "\n", "。", ".", " ", ""],
-        length_function=len,
-    )
-    text_chunks = text_splitter.split_text(text)
+    Splits text into chunks lazily and assigns page numbers.
+    `pieces` is any iterable of text (e.g. iter_text over an upload); it is
+    buffered into blocks of about `block_chars` characters cut at paragraph
+    breaks, and each block is split on its own, so memory stays bounded by
+    the block size whatever the size of the file. `splitter` maps a block to
+    chunk spans (default: get_splitter() for the configured CHUNK_MODE).
+
+    Page markers are found once per block and pages are assigned by offset:
+    `page_number` is the page in effect where the chunk starts (or its first
+    marker, before the first page), `page_end` the page where it ends.
+    """
+    block_chars = block_chars or settings.INGEST_BLOCK_CHARS
+    splitter = splitter or get_splitter()
     current_page = None
-    chunks_with_metadata = []
-    
-    for i, chunk in enumerate(text_chunks):
-        page_num = extract_page_number(chunk)
-        if page_num:
-            current_page = page_num
-        chunks_with_metadata.append({
-            "text": chunk,
-            "index": i,
-            "page_number": current_page,
-            "has_page_marker": bool(page_num)
-        })
-    return chunks_with_metadata
-
-def process_file_content(content: str, filename: str):
+    index = 0
+
+    def split(block):
+        nonlocal current_page, index
+        offsets, pages = [], []
+        for match in PAGE_MARKER.finditer(block):
+            offsets.append(match.start())
+            pages.append(match.group(1) or match.group(2))
+
+        def page_at(position):
+            i = bisect_right(offsets, position) - 1
+            return pages[i] if i >= 0 else current_page
+
+        for start, end in splitter(block):
+            first = bisect_left(offsets, start)
+            has_marker = first < len(offsets) and offsets[first] < end
+            page_number = page_at(start)
+            if page_number is None and has_marker:
+                page_number = pages[first]
+            yield {
+                "text": block[start:end],
+                "index": index,
+                "page_number": page_number,
+                "page_end": page_at(end - 1),
+                "has_page_marker": has_marker
+            }
+            index += 1
+        if pages:
+            current_page = pages[-1]
+
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= block_chars:
+            cut = _block_end(buffer, block_chars)
+            yield from split(buffer[:cut])
+            buffer = buffer[cut:]
+    if buffer:
+        yield from split(buffer)
+
+def chunk_text(text: str, splitter=None) -> list[dict]:
     """
-    Process file content directly from memory (no local file saving).
+    Split text into chunks and extract page numbers.
+    """
+    return list(iter_chunks([text], splitter=splitter))
+
+def batches(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+class IngestionCancelled(Exception):
+    """Raised inside ingest_chunks when its `cancelled` callback returns True."""
+
+def content_hash(data) -> str:
+    """sha256 of a text (UTF-8) or bytes: identity of a file and of a chunk."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(stream) -> str:
+    """Content hash of a seekable binary file object, read in pieces; the position is restored."""
+    position = stream.tell()
+    h = hashlib.sha256()
+    for data in iter(lambda: stream.read(1 << 20), b""):
+        h.update(data)
+    stream.seek(position)
+    return h.hexdigest()
+
+def _embed_texts(texts: list[str]) -> list[list[float]]:
+    return retry(get_batch_embeddings, texts, attempts=settings.INGEST_RETRIES, base_delay=settings.INGEST_RETRY_DELAY)
+
+def embed_chunks(texts: list[str], embed=None) -> tuple[list, int]:
+    """
+    Embeddings of chunk texts. Chunks whose content hash is already in the
+    chunk table (an unchanged part of an edited file, or the same passage in
+    another document) reuse the stored embedding; only the others are sent
+    to `embed` (by default get_batch_embeddings with retries).
+    Returns (embeddings, number reused).
     """
-    # 1. Chunk text
-    chunks_with_metadata = chunk_text(content)
-    total_chunks = len(chunks_with_metadata)
-    
-    # 2. Create Document record in Supabase
-    doc_record = insert_document_record(filename, total_chunks)
-    document_id = doc_record['id']
-    
-    # 3. Prepare chunks for insertion (including embeddings)
-    chunks_data = []
-    texts_to_embed = [chunk['text'] for chunk in chunks_with_metadata]
-    
-    # Generate embeddings for all chunks in batch
-    print(f"Generating embeddings for {len(texts_to_embed)} chunks...")
-    embeddings = get_batch_embeddings(texts_to_embed)
-    
-    for i, chunk in enumerate(chunks_with_metadata):
-        chunks_data.append({
-            "document_id": document_id,
-            "chunk_index": chunk['index'],
-            "content": chunk['text'],
-            "metadata": {
-                "page_number": chunk['page_number'] if chunk['page_number'] else "",
-                "has_page_marker": chunk['has_page_marker'],
-                "filename": filename
-            },
-            "embedding": embeddings[i], # Insert embedding directly
-            "embedding_id": str(uuid.uuid4()) # Dummy ID to satisfy NOT NULL constraint (legacy column)
-        })
-        
-    # 4. Insert chunks into Supabase (now includes embeddings)
-    # Use batching to avoid timeout with large files
-    batch_size = 100
-    total_inserted = 0
-    print(f"Inserting {len(chunks_data)} chunks into Supabase in batches of {batch_size}...")
-    
-    for i in range(0, len(chunks_data), batch_size):
-        batch = chunks_data[i:i + batch_size]
-        try:
-            insert_chunks_records(batch)
-            total_inserted += len(batch)
-            print(f"   - Inserted batch {i//batch_size + 1} ({len(batch)} chunks)")
-        except Exception as e:
-            print(f"❌ Error inserting batch {i//batch_size + 1}: {e}")
-            raise e
-    
-    # 5. Update BM25 Index (In-Memory update only for current session)
+    from app.services.vector_store import parse_embedding
+
+    hashes = [content_hash(text) for text in texts]
+    known = {key: parse_embedding(value) for key, value in fetch_embeddings_by_hash(sorted(set(hashes))).items()}
+    missing = [i for i, key in enumerate(hashes) if key not in known]
+    vectors = [known.get(key) for key in hashes]
+    if missing:
+        for i, vector in zip(missing, (embed or _embed_texts)([texts[i] for i in missing])):
+            vectors[i] = vector
+    return vectors, len(texts) - len(missing)
+
+def remove_document(document_id: int):
+    """Deletes a document from Supabase and the local indexes (indexes left unsaved)."""
     from app.services.bm25_service import bm25_service
-    
-    # Construct metadata list for BM25
-    new_metadatas = [{
+    bm25_service.remove_document(document_id, save=False)
+    get_vector_store().remove_document(document_id, save=False)
+    delete_document_record(document_id)
+
+def replace_previous_versions(document_id: int, filename: str, keep: Iterable[int] = ()) -> int:
+    """
+    Removes the other documents uploaded under `filename`, except those in
+    `keep`. Only called when the caller asked for it (replace=True): a
+    filename alone does not identify a document, two unrelated files may
+    share it.
+    """
+    kept = {document_id, *keep}
+    previous = [doc['id'] for doc in find_documents_by_filename(filename) if doc['id'] not in kept]
+    if previous:
+        print(f"⚠️  Replacing previous version(s) of {filename} with document {document_id}: "
+              f"removing documents {previous}")
+    for old_id in previous:
+        remove_document(old_id)
+    return len(previous)
+
+def _bm25_metadata(document_id: int, filename: str, chunk_index: int, page_number: str) -> dict:
+    return {
         "document_id": document_id,
-        "chunk_index": c['chunk_index'],
+        "chunk_index": chunk_index,
         "filename": filename,
-        "page_number": c['metadata']['page_number']
-    } for c in chunks_data]
-    
-    bm25_service.add_documents(texts_to_embed, new_metadatas)
-    
-    # Count documents with page numbers
-    chunks_with_pages = sum(1 for c in chunks_data if c['metadata'].get("page_number"))
-    
+        "page_number": page_number
+    }
+
+def chunk_row(document_id: int, filename: str, chunk: dict, embedding: list) -> dict:
+    """Row of the chunk table for one chunk of iter_chunks."""
+    row = {
+        "document_id": document_id,
+        "chunk_index": chunk['index'],
+        "content": chunk['text'],
+        "metadata": {
+            "page_number": chunk['page_number'] if chunk['page_number'] else "",
+            "has_page_marker": chunk['has_page_marker'],
+            "filename": filename
+        },
+        "embedding": embedding, # Insert embedding directly
+        "embedding_id": str(uuid.uuid4()), # Dummy ID to satisfy NOT NULL constraint (legacy column)
+        "content_hash": content_hash(chunk['text'])
+    }
+    if chunk.get('page_end') and chunk['page_end'] != chunk['page_number']:
+        row["metadata"]["page_end"] = chunk['page_end']
+    return row
+
+def store_rows(chunks_data: list[dict]) -> list[int]:
+    """
+    Inserts chunk rows (possibly of several documents) into Supabase in one
+    request, then adds them to the BM25 and local vector indexes (unsaved).
+    Returns the new chunk ids.
+    """
+    from app.services.bm25_service import bm25_service
+
+    inserted = insert_chunks_records(chunks_data)
+    chunk_ids = [row['id'] for row in inserted]
+    has_ids = len(chunk_ids) == len(chunks_data)
+
+    new_metadatas = [_bm25_metadata(c['document_id'], c['metadata']['filename'], c['chunk_index'],
+                                    c['metadata']['page_number'])
+                     for c in chunks_data]
+    bm25_service.add_documents([c['content'] for c in chunks_data], new_metadatas,
+                               chunk_ids if has_ids else None, save=False)
+    # Local vector index (no-op for the Supabase backend, which already has the embeddings)
+    if has_ids:
+        get_vector_store().add_chunks(chunk_ids, [c['document_id'] for c in chunks_data],
+                                      [c['embedding'] for c in chunks_data], save=False)
+    return chunk_ids
+
+def _resume_document(document_id: int, filename: str) -> tuple[int, int]:
+    """
+    Prepares a partially ingested document for resumption. Batches are inserted
+    in chunk order, so the stored chunks are a prefix of the document: rows
+    past the first gap are deleted, the prefix is re-indexed (chunks added to
+    BM25 after the last save were lost with the process), and
+    (chunks already stored, how many have a page number) is returned.
+    """
+    from app.services.bm25_service import bm25_service
+    from app.services.vector_store import parse_embedding
+
+    rows = sorted(fetch_document_chunks(document_id, "id,chunk_index,content,metadata,embedding"),
+                  key=lambda row: row['chunk_index'])
+    done = 0
+    while done < len(rows) and rows[done]['chunk_index'] == done:
+        done += 1
+    if done < len(rows):
+        delete_chunks_from(document_id, done)
+    rows = rows[:done]
+
+    vector_store = get_vector_store()
+    bm25_service.remove_document(document_id, save=False)
+    vector_store.remove_document(document_id, save=False)
+    pages = [(row['metadata'] or {}).get('page_number', "") for row in rows]
+    if rows:
+        bm25_service.add_documents(
+            [row['content'] for row in rows],
+            [_bm25_metadata(document_id, filename, row['chunk_index'], page) for row, page in zip(rows, pages)],
+            [row['id'] for row in rows],
+            save=False,
+        )
+        vector_store.add_chunks([row['id'] for row in rows], [document_id] * len(rows),
+                                [parse_embedding(row['embedding']) for row in rows], save=False)
+    print(f"🔄 Resuming document {document_id} after {done} stored chunks.")
+    return done, sum(1 for page in pages if page)
+
+def ingest_chunks(chunks: Iterable[dict], filename: str, document_id: int = None, progress=None,
+                  cancelled=None, keep_partial: bool = False, file_content_hash: str = None,
+                  replace: bool = False) -> dict:
+    """
+    Embeds and stores a stream of chunks as one document.
+
+    Batches of INGEST_EMBED_BATCH chunks are embedded concurrently (at most
+    INGEST_EMBED_CONCURRENCY in flight, each retried with backoff) while the
+    oldest embedded batch is inserted on a separate thread, in order. Only
+    those batches are held in memory. The document's total_chunks is set
+    once the stream is exhausted.
+
+    `document_id` resumes a partially ingested document (its stored chunks
+    are skipped). `progress(stage, counts)` is called after every batch and
+    `cancelled()` is polled between batches (raising IngestionCancelled).
+    On failure the partial document is deleted, unless `keep_partial` is set
+    so that it can be resumed later.
+
+    Ingestion is idempotent by content: a file whose `file_content_hash`
+    matches a fully ingested document is skipped, chunks already embedded
+    (by hash) are not embedded again. With `replace`, once the new document
+    is stored, the older documents with the same filename are removed;
+    otherwise documents sharing a filename are kept side by side.
+    """
+    from app.services.bm25_service import bm25_service
+
+    skip = with_pages = 0
+    if document_id is None:
+        existing = find_document_by_hash(file_content_hash) if file_content_hash else None
+        if existing is not None:
+            print(f"⏭️  {filename} is unchanged (document {existing['id']}), skipping.")
+            return {
+                "filename": filename,
+                "total_chunks": existing['total_chunks'],
+                "document_id": existing['id'],
+                "status": "unchanged"
+            }
+        doc_record = insert_document_record(filename, 0, file_content_hash)
+        document_id = doc_record['id']
+    else:
+        skip, with_pages = _resume_document(document_id, filename)
+    concurrency = max(1, settings.INGEST_EMBED_CONCURRENCY)
+    totals = {"document_id": document_id, "chunks_read": skip, "chunks_embedded": skip,
+              "chunks_inserted": skip, "embeddings_reused": 0, "with_pages": with_pages, "batches": 0}
+
+    def report(stage):
+        if progress is not None:
+            progress(stage, dict(totals))
+
+    def check_cancelled():
+        if cancelled is not None and cancelled():
+            raise IngestionCancelled(f"Ingestion of {filename} was cancelled")
+
+    def insert(batch, embeddings):
+        store_rows([chunk_row(document_id, filename, chunk, embedding) for chunk, embedding in zip(batch, embeddings)])
+        totals["chunks_inserted"] += len(batch)
+        report("inserting")
+
+    embed_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ingest-embed")
+    insert_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-insert")
+    pending = deque()  # (batch, embedding future), oldest first
+    inserting = None
+
+    def store_oldest():
+        nonlocal inserting
+        batch, future = pending.popleft()
+        embeddings, reused = future.result()
+        totals["chunks_embedded"] += len(batch)
+        totals["embeddings_reused"] += reused
+        if inserting is not None:
+            inserting.result()  # keeps inserts in order and at most one batch waiting
+        check_cancelled()
+        inserting = insert_pool.submit(insert, batch, embeddings)
+        totals["batches"] += 1
+        print(f"   - Embedded batch {totals['batches']} ({len(batch)} chunks)")
+        report("embedding")
+
+    try:
+        print(f"Ingesting {filename} in batches of {settings.INGEST_EMBED_BATCH} chunks...")
+        report("chunking")
+        remaining = (chunk for chunk in chunks if chunk['index'] >= skip)
+        for batch in batches(remaining, settings.INGEST_EMBED_BATCH):
+            check_cancelled()
+            totals["chunks_read"] += len(batch)
+            totals["with_pages"] += sum(1 for chunk in batch if chunk['page_number'])
+            pending.append((batch, embed_pool.submit(embed_chunks, [chunk['text'] for chunk in batch])))
+            if len(pending) >= concurrency:
+                store_oldest()
+        while pending:
+            store_oldest()
+        if inserting is not None:
+            inserting.result()
+        report("indexing")
+        update_document_total_chunks(document_id, totals["chunks_read"])
+        if replace:
+            replace_previous_versions(document_id, filename)
+    except Exception as e:
+        print(f"❌ Ingestion of {filename} stopped after {totals['chunks_inserted']} chunks: {e}")
+        for _, future in pending:
+            future.cancel()
+        embed_pool.shutdown(wait=True)
+        insert_pool.shutdown(wait=True)
+        if keep_partial:
+            # Keep the indexes consistent with the stored prefix until the job is resumed
+            if bm25_service.bm25 is not None:
+                bm25_service.save_index()
+            get_vector_store().save()
+        else:
+            remove_document(document_id)
+        raise
+    finally:
+        embed_pool.shutdown(wait=False)
+        insert_pool.shutdown(wait=False)
+
+    bm25_service.save_index()
+    get_vector_store().save()
+
+    # Cached answers were built without these chunks
+    from app.services.answer_cache import answer_cache
+    answer_cache.invalidate()
+
+    print(f"✅ Stored {totals['chunks_read']} chunks of {filename} (document {document_id}, "
+          f"{totals['embeddings_reused']} embeddings reused).")
     return {
         "filename": filename,
-        "total_chars": len(content),
-        "total_chunks": total_chunks,
-        "chunks_with_page_numbers": chunks_with_pages,
+        "total_chunks": totals["chunks_read"],
+        "chunks_with_page_numbers": totals["with_pages"],
+        "embeddings_reused": totals["embeddings_reused"],
         "document_id": document_id,
         "status": "processed_and_stored"
     }
-    
 
+def process_file_stream(stream, filename: str, **options) -> dict:
+    """
+    Process an uploaded file object without reading it into memory at once:
+    decoded, chunked, embedded and stored as it is read.
+    `options` are passed to ingest_chunks (resume, progress, cancellation,
+    replace).
+    """
+    total_chars = 0
+
+    def counted(pieces):
+        nonlocal total_chars
+        for piece in pieces:
+            total_chars += len(piece)
+            yield piece
+
+    if stream.seekable():
+        options.setdefault("file_content_hash", file_hash(stream))
+    result = ingest_chunks(iter_chunks(counted(iter_text(stream))), filename, **options)
+    return {**result, "total_chars": total_chars}
+
+def process_file_content(content: str, filename: str, replace: bool = False):
+    """
+    Process file content directly from memory (no local file saving).
+    With `replace`, older documents with the same filename are removed.
+    """
+    result = ingest_chunks(iter_chunks([content]), filename, file_content_hash=content_hash(content),
+                           replace=replace)
+    return {**result, "total_chars": len(content)}
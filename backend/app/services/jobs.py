@@ -0,0 +1,306 @@
+"""
+Background ingestion jobs.
+
+/api/upload spools the file to JOBS_UPLOAD_DIR, enqueues a job and returns
+its id at once; a local pool of JOBS_WORKERS threads runs the streaming
+ingestion (process_file_stream). Job state lives in a SQLite table, so it
+survives restarts and is visible to every worker process:
+
+    queued -> running -> completed | failed | cancelled
+
+Cancellation is a flag polled between embedding batches. Failed and
+cancelled jobs keep their partially ingested document and can be resumed:
+the chunks already stored are skipped and ingestion continues after them.
+
+A running job records its worker (host, pid and a per-process token).
+recover(), called at startup, re-queues the running jobs whose worker is
+gone at once: an earlier run of this process, or a dead pid on this host.
+Jobs of a live worker process are left alone; jobs of another host, whose
+pid cannot be checked, are re-queued once not updated for stale_seconds.
+"""
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from app.core.config import settings
+from app.services.ingestion import IngestionCancelled, process_file_stream
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+COLUMNS = (
+    "id TEXT PRIMARY KEY, filename TEXT NOT NULL, path TEXT NOT NULL, status TEXT NOT NULL, "
+    "stage TEXT, document_id INTEGER, total_bytes INTEGER NOT NULL DEFAULT 0, "
+    "bytes_read INTEGER NOT NULL DEFAULT 0, chunks_read INTEGER NOT NULL DEFAULT 0, "
+    "chunks_embedded INTEGER NOT NULL DEFAULT 0, chunks_inserted INTEGER NOT NULL DEFAULT 0, "
+    "resumed_from INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0, "
+    "cancel_requested INTEGER NOT NULL DEFAULT 0, error TEXT, result TEXT, "
+    "created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL, finished_at REAL, worker TEXT, "
+    "replace_previous INTEGER NOT NULL DEFAULT 0"
+)
+# Columns added after the first release: (name, definition) for ALTER TABLE
+ADDED_COLUMNS = (("worker", "TEXT"), ("replace_previous", "INTEGER NOT NULL DEFAULT 0"))
+
+
+class JobError(Exception):
+    """The requested transition is not possible in the job's current state."""
+
+
+class JobQueue:
+    def __init__(self, path: str, upload_dir: str, workers: int = 2, stale_seconds: float = 300):
+        self.path = path
+        self.upload_dir = upload_dir
+        self.stale_seconds = stale_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest-job")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._token = uuid.uuid4().hex[:8]
+
+    @property
+    def worker_id(self) -> str:
+        # The pid is read on every call: a forked worker process must not reuse its parent's id
+        return f"{socket.gethostname()}:{os.getpid()}:{self._token}"
+
+    def _db(self):
+        # Opened lazily so importing the module never touches the filesystem
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS jobs ({COLUMNS})")
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, definition in ADDED_COLUMNS:
+                if name not in existing:  # tables created before the column
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status)")
+            self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params=()) -> int:
+        with self._lock:
+            db = self._db()
+            cursor = db.execute(sql, params)
+            db.commit()
+            return cursor.rowcount
+
+    def _row(self, job_id: str) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    # --- API --------------------------------------------------------------
+
+    def submit(self, stream, filename: str, replace: bool = False) -> dict:
+        """
+        Spools `stream` (binary file object) to disk and queues its ingestion.
+        With `replace`, the stored documents with the same filename are
+        removed once the new one is complete.
+        """
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.upload_dir, exist_ok=True)
+        path = os.path.join(self.upload_dir, f"{job_id}.txt")
+        with open(path, "wb") as f:
+            shutil.copyfileobj(stream, f, 1 << 20)
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, filename, path, status, total_bytes, replace_previous, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, filename, path, QUEUED, os.path.getsize(path), int(replace), now, now),
+        )
+        self._executor.submit(self._run, job_id)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._row(job_id)
+        return describe(row) if row is not None else None
+
+    def list(self, limit: int = 20) -> List[dict]:
+        with self._lock:
+            rows = self._db().execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [describe(row) for row in rows]
+
+    def cancel(self, job_id: str) -> dict:
+        """Cancels a queued job at once, or asks a running one to stop after its current batch."""
+        now = time.time()
+        if not self._execute("UPDATE jobs SET status = ?, finished_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                             (CANCELLED, now, now, job_id, QUEUED)):
+            if not self._execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?", (job_id, RUNNING)):
+                self._raise_for(job_id, "cancel")
+        return self.get(job_id)
+
+    def resume(self, job_id: str) -> dict:
+        """Re-queues a failed or cancelled job; it continues after the chunks already stored."""
+        row = self._row(job_id)
+        if row is not None and not os.path.exists(row["path"]):
+            raise JobError(f"Job {job_id} cannot be resumed: its upload file is gone")
+        if not self._execute(
+            "UPDATE jobs SET status = ?, cancel_requested = 0, error = NULL, finished_at = NULL, updated_at = ? "
+            "WHERE id = ? AND status IN (?, ?)",
+            (QUEUED, time.time(), job_id, FAILED, CANCELLED),
+        ):
+            self._raise_for(job_id, "resume")
+        self._executor.submit(self._run, job_id)
+        return self.get(job_id)
+
+    def recover(self) -> int:
+        """Startup: re-queues running jobs whose worker is gone (see module docstring), and starts every queued job."""
+        now = time.time()
+        with self._lock:
+            running = self._db().execute("SELECT id, worker, updated_at FROM jobs WHERE status = ?",
+                                         (RUNNING,)).fetchall()
+        for row in running:
+            if self._orphaned(row["worker"], row["updated_at"], now):
+                # Unchanged owner only: the job may have been finished or reclaimed meanwhile
+                self._execute("UPDATE jobs SET status = ?, worker = NULL, updated_at = ? "
+                              "WHERE id = ? AND status = ? AND worker IS ?",
+                              (QUEUED, now, row["id"], RUNNING, row["worker"]))
+        with self._lock:
+            queued = [row["id"] for row in self._db().execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,))]
+        for job_id in queued:
+            self._executor.submit(self._run, job_id)
+        if queued:
+            print(f"🔄 Re-queued {len(queued)} ingestion jobs.")
+        return len(queued)
+
+    def _orphaned(self, worker: Optional[str], updated_at: float, now: float) -> bool:
+        if updated_at < now - self.stale_seconds or not worker:
+            return True
+        host, pid, _ = worker.rsplit(":", 2)
+        if host != socket.gethostname():
+            return False
+        if int(pid) == os.getpid():
+            # An earlier run of this process with the same pid (pid 1 in a container)
+            return worker != self.worker_id
+        return not _pid_alive(int(pid))
+
+    def _raise_for(self, job_id: str, action: str):
+        row = self._row(job_id)
+        if row is None:
+            raise KeyError(job_id)
+        raise JobError(f"Cannot {action} job {job_id}: it is {row['status']}")
+
+    # --- Worker -----------------------------------------------------------
+
+    def _run(self, job_id: str):
+        now = time.time()
+        # Claim the job: another worker process may have picked it up already
+        if not self._execute("UPDATE jobs SET status = ?, worker = ?, started_at = ?, updated_at = ?, "
+                             "attempts = attempts + 1 WHERE id = ? AND status = ?",
+                             (RUNNING, self.worker_id, now, now, job_id, QUEUED)):
+            return
+        job = self._row(job_id)
+        print(f"📥 Job {job_id}: ingesting {job['filename']}...")
+        first_report = True
+
+        def progress(stage: str, counts: dict):
+            nonlocal first_report
+            fields = {
+                "stage": stage,
+                "document_id": counts["document_id"],
+                "bytes_read": f.tell(),
+                "chunks_read": counts["chunks_read"],
+                "chunks_embedded": counts["chunks_embedded"],
+                "chunks_inserted": counts["chunks_inserted"],
+                "updated_at": time.time(),
+            }
+            if first_report:
+                # Chunks stored by earlier runs, excluded from this run's throughput
+                fields["resumed_from"] = counts["chunks_inserted"]
+                first_report = False
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+        def cancelled() -> bool:
+            return bool(self._row(job_id)["cancel_requested"])
+
+        try:
+            with open(job["path"], "rb") as f:
+                result = process_file_stream(f, job["filename"], document_id=job["document_id"],
+                                             progress=progress, cancelled=cancelled, keep_partial=True,
+                                             replace=bool(job["replace_previous"]))
+        except IngestionCancelled:
+            print(f"🛑 Job {job_id} cancelled.")
+            self._finish(job_id, CANCELLED)
+            return
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            self._finish(job_id, FAILED, error=str(e))
+            return
+
+        self._finish(job_id, COMPLETED, result=result)
+        os.remove(job["path"])
+
+    def _finish(self, job_id: str, status: str, error: str = None, result: dict = None):
+        now = time.time()
+        stage = "done" if status == COMPLETED else None
+        self._execute(
+            "UPDATE jobs SET status = ?, stage = COALESCE(?, stage), error = ?, result = ?, "
+            "finished_at = ?, updated_at = ? WHERE id = ?",
+            (status, stage, error, json.dumps(result, ensure_ascii=False) if result else None, now, now, job_id),
+        )
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True  # os.kill would terminate the process: rely on the stale_seconds age check
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+def describe(row: sqlite3.Row) -> dict:
+    """API view of a job row: per-stage progress and throughput of the current run."""
+    end = row["finished_at"] or (row["updated_at"] if row["status"] == RUNNING else None)
+    elapsed = end - row["started_at"] if end and row["started_at"] else 0.0
+    done = row["chunks_inserted"] - row["resumed_from"]
+    return {
+        "id": row["id"],
+        "filename": row["filename"],
+        "status": row["status"],
+        "stage": row["stage"],
+        "document_id": row["document_id"],
+        "replace": bool(row["replace_previous"]),
+        "progress": {
+            "bytes_read": row["bytes_read"],
+            "total_bytes": row["total_bytes"],
+            "chunks_read": row["chunks_read"],
+            "chunks_embedded": row["chunks_embedded"],
+            "chunks_inserted": row["chunks_inserted"],
+            "resumed_from": row["resumed_from"],
+        },
+        "throughput": {
+            "elapsed_seconds": round(elapsed, 3),
+            "chunks_per_second": round(done / elapsed, 2) if elapsed > 0 else 0.0,
+            "bytes_per_second": round(row["bytes_read"] / elapsed, 1) if elapsed > 0 else 0.0,
+        },
+        "cancel_requested": bool(row["cancel_requested"]),
+        "attempts": row["attempts"],
+        "error": row["error"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+    }
+
+
+job_queue = JobQueue(
+    path=settings.JOBS_DB_PATH,
+    upload_dir=settings.JOBS_UPLOAD_DIR,
+    workers=settings.JOBS_WORKERS,
+    stale_seconds=settings.JOBS_STALE_SECONDS,
+)
@@ -0,0 +1,82 @@
+"""
+Model providers behind one interface:
+
+    gemini   google.generativeai (embed_content, GenerativeModel)
+    fake     deterministic offline stand-in (fakes.FakeProvider): hashed
+             bag-of-terms embeddings and canned answers with a configurable
+             latency, to run and benchmark the pipeline without API calls
+
+A provider has:
+    embedding_model                    name used in embedding cache keys
+    embed(texts, task_type)            one vector per text ("retrieval_query" / "retrieval_document")
+    generate(prompt)                   answer text
+    generate_stream(prompt)            answer text, piece by piece
+
+The database has the same switch in database.get_supabase (DATABASE_BACKEND).
+Calls are counted and timed by telemetry.external_call (fake ones included,
+so offline benchmarks report the calls a real run would make).
+"""
+import threading
+from typing import Iterator, List
+
+import google.generativeai as genai
+from app.core.config import settings
+from app.services.telemetry import external_call
+
+
+class GeminiProvider:
+    name = "gemini"
+
+    def __init__(self):
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+
+    @property
+    def embedding_model(self) -> str:
+        return settings.GEMINI_EMBEDDING_MODEL
+
+    def embed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        # embed_content supports a list of content: one round-trip for the whole batch.
+        with external_call(self.name, "embed"):
+            result = genai.embed_content(
+                model=settings.GEMINI_EMBEDDING_MODEL,
+                content=texts,
+                task_type=task_type
+            )
+        return result['embedding']
+
+    def generate(self, prompt: str) -> str:
+        model = genai.GenerativeModel(settings.GEMINI_CHAT_MODEL)
+        with external_call(self.name, "generate"):
+            return model.generate_content(prompt).text
+
+    def generate_stream(self, prompt: str) -> Iterator[str]:
+        model = genai.GenerativeModel(settings.GEMINI_CHAT_MODEL)
+        with external_call(self.name, "generate_stream"):
+            for chunk in model.generate_content(prompt, stream=True):
+                yield chunk.text
+
+
+def _fake_provider():
+    from app.services.fakes import FakeProvider
+    return FakeProvider()
+
+
+PROVIDERS = {
+    "gemini": GeminiProvider,
+    "fake": _fake_provider,
+}
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name: str = None):
+    """Returns the (cached) provider registered under `name`, or the configured MODEL_PROVIDER."""
+    if name is None:
+        name = settings.MODEL_PROVIDER
+    with _providers_lock:
+        if name not in _providers:
+            if name not in PROVIDERS:
+                raise ValueError(f"Unknown model provider '{name}'. Available: {', '.join(PROVIDERS)}")
+            _providers[name] = PROVIDERS[name]()
+        return _providers[name]
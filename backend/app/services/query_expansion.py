@@ -1,18 +1,77 @@
 """
 Query expansion service to improve search for short queries
+
+Modes (settings.QUERY_EXPANSION):
+    local   variants made of the query plus related corpus terms
+            (term_expansion table stored with the BM25 index, no API call)
+    hybrid  local, falling back to the LLM when the corpus knows none of the terms
+    llm     Gemini reformulations, cached by normalized query
+    none    the query alone
 """
-import google.generativeai as genai
+import re
+import threading
+from collections import OrderedDict
+
 from app.core.config import settings
-from app.services.embedding import configure_gemini
+from app.services.answer_cache import normalize_query
+from app.services.providers import get_provider
 
-def expand_query(query: str) -> list[str]:
-    """
-    Expand a short query into multiple related queries for better search coverage.
-    Returns list of query variations including the original.
-    """
-    configure_gemini()
-    model = genai.GenerativeModel(settings.GEMINI_CHAT_MODEL)
-    
+# Related terms appended to the query per variant
+TERMS_PER_VARIANT = 3
+
+
+class ExpansionCache:
+    """LRU of LLM expansions keyed by normalized query (diacritics, letter variants, punctuation)."""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str):
+        key = normalize_query(query)
+        with self._lock:
+            variants = self._entries.get(key)
+            if variants is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Cached reformulations, with this query's own wording first
+        return [query] + variants[1:]
+
+    def put(self, query: str, variants: list[str]):
+        with self._lock:
+            self._entries[normalize_query(query)] = variants
+            self._entries.move_to_end(normalize_query(query))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+expansion_cache = ExpansionCache(settings.QUERY_EXPANSION_CACHE_SIZE)
+
+
+def local_expand_query(query: str) -> list[str]:
+    """The query, then the query followed by groups of related corpus terms."""
+    from app.services.bm25_service import bm25_service
+    terms = bm25_service.expansion_terms(query)
+    return [query] + [
+        f"{query} {' '.join(terms[i:i + TERMS_PER_VARIANT])}"
+        for i in range(0, len(terms), TERMS_PER_VARIANT)
+    ]
+
+
+def llm_expand_query(query: str) -> list[str]:
+    """LLM reformulations of the query, served from expansion_cache when seen before."""
+    cached = expansion_cache.get(query)
+    if cached is not None:
+        return cached
     prompt = f"""أنت خبير في توسيع الاستعلامات البحثية. 
 
 **السؤال الأصلي:**
@@ -35,21 +94,37 @@ def expand_query(query: str) -> list[str]:
 """
     
     try:
-        response = model.generate_content(prompt)
-        lines = response.text.strip().split('\n')
+        lines = get_provider().generate(prompt).strip().split('\n')
         
         # Extract queries (remove numbering and empty lines)
         expanded = [query]  # Always include original
         for line in lines:
             line = line.strip()
             # Remove numbering like "1.", "2.", etc.
-            import re
             clean_line = re.sub(r'^\d+[\.\)]\s*', '', line)
             if clean_line and len(clean_line) > 10:
                 expanded.append(clean_line)
         
-        return expanded[:4]  # Return max 4 queries (original + 3 expansions)
+        expanded = expanded[:4]  # Return max 4 queries (original + 3 expansions)
+        expansion_cache.put(query, expanded)
+        return expanded
         
     except Exception as e:
         print(f"Query expansion error: {e}")
-        return [query]  # Fallback to original query only
+        return [query]  # Fallback to original query only (not cached)
+
+
+def expand_query(query: str) -> list[str]:
+    """
+    Expand a short query into multiple related queries for better search coverage.
+    Returns list of query variations including the original.
+    """
+    mode = settings.QUERY_EXPANSION
+    if mode == "none":
+        return [query]
+    if mode == "llm":
+        return llm_expand_query(query)
+    variants = local_expand_query(query)
+    if mode == "hybrid" and len(variants) == 1:
+        return llm_expand_query(query)
+    return variants
@@ -1,15 +1,17 @@
-import google.generativeai as genai
-from app.core.config import settings
-from app.services.embedding import get_embedding
-from app.services.vector_store import query_vectors
-
-_gemini_configured = False
+import asyncio
+import re
 
-def configure_gemini():
-    global _gemini_configured
-    if not _gemini_configured:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        _gemini_configured = True
+from app.core.config import settings
+from app.services.answer_cache import answer_cache
+from app.services.concurrency import iterate_stage, run_stage, submit
+from app.services.context_builder import assemble_context
+from app.services.embedding import get_batch_embeddings
+from app.services.fusion import fuse_results
+from app.services.providers import get_provider
+from app.services.reranker import get_reranker
+from app.services.telemetry import span, start_trace
+from app.services.vector_store import get_vector_store, query_vectors
+from app.services.tokenizer import estimate_tokens, get_tokenizer
 
 def detect_language(text: str) -> str:
     """Detect the language of the query"""
@@ -33,10 +35,7 @@ def detect_language(text: str) -> str:
     
     return "en"  # Default to English
 
-def generate_answer(query: str, context: str, metadatas: list = None) -> str:
-    configure_gemini()
-    model = genai.GenerativeModel(settings.GEMINI_CHAT_MODEL)
-    
+def build_answer_prompt(query: str, context: str, metadatas: list = None) -> str:
     # Detect query language
     lang = detect_language(query)
     
@@ -153,21 +152,62 @@ def generate_answer(query: str, context: str, metadatas: list = None) -> str:
 
 **الإجابة (التزم بالتنسيق المطلوب):**
 """
-    response = model.generate_content(prompt)
-    answer = response.text
-    
-    # Post-processing: فصل المراجع [N] عن الاقتباسات
-    import re
-    # البحث عن نمط: "نص" [رقم] واستبداله بـ "نص"\n[رقم]
-    # نبحث عن علامة تنصيص متبوعة بمسافة ثم [رقم]
-    answer = re.sub(r'(["\u201d\u201c»])\s*(\[\d+\])', r'\1\n\2', answer)
-    
-    return answer
+    return prompt
+
+# Post-processing: فصل المراجع [N] عن الاقتباسات
+# البحث عن نمط: "نص" [رقم] واستبداله بـ "نص"\n[رقم]
+# نبحث عن علامة تنصيص متبوعة بمسافة ثم [رقم]
+CITATION_PATTERN = re.compile(r'(["\u201d\u201c»])\s*(\[\d+\])')
+# A quote at the end of the text that may still turn into a citation match
+_CITATION_PREFIX = re.compile(r'["\u201d\u201c»]\s*(\[\d*)?$')
+
+def format_citations(answer: str) -> str:
+    return CITATION_PATTERN.sub(r'\1\n\2', answer)
+
+def generate_answer(query: str, context: str, metadatas: list = None) -> str:
+    prompt = build_answer_prompt(query, context, metadatas)
+    return format_citations(get_provider().generate(prompt))
+
+def generate_answer_stream(query: str, context: str, metadatas: list = None):
+    """
+    Streaming variant of generate_answer: yields answer text as the model produces it,
+    with the citation post-processing applied incrementally.
+    """
+    prompt = build_answer_prompt(query, context, metadatas)
+    formatter = CitationFormatter()
+    for piece in get_provider().generate_stream(prompt):
+        text = formatter.feed(piece)
+        if text:
+            yield text
+    text = formatter.flush()
+    if text:
+        yield text
+
+class CitationFormatter:
+    """
+    Applies format_citations to a stream of text pieces. Text that could still
+    be the start of a `"… [N]` citation is held back until the next piece.
+    """
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        pending = format_citations(self._pending + text)
+        match = _CITATION_PREFIX.search(pending)
+        cut = match.start() if match else len(pending)
+        self._pending = pending[cut:]
+        return pending[:cut]
+
+    def flush(self) -> str:
+        text, self._pending = format_citations(self._pending), ""
+        return text
 
 def calculate_relevance_score(query: str, document: str) -> float:
     """Calculate relevance score using keyword overlap"""
-    query_words = set(query.lower().split())
-    doc_words = set(document.lower().split())
+    tokenizer = get_tokenizer()
+    query_words = set(tokenizer(query))
+    doc_words = set(tokenizer(document))
     
     if len(query_words) == 0:
         return 0.0
@@ -178,14 +218,11 @@ def calculate_relevance_score(query: str, document: str) -> float:
     
     return len(intersection) / len(union) if len(union) > 0 else 0.0
 
-def rerank_with_gemini(query: str, chunks: list[str], top_k: int = 3) -> list[tuple[str, float]]:
+def gemini_relevance_scores(query: str, chunks: list[str]) -> list[float] | None:
     """
-    Use Gemini to re-rank chunks based on relevance to query.
-    Returns list of (chunk, score) tuples sorted by relevance.
+    Use Gemini to grade the relevance of each chunk to the query.
+    Returns one score (0-1) per chunk, in the order of `chunks`, or None when grading fails.
     """
-    configure_gemini()
-    model = genai.GenerativeModel(settings.GEMINI_CHAT_MODEL)
-    
     # Prepare chunks for evaluation
     chunks_text = ""
     for i, chunk in enumerate(chunks[:10], 1):  # Evaluate top 10 only
@@ -216,123 +253,153 @@ def rerank_with_gemini(query: str, chunks: list[str], top_k: int = 3) -> list[tu
 """
     
     try:
-        response = model.generate_content(prompt)
+        response_text = get_provider().generate(prompt)
         # Extract JSON from response
         import json
         import re
         
         # Find JSON in response
-        json_match = re.search(r'\{[^}]+\}', response.text)
+        json_match = re.search(r'\{[^}]+\}', response_text)
         if json_match:
             scores = json.loads(json_match.group())
             
-            # Create ranked list
-            ranked = []
-            for i, chunk in enumerate(chunks[:10], 1):
-                score = float(scores.get(str(i), 0)) / 10.0  # Normalize to 0-1
-                ranked.append((chunk, score))
+            # Grade of each chunk, in order
+            ranked = [float(scores.get(str(i), 0)) / 10.0 for i in range(1, min(len(chunks), 10) + 1)]  # Normalize to 0-1
             
             # Add remaining chunks with low score
-            for chunk in chunks[10:]:
-                ranked.append((chunk, 0.1))
-            
-            # Sort by score
-            ranked.sort(key=lambda x: x[1], reverse=True)
-            return ranked[:top_k]
-        else:
-            # Fallback: return top chunks as-is
-            return [(chunk, 0.5) for chunk in chunks[:top_k]]
+            return ranked + [0.1] * len(chunks[10:])
+        return None
             
     except Exception as e:
         print(f"Re-ranking error: {e}")
+        return None
+
+def rerank_with_gemini(query: str, chunks: list[str], top_k: int = 3) -> list[tuple[str, float]]:
+    """
+    Use Gemini to re-rank chunks based on relevance to query.
+    Returns list of (chunk, score) tuples sorted by relevance.
+    """
+    scores = gemini_relevance_scores(query, chunks)
+    if scores is None:
         # Fallback: return top chunks as-is
         return [(chunk, 0.5) for chunk in chunks[:top_k]]
+    ranked = sorted(zip(chunks, scores), key=lambda x: x[1], reverse=True)
+    return ranked[:top_k]
 
-def rag_pipeline(query: str):
+def query_variants(query: str) -> list[str]:
+    """Expand query for better coverage (activated for queries with 10 words or less)."""
     from app.services.query_expansion import expand_query
-    
-    # 1. Expand query for better coverage (activate for queries with 10 words or less)
-    queries = expand_query(query) if len(query.split()) <= 10 else [query]
-    print(f"Searching with {len(queries)} query variations...")
-    
-    # 2. Search with all query variations and collect results
-    all_documents = []
-    all_distances = []
-    all_metadatas = []
-    
-    for q in queries:
-        # Embed Query with correct task_type
-        query_embedding = get_embedding(q, is_query=True)
-        
-        # Retrieve from Supabase (pgvector)
-        # Returns list of dicts: [{'content': '...', 'metadata': {...}, 'similarity': 0.85}, ...]
-        results = query_vectors(query_embedding, match_count=20)
-        
-        # Collect results
-        for res in results:
-            all_documents.append(res['content'])
-            # Convert similarity to distance-like score for RRF (1 - similarity) or just use similarity
-            # RRF expects rank, so raw score matters less, but let's keep it consistent
-            # Supabase returns similarity (1 is identical). Chroma returned distance (0 is identical).
-            # We will use similarity directly for scoring if needed, or invert for distance.
-            # Let's store similarity as score.
-            all_distances.append(1 - res['similarity']) # Fake distance for compatibility if needed
-            all_metadatas.append(res['metadata'])
-    
-    # 3. Hybrid Search (Vector + BM25) with Reciprocal Rank Fusion (RRF)
+    return expand_query(query) if len(query.split()) <= 10 else [query]
+
+def select_context(reranked: list[tuple[int, str, float]], chunk_to_meta: dict) -> tuple[list[str], list[dict]]:
+    """Extract the re-ranked documents and find their metadata (by chunk id)."""
+    final_documents = []
+    final_metadatas = []
+    for chunk_id, chunk, score in reranked:
+        final_documents.append(chunk)
+        # Retrieve metadata using the map, defaulting to empty dict if not found (unlikely)
+        final_metadatas.append(chunk_to_meta.get(chunk_id, {}))
+    return final_documents, final_metadatas
+
+def build_context(query: str, documents: list[str], metadatas: list[dict]) -> tuple[list[str], list[dict]]:
+    """Fits the selected chunks in the prompt budget (see context_builder)."""
+    overhead = estimate_tokens(build_answer_prompt(query, "", None))
+    return assemble_context(query, documents, metadatas, overhead=overhead)
+
+def lookup_answer(query: str):
+    """
+    Answer-cache lookup, exact then by query-embedding similarity.
+    Returns (cached result or None, query embedding, corpus version).
+    """
+    with span("answer_cache") as current:
+        version = answer_cache.version()
+        cached = answer_cache.get(query)
+        if cached is not None:
+            current.set_attribute("hit", "exact")
+            return cached, None, version
+        # Same text/task_type as the first query variant, so the pipeline reuses it from the embedding cache
+        embedding = get_batch_embeddings([query], is_query=True)[0]
+        cached = answer_cache.find_similar(query, embedding)
+        current.set_attribute("hit", "semantic" if cached is not None else "miss")
+        return cached, embedding, version
+
+def use_answer_cache(reranker: str = None) -> bool:
+    # Cached answers were reranked with the default reranker
+    return settings.ANSWER_CACHE and reranker in (None, settings.RERANKER)
+
+def with_timings(result: dict, trace) -> dict:
+    # A copy: the cached result must not carry the timings of the query that stored it
+    return {**result, "timings": trace.timings()}
+
+def rag_pipeline(query: str, reranker: str = None, timings: bool = False):
+    """
+    `reranker` picks a registered reranker ("local", "gemini", "none"); default settings.RERANKER.
+    With `timings`, the result has a "timings" block (per-stage milliseconds and spans, see telemetry).
+    """
+    with start_trace("rag_pipeline", reranker=reranker or settings.RERANKER) as trace:
+        if not use_answer_cache(reranker):
+            result = run_rag_pipeline(query, reranker)
+        else:
+            result, embedding, version = lookup_answer(query)
+            if result is not None:
+                print("⚡ Answer cache hit")
+            else:
+                result = run_rag_pipeline(query, reranker)
+                answer_cache.store(query, embedding, result, version)
+    return with_timings(result, trace) if timings else result
+
+def search_candidates(query: str, match_count: int = 20) -> tuple[list[str], list[list[dict]], list]:
+    """
+    Retrieval before fusion: the query variants, one vector result list per
+    variant and the BM25 results (match_count hits each).
+    """
     from app.services.bm25_service import bm25_service
     
-    # Get BM25 results (Increased to 20 to capture more candidates)
-    bm25_results = bm25_service.search(query, top_k=20)
-    
-    # RRF Constants
-    k = 60
-    doc_scores = {}
-    doc_metadatas = {}
+    # BM25 only needs the original query: start it now so it overlaps with expansion and embedding
+    bm25_future = submit("bm25", bm25_service.search, query, top_k=match_count, with_ids=True)
     
-    # Process Vector Results (Weight: 0.3)
-    vector_weight = 0.3
-    for rank, (doc, dist, meta) in enumerate(zip(all_documents, all_distances, all_metadatas)):
-        if doc not in doc_scores:
-            doc_scores[doc] = 0
-            doc_metadatas[doc] = meta
-        # Vector rank contribution
-        doc_scores[doc] += vector_weight * (1 / (k + rank + 1))
-        
-    # Process BM25 Results (Weight: 0.7)
-    bm25_weight = 0.7
-    for rank, (doc, score, meta) in enumerate(bm25_results):
-        if doc not in doc_scores:
-            doc_scores[doc] = 0
-            doc_metadatas[doc] = meta
-        # BM25 rank contribution
-        doc_scores[doc] += bm25_weight * (1 / (k + rank + 1))
+    # 1. Expand query
+    with span("expand"):
+        queries = query_variants(query)
+    print(f"Searching with {len(queries)} query variations...")
     
-    # Sort by RRF score
-    ranked_items = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
+    # 2. Search with all query variations: one batched embedding call, then
+    # one matmul (local index) or the per-variant RPCs concurrently (Supabase pgvector)
+    with span("embed"):
+        query_embeddings = get_batch_embeddings(queries, is_query=True)
+    vector_store = get_vector_store()
+    if vector_store.in_process:
+        with span("vector"):
+            vector_results = vector_store.query_batch(query_embeddings, match_count=match_count)
+    else:
+        vector_futures = [
+            submit("vector", query_vectors, query_embedding, match_count=match_count)
+            for query_embedding in query_embeddings
+        ]
+        vector_results = [future.result() for future in vector_futures]
+    return queries, vector_results, bm25_future.result()
+
+def run_rag_pipeline(query: str, reranker: str = None):
+    reranker = get_reranker(reranker)
     
-    # Take top 15 for re-ranking (Optimized for speed/accuracy balance)
-    top_10_documents = [doc for doc, score in ranked_items[:15]]
-    top_10_metadatas = [doc_metadatas[doc] for doc, score in ranked_items[:15]]
+    # 1-2. Expansion, vector and BM25 search (Increased to 20 to capture more candidates)
+    _, vector_results, bm25_results = search_candidates(query, match_count=20)
     
-    # Create a map of chunk -> metadata for reliable retrieval
-    chunk_to_meta = {doc: meta for doc, meta in zip(top_10_documents, top_10_metadatas)}
+    # 3. Hybrid fusion
+    with span("fusion"):
+        top_ids, top_documents, chunk_to_meta, signals = fuse_results(vector_results, bm25_results)
     
-    # 5. Re-rank with Gemini for better accuracy
-    reranked = rerank_with_gemini(query, top_10_documents, top_k=5)
-    
-    # Extract documents and find their metadata
-    final_documents = []
-    final_metadatas = []
-    for chunk, score in reranked:
-        final_documents.append(chunk)
-        # Retrieve metadata using the map, defaulting to empty dict if not found (unlikely)
-        final_metadatas.append(chunk_to_meta.get(chunk, {}))
+    # 4. Re-rank (local feature scorer by default, Gemini when requested)
+    with span("rerank"):
+        reranked = reranker.rerank(query, top_documents, top_k=5, signals=signals, ids=top_ids)
+    with span("context"):
+        final_documents, final_metadatas = build_context(query, *select_context(reranked, chunk_to_meta))
     
     context = "\n\n---\n\n".join(final_documents)
     
-    # 6. Generate Answer with metadata
-    answer = generate_answer(query, context, final_metadatas)
+    # 5. Generate Answer with metadata
+    with span("generate"):
+        answer = generate_answer(query, context, final_metadatas)
     
     return {
         "query": query,
@@ -341,11 +408,104 @@ def rag_pipeline(query: str):
         "answer": answer
     }
 
+async def retrieve_context_async(query: str, reranker: str = None) -> tuple[list[str], list[dict]]:
+    """
+    Retrieval half of rag_pipeline, with every blocking call run through
+    run_stage so the event loop stays free and each stage has its own
+    concurrency limit. Returns the final chunks and their metadata.
+    """
+    from app.services.bm25_service import bm25_service
+    
+    reranker = get_reranker(reranker)
+    bm25_task = asyncio.ensure_future(run_stage("bm25", bm25_service.search, query, top_k=20, with_ids=True))
+    try:
+        queries = await run_stage("expand", query_variants, query)
+        print(f"Searching with {len(queries)} query variations...")
+        
+        query_embeddings = await run_stage("embed", get_batch_embeddings, queries, is_query=True)
+        vector_store = get_vector_store()
+        if vector_store.in_process:
+            vector_results = await run_stage("vector", vector_store.query_batch, query_embeddings, match_count=20)
+        else:
+            vector_results = await asyncio.gather(*(
+                run_stage("vector", query_vectors, query_embedding, match_count=20)
+                for query_embedding in query_embeddings
+            ))
+        bm25_results = await bm25_task
+    finally:
+        bm25_task.cancel()
+    
+    with span("fusion"):
+        top_ids, top_documents, chunk_to_meta, signals = fuse_results(vector_results, bm25_results)
+    
+    reranked = await run_stage("rerank", reranker.rerank, query, top_documents, top_k=5, signals=signals,
+                               ids=top_ids)
+    with span("context"):
+        return build_context(query, *select_context(reranked, chunk_to_meta))
+
+async def rag_pipeline_async(query: str, reranker: str = None, timings: bool = False):
+    """Same result as rag_pipeline without blocking the event loop."""
+    with start_trace("rag_pipeline", reranker=reranker or settings.RERANKER) as trace:
+        result = None
+        if use_answer_cache(reranker):
+            result, embedding, version = await run_stage("embed", lookup_answer, query)
+            if result is not None:
+                print("⚡ Answer cache hit")
+        
+        if result is None:
+            final_documents, final_metadatas = await retrieve_context_async(query, reranker)
+            
+            context = "\n\n---\n\n".join(final_documents)
+            answer = await run_stage("generate", generate_answer, query, context, final_metadatas)
+            
+            result = {
+                "query": query,
+                "context": final_documents,
+                "metadatas": final_metadatas,
+                "answer": answer
+            }
+            if use_answer_cache(reranker):
+                answer_cache.store(query, embedding, result, version)
+    return with_timings(result, trace) if timings else result
+
+async def rag_pipeline_stream(query: str, reranker: str = None, timings: bool = False):
+    """
+    Streaming pipeline: yields (event, data) pairs.
+    "retrieval" carries the selected chunks as soon as they are known, then
+    "token" events carry answer text as it is generated, and "done" the full
+    answer (with the "timings" block when requested).
+    """
+    with start_trace("rag_pipeline_stream", reranker=reranker or settings.RERANKER) as trace:
+        if use_answer_cache(reranker):
+            cached, embedding, version = await run_stage("embed", lookup_answer, query)
+            if cached is not None:
+                print("⚡ Answer cache hit")
+                yield "retrieval", {"query": query, "context": cached["context"], "metadatas": cached["metadatas"]}
+                yield "token", {"text": cached["answer"]}
+                yield "done", with_timings({"answer": cached["answer"]}, trace) if timings else {"answer": cached["answer"]}
+                return
+        
+        final_documents, final_metadatas = await retrieve_context_async(query, reranker)
+        yield "retrieval", {"query": query, "context": final_documents, "metadatas": final_metadatas}
+        
+        context = "\n\n---\n\n".join(final_documents)
+        parts = []
+        async for text in iterate_stage("generate", generate_answer_stream, query, context, final_metadatas):
+            parts.append(text)
+            yield "token", {"text": text}
+        answer = "".join(parts)
+        yield "done", with_timings({"answer": answer}, trace) if timings else {"answer": answer}
+        
+        if use_answer_cache(reranker):
+            answer_cache.store(query, embedding, {
+                "query": query,
+                "context": final_documents,
+                "metadatas": final_metadatas,
+                "answer": answer
+            }, version)
+
 def summarize_text(text: str) -> str:
     """Generate a concise summary of the provided text"""
-    configure_gemini()
-    model = genai.GenerativeModel(settings.GEMINI_CHAT_MODEL)
-    
     prompt = f"""قم بتلخيص النص التالي في نقاط رئيسية مركزة وواضحة.
 الهدف هو استخراج أهم المعلومات والأفكار الواردة في النص.
 
@@ -355,8 +515,7 @@ def summarize_text(text: str) -> str:
 **الملخص:**
 """
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        return get_provider().generate(prompt)
     except Exception as e:
         print(f"Summarization error: {e}")
         return "عذراً، لم أتمكن من تلخيص النص. يرجى المحاولة مرة أخرى."
@@ -0,0 +1,141 @@
+"""
+Rerankers for the fused candidate list.
+
+Every reranker takes the query, the fused chunks (best first), their chunk
+ids and the retrieval signals collected during fusion (keyed by chunk id),
+and returns [(chunk id, chunk, score)] sorted best first:
+
+    local    CPU-only feature scorer (BM25, vector similarity, term
+             proximity, keyword overlap, fusion score), no network call
+    gemini   LLM relevance grading (rerank_with_gemini), opt-in
+    none     keeps the fusion order
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.tokenizer import get_tokenizer
+
+# Weights of the local scorer, in FEATURES order
+FEATURES = ("bm25", "vector", "proximity", "overlap", "fusion")
+LOCAL_WEIGHTS = np.array([0.25, 0.3, 0.2, 0.15, 0.1])
+
+
+def proximity_score(query_terms: set, doc_tokens: List[str]) -> float:
+    """
+    Coverage of the query terms times their density in the shortest window of
+    the document that contains all the matched ones: 1.0 when every query term
+    appears and they are adjacent.
+    """
+    hits = [(pos, token) for pos, token in enumerate(doc_tokens) if token in query_terms]
+    matched = len({token for _, token in hits})
+    if not matched:
+        return 0.0
+    counts = {}
+    best = len(doc_tokens)
+    start = 0
+    for end, (pos, token) in enumerate(hits):
+        counts[token] = counts.get(token, 0) + 1
+        while len(counts) == matched:
+            best = min(best, pos - hits[start][0] + 1)
+            first = hits[start][1]
+            counts[first] -= 1
+            if not counts[first]:
+                del counts[first]
+            start += 1
+    return (matched / len(query_terms)) * (matched / best)
+
+
+def _ids(chunks: List[str], ids: Sequence[int] = None) -> Sequence[int]:
+    # Without ids, a chunk is known by its position
+    return range(len(chunks)) if ids is None else ids
+
+
+def _ranked(chunks: List[str], ids: Sequence[int], scores, top_k: int) -> List[Tuple[int, str, float]]:
+    # Stable sort: ties keep the fusion order
+    order = np.argsort(-np.asarray(scores, dtype=float), kind="stable")[:top_k]
+    return [(ids[i], chunks[i], float(scores[i])) for i in order]
+
+
+def local_features(query: str, chunks: List[str], signals: Dict[int, dict] = None,
+                   ids: Sequence[int] = None) -> np.ndarray:
+    """Feature matrix (len(chunks), len(FEATURES)), each column scaled to [0, 1]."""
+    from app.services.rag import calculate_relevance_score
+
+    signals = signals or {}
+    tokenizer = get_tokenizer()
+    query_terms = set(tokenizer(query))
+    features = np.zeros((len(chunks), len(FEATURES)))
+    for i, (chunk_id, chunk) in enumerate(zip(_ids(chunks, ids), chunks)):
+        signal = signals.get(chunk_id, {})
+        features[i, 0] = signal.get("bm25", 0.0)
+        features[i, 1] = signal.get("vector", 0.0)
+        features[i, 2] = proximity_score(query_terms, tokenizer(chunk)) if query_terms else 0.0
+        features[i, 3] = calculate_relevance_score(query, chunk)
+        features[i, 4] = signal.get("fusion", 0.0)
+
+    # Scores on unbounded or small scales are made relative to the best candidate
+    for column in (0, 3, 4):
+        peak = features[:, column].max() if len(chunks) else 0.0
+        if peak > 0:
+            features[:, column] /= peak
+    np.clip(features, 0.0, 1.0, out=features)
+    return features
+
+
+class LocalReranker:
+    name = "local"
+
+    def __init__(self, weights: np.ndarray = LOCAL_WEIGHTS):
+        self.weights = np.asarray(weights, dtype=float)
+
+    def rerank(self, query: str, chunks: List[str], top_k: int = 5, signals: Dict[int, dict] = None,
+               ids: Sequence[int] = None) -> List[Tuple[int, str, float]]:
+        if not chunks:
+            return []
+        ids = _ids(chunks, ids)
+        return _ranked(chunks, ids, local_features(query, chunks, signals, ids) @ self.weights, top_k)
+
+
+class GeminiReranker:
+    name = "gemini"
+
+    def rerank(self, query: str, chunks: List[str], top_k: int = 5, signals: Dict[int, dict] = None,
+               ids: Sequence[int] = None) -> List[Tuple[int, str, float]]:
+        from app.services.rag import gemini_relevance_scores
+        scores = gemini_relevance_scores(query, chunks)
+        if scores is None:
+            # Grading failed: keep the fusion order
+            scores = [0.5] * len(chunks)
+        return _ranked(chunks, _ids(chunks, ids), scores, top_k)
+
+
+class FusionOrderReranker:
+    name = "none"
+
+    def rerank(self, query: str, chunks: List[str], top_k: int = 5, signals: Dict[int, dict] = None,
+               ids: Sequence[int] = None) -> List[Tuple[int, str, float]]:
+        signals = signals or {}
+        return [(chunk_id, chunk, signals.get(chunk_id, {}).get("fusion", 0.0))
+                for chunk_id, chunk in zip(_ids(chunks, ids)[:top_k], chunks[:top_k])]
+
+
+RERANKERS = {
+    "local": LocalReranker,
+    "gemini": GeminiReranker,
+    "none": FusionOrderReranker,
+}
+
+_rerankers = {}
+
+
+def get_reranker(name: str = None):
+    """Returns the (cached) reranker registered under `name`, or the configured default."""
+    if name is None:
+        name = settings.RERANKER
+    if name not in _rerankers:
+        if name not in RERANKERS:
+            raise ValueError(f"Unknown reranker '{name}'. Available: {', '.join(RERANKERS)}")
+        _rerankers[name] = RERANKERS[name]()
+    return _rerankers[name]
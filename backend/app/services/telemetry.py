@@ -0,0 +1,314 @@
+"""
+Per-stage timing spans and Prometheus metrics for the RAG pipeline.
+
+Spans
+    `start_trace(name)` opens the root span of a query and `span(stage)` the
+    span of a pipeline stage (run_stage opens one per call, so every stage run
+    on the executor is covered). The current span lives in a contextvar, which
+    asyncio tasks inherit and run_stage copies into the worker thread, so
+    stages started from anywhere in the query nest under its root. Finished
+    spans are kept on the trace with OpenTelemetry field names (trace_id,
+    span_id, parent_span_id, start/end_time_unix_nano, attributes, status) and
+    returned as the optional `timings` block of /api/query. When the
+    opentelemetry API is installed, every span is also started as an
+    OpenTelemetry span (exported by whatever SDK the deployment configures)
+    and takes its ids.
+
+Metrics
+    Stage durations and external calls (Gemini, database) go into in-process
+    histograms and counters; /api/metrics renders them in the Prometheus text
+    format together with gauges read at scrape time (cache hit ratios, BM25
+    corpus size, index memory).
+"""
+import contextvars
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Dict, List, Optional
+
+try:
+    from opentelemetry import trace as otel_trace
+    _tracer = otel_trace.get_tracer("nibrasse.rag")
+except ImportError:
+    otel_trace = None
+    _tracer = None
+
+PREFIX = "nibrasse"
+# Seconds; Prometheus client defaults plus 30s for slow generations
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# --- Metrics -------------------------------------------------------------------
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.label_names = f"{PREFIX}_{name}", help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name, self.help, self.label_names, self.buckets = f"{PREFIX}_{name}", help, labels, buckets
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                    cumulative += count
+                    le = _labels(self.label_names + ("le",), labels + (f"{bound:g}" if bound != "+Inf" else bound,))
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+def _samples(name: str, help: str, samples: list, kind: str = "gauge") -> List[str]:
+    """Lines of a metric from (labels dict, value) samples read at scrape time."""
+    name = f"{PREFIX}_{name}"
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value:g}")
+    return lines
+
+
+stage_seconds = Histogram("stage_duration_seconds", "Duration of RAG pipeline stages.", ("stage",))
+external_calls = Counter("external_calls_total", "Calls to external services.", ("service", "operation"))
+external_errors = Counter("external_call_errors_total", "Failed calls to external services.", ("service", "operation"))
+external_seconds = Histogram("external_call_duration_seconds", "Duration of calls to external services.",
+                             ("service", "operation"))
+
+
+@contextmanager
+def external_call(service: str, operation: str):
+    """Counts and times one call to an external service (failures included)."""
+    external_calls.inc(service, operation)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        external_errors.inc(service, operation)
+        raise
+    finally:
+        external_seconds.observe(time.perf_counter() - started, service, operation)
+
+
+def _cache_samples() -> Dict[str, list]:
+    from app.services.answer_cache import answer_cache
+    from app.services.embedding_cache import embedding_cache
+    from app.services.query_expansion import expansion_cache
+
+    embedding = embedding_cache.stats()
+    answer = answer_cache.stats()
+    caches = {
+        "embedding": (embedding["hits_memory"] + embedding["hits_disk"], embedding["misses"]),
+        "answer": (answer["hits_exact"] + answer["hits_semantic"], answer["misses"]),
+        "query_expansion": (expansion_cache.hits, expansion_cache.misses),
+    }
+    return {
+        "hits": [({"cache": name}, hits) for name, (hits, _) in caches.items()],
+        "misses": [({"cache": name}, misses) for name, (_, misses) in caches.items()],
+        "ratio": [({"cache": name}, hits / (hits + misses) if hits + misses else 0.0)
+                  for name, (hits, misses) in caches.items()],
+    }
+
+
+def render_metrics() -> str:
+    """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+    from app.services.bm25_service import bm25_service
+    from app.services.vector_store import get_vector_store
+
+    lines = []
+    for metric in (stage_seconds, external_calls, external_errors, external_seconds):
+        lines.extend(metric.render())
+
+    caches = _cache_samples()
+    lines.extend(_samples("cache_hits_total", "Cache hits since start.", caches["hits"], "counter"))
+    lines.extend(_samples("cache_misses_total", "Cache misses since start.", caches["misses"], "counter"))
+    lines.extend(_samples("cache_hit_ratio", "Cache hits / lookups since start.", caches["ratio"]))
+
+    index = bm25_service.bm25
+    lines.extend(_samples("bm25_chunks", "Live chunks in the BM25 index.", [({}, index.num_docs if index else 0)]))
+    lines.extend(_samples("bm25_terms", "Distinct terms in the BM25 index.", [({}, len(index.doc_freq) if index else 0)]))
+    vector_stats = get_vector_store().stats()
+    lines.extend(_samples("index_memory_bytes", "Approximate heap size of the in-process indexes.", [
+        ({"index": "bm25"}, index.memory_usage() if index else 0),
+        ({"index": "vector"}, vector_stats.get("bytes", 0)),
+    ]))
+    if "vectors" in vector_stats:
+        lines.extend(_samples("vector_chunks", "Vectors in the local vector index.", [({}, vector_stats["vectors"])]))
+    return "\n".join(lines) + "\n"
+
+
+# --- Spans ---------------------------------------------------------------------
+
+_current = contextvars.ContextVar("nibrasse_span", default=None)
+
+
+class Span:
+    def __init__(self, trace: Optional["Trace"], name: str, parent_span_id: Optional[str], attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = "OK"
+        self.otel = None
+        self._started = time.perf_counter()
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+        if self.otel is not None:
+            self.otel.set_attribute(key, value)
+
+    def finish(self):
+        self.end_ns = self.start_ns + int((time.perf_counter() - self._started) * 1e9)
+
+    @property
+    def duration(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e9 if self.end_ns else time.perf_counter() - self._started
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace.trace_id if self.trace else None,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.root = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def timings(self) -> dict:
+        """
+        The `timings` block: total and per-stage milliseconds (a stage run
+        several times, e.g. one vector search per query variant, is summed),
+        then every finished span.
+        """
+        root = self.root
+        with self._lock:
+            # The root is still open when timings are sent before the end of a stream
+            spans = sorted(set(self.spans) | {root}, key=lambda s: s.start_ns)
+        stages = {}
+        for s in spans:
+            if s is not root:
+                stages[s.name] = round(stages.get(s.name, 0.0) + s.duration * 1000, 3)
+        return {
+            "trace_id": self.trace_id,
+            "total_ms": round(root.duration * 1000, 3),
+            "stages": stages,
+            "spans": [s.to_dict() for s in spans],
+        }
+
+
+@contextmanager
+def _run(current: Span):
+    token = _current.set(current)
+    with ExitStack() as stack:
+        if _tracer is not None:
+            current.otel = stack.enter_context(_tracer.start_as_current_span(current.name, attributes=dict(current.attributes)))
+            context = current.otel.get_span_context()
+            if context.is_valid:
+                # An SDK is configured: share its ids so both views of the trace match
+                current.span_id = f"{context.span_id:016x}"
+                if current.trace is not None:
+                    current.trace.trace_id = f"{context.trace_id:032x}"
+        try:
+            yield current
+        except BaseException as e:
+            current.status = "ERROR"
+            current.attributes["error"] = repr(e)
+            raise
+        finally:
+            current.finish()
+            try:
+                _current.reset(token)
+            except ValueError:
+                pass  # async generator closed from another context (e.g. client gone mid-stream)
+            stage_seconds.observe(current.duration, current.name)
+            if current.trace is not None:
+                current.trace.add(current)
+
+
+def span(name: str, **attributes):
+    """
+    Context manager timing a stage: always recorded in stage_duration_seconds,
+    and added to the current trace (if any) as a child of the current span.
+    """
+    parent = _current.get()
+    if parent is None:
+        return _run(Span(None, name, None, attributes))
+    return _run(Span(parent.trace, name, parent.span_id, attributes))
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Root span of a new trace; yields the Trace (see Trace.timings)."""
+    trace = Trace()
+    trace.root = Span(trace, name, None, attributes)
+    with _run(trace.root):
+        yield trace
+
+
+def current_trace() -> Optional[Trace]:
+    current = _current.get()
+    return current.trace if current is not None else None
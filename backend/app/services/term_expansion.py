@@ -0,0 +1,177 @@
+"""
+Corpus-derived query expansion terms.
+
+Built from the BM25 corpus and stored next to it (INDEX_DIR/expansion.npz):
+for every term of the vocabulary, its nearest neighbours by normalized
+pointwise mutual information (NPMI) of chunk-level co-occurrence:
+
+    npmi(a, b) = log(p(a, b) / (p(a) p(b))) / -log(p(a, b))
+
+Terms are compared by their light stem (so "اللغة" and "لغتنا" count as one
+term) and are written back with their most frequent surface form, so the
+expansion can be appended to a query sent to the embedding model.
+
+Expanding a query is a few dictionary lookups; the table is rebuilt when the
+corpus has grown or shrunk by QUERY_EXPANSION_REBUILD_RATIO since the last build.
+"""
+import os
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+
+from app.services.tokenizer import STOPWORDS, light_stem, normalize, surface_tokens
+
+FILE_NAME = "expansion.npz"
+# Pairs buffered before they are counted with np.unique
+_FLUSH_PAIRS = 2_000_000
+
+
+# A corpus has far fewer distinct words than words
+@lru_cache(maxsize=1 << 18)
+def _stem(word: str) -> Optional[str]:
+    """Stem of a surface word, None for stopwords and words that normalize to less than two letters."""
+    normalized = normalize(word)
+    if normalized in STOPWORDS or len(normalized) < 2:
+        return None
+    return light_stem(normalized)
+
+
+def analyze(text: str) -> List[tuple]:
+    """(stem, surface form) of every non-stopword word of `text`."""
+    # Each word is normalized on its own, so a stem always sits next to its own surface form
+    return [(stem, word) for word in surface_tokens(text) if (stem := _stem(word)) is not None]
+
+
+def _count(keys: List[np.ndarray], acc_keys: np.ndarray, acc_counts: np.ndarray):
+    keys = np.concatenate([acc_keys] + keys)
+    weights = np.concatenate([acc_counts, np.ones(len(keys) - len(acc_keys), dtype=np.int64)])
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=weights, minlength=len(unique)).astype(np.int64)
+
+
+class TermExpansion:
+    def __init__(self, stems: List[str], surfaces: List[str], ptr: np.ndarray, ids: np.ndarray,
+                 scores: np.ndarray, num_docs: int):
+        self.stems = list(stems)
+        self.surfaces = list(surfaces)
+        self.ptr = ptr          # neighbours of term i are ids[ptr[i]:ptr[i + 1]], best first
+        self.ids = ids
+        self.scores = scores
+        self.num_docs = num_docs
+        self._id = {stem: i for i, stem in enumerate(self.stems)}
+
+    def __len__(self) -> int:
+        return len(self.stems)
+
+    @classmethod
+    def build(cls, texts, min_df: int = 3, max_df_ratio: float = 0.1, max_vocab: int = 50000,
+              terms_per_doc: int = 32, neighbours: int = 10, min_count: int = 2) -> "TermExpansion":
+        """
+        Builds the table from an iterable factory `texts` (called twice: one
+        pass for document frequencies, one for co-occurrences). A chunk
+        contributes the pairs of its `terms_per_doc` rarest vocabulary terms.
+        """
+        started = time.perf_counter()
+        df = Counter()
+        num_docs = 0
+        for text in texts():
+            df.update({stem for stem, _ in analyze(text)})
+            num_docs += 1
+        max_df = max(min_df, int(max_df_ratio * num_docs))
+        vocab = [stem for stem, count in df.most_common() if min_df <= count <= max_df][:max_vocab]
+        term_id = {stem: i for i, stem in enumerate(vocab)}
+        vocab_df = np.array([df[stem] for stem in vocab], dtype=np.int64)
+        size = len(vocab)
+
+        forms = [Counter() for _ in vocab]
+        pending, pending_pairs = [], 0
+        acc_keys, acc_counts = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        for text in texts():
+            ids = set()
+            for stem, word in analyze(text):
+                i = term_id.get(stem)
+                if i is not None:
+                    ids.add(i)
+                    forms[i][word] += 1
+            if len(ids) < 2:
+                continue
+            ids = np.fromiter(ids, dtype=np.int64, count=len(ids))
+            if len(ids) > terms_per_doc:
+                ids = ids[np.argsort(vocab_df[ids], kind="stable")[:terms_per_doc]]
+            ids.sort()
+            a, b = np.triu_indices(len(ids), 1)
+            pending.append(ids[a] * size + ids[b])
+            pending_pairs += len(a)
+            if pending_pairs >= _FLUSH_PAIRS:
+                acc_keys, acc_counts = _count(pending, acc_keys, acc_counts)
+                pending, pending_pairs = [], 0
+        if pending:
+            acc_keys, acc_counts = _count(pending, acc_keys, acc_counts)
+
+        keep = acc_counts >= min_count
+        a, b = np.divmod(acc_keys[keep], max(size, 1))
+        count = acc_counts[keep].astype(np.float64)
+        p_ab = count / max(num_docs, 1)
+        npmi = np.log(p_ab / ((vocab_df[a] / num_docs) * (vocab_df[b] / num_docs))) / -np.log(p_ab)
+        positive = npmi > 0
+        src = np.concatenate([a[positive], b[positive]])
+        dst = np.concatenate([b[positive], a[positive]])
+        score = np.concatenate([npmi[positive], npmi[positive]]).astype(np.float32)
+
+        order = np.lexsort((-score, src))
+        src, dst, score = src[order], dst[order], score[order]
+        starts = np.searchsorted(src, np.arange(size))
+        rank = np.arange(len(src)) - starts[src] if len(src) else np.empty(0, dtype=np.int64)
+        top = rank < neighbours
+        src, dst, score = src[top], dst[top], score[top]
+        ptr = np.searchsorted(src, np.arange(size + 1)).astype(np.int64)
+
+        surfaces = [counts.most_common(1)[0][0] if counts else stem for stem, counts in zip(vocab, forms)]
+        print(f"✅ Expansion table built: {size} terms, {len(dst)} neighbours from {num_docs} chunks "
+              f"in {time.perf_counter() - started:.1f}s")
+        return cls(vocab, surfaces, ptr, dst.astype(np.int32), score, num_docs)
+
+    def neighbours(self, stem: str) -> List[tuple]:
+        """(surface form, npmi) of the neighbours of a stem, best first."""
+        i = self._id.get(stem)
+        if i is None:
+            return []
+        lo, hi = self.ptr[i], self.ptr[i + 1]
+        return [(self.surfaces[j], float(s)) for j, s in zip(self.ids[lo:hi], self.scores[lo:hi])]
+
+    def expand(self, query: str, limit: int = 6, min_score: float = 0.1) -> List[str]:
+        """
+        Surface forms of the terms most associated with the query terms; a
+        term related to several query terms adds up their scores.
+        """
+        query_ids = {self._id[stem] for stem, _ in analyze(query) if stem in self._id}
+        scores = {}
+        for i in query_ids:
+            lo, hi = self.ptr[i], self.ptr[i + 1]
+            for j, s in zip(self.ids[lo:hi].tolist(), self.scores[lo:hi].tolist()):
+                if j not in query_ids and s >= min_score:
+                    scores[j] = scores.get(j, 0.0) + s
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return [self.surfaces[j] for j in best]
+
+    # --- Persistence -----------------------------------------------------
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, FILE_NAME)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, stems=np.array(self.stems, dtype=str), surfaces=np.array(self.surfaces, dtype=str),
+                 ptr=self.ptr, ids=self.ids, scores=self.scores, num_docs=np.int64(self.num_docs))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["TermExpansion"]:
+        path = os.path.join(directory, FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return cls(data["stems"].tolist(), data["surfaces"].tolist(), data["ptr"], data["ids"],
+                       data["scores"], int(data["num_docs"]))
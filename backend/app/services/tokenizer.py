@@ -0,0 +1,138 @@
+"""
+Arabic-aware tokenizer shared by BM25 indexing, BM25 queries and the lexical reranker.
+
+The same pipeline must run at index time and query time, so every caller goes
+through get_tokenizer() instead of splitting text itself.
+"""
+import re
+import sys
+from typing import List
+
+from app.core.config import settings
+
+# Tashkeel, Quranic marks and superscript alef
+_DIACRITICS = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06DC\u06DF-\u06E8\u06EA-\u06ED]")
+_TATWEEL = "\u0640"
+_CHAR_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+    "ؤ": "و",
+    "ئ": "ي",
+    _TATWEEL: None,
+})
+# Letters and digits only: punctuation (Arabic or Latin), newlines and symbols all split tokens
+_TOKEN = re.compile(r"[^\W_]+")
+
+# Longest first so "وال" wins over "و"
+_PREFIXES = ("وبال", "وكال", "وال", "بال", "كال", "فال", "لل", "ال")
+_SUFFIXES = ("هما", "كما", "تين", "ات", "ان", "ون", "ين", "يه", "ها", "هم", "هن", "كم", "نا", "ه", "ي")
+
+_STOPWORDS_RAW = {
+    # Arabic
+    "في", "من", "على", "إلى", "عن", "مع", "ما", "ماذا", "هل", "لم", "لن", "لا", "أن", "إن", "أو", "ثم",
+    "هذا", "هذه", "ذلك", "تلك", "هؤلاء", "التي", "الذي", "الذين", "كان", "كانت", "قد", "كل", "بين",
+    "عند", "هو", "هي", "هم", "كما", "حيث", "أي", "إذا", "و", "ف", "ب", "ل", "ك", "بعد", "قبل", "حتى",
+    "كيف", "لماذا", "متى", "أين", "ذات", "غير", "هناك", "أيضا", "فيها", "فيه", "منها", "منه", "به", "بها",
+    # French
+    "le", "la", "les", "de", "des", "du", "un", "une", "et", "en", "dans", "pour", "est", "sont", "au", "aux",
+    # English
+    "the", "a", "an", "of", "and", "in", "to", "is", "are", "for", "on", "what", "how",
+}
+
+
+def normalize(text: str) -> str:
+    """Strips diacritics/tatweel, unifies alef, ya, ta marbuta and hamza carriers, lowercases."""
+    return _DIACRITICS.sub("", text).translate(_CHAR_MAP).lower()
+
+
+def surface_tokens(text: str) -> List[str]:
+    """Words of `text` as written, without diacritics or tatweel and lowercased (letters are not unified)."""
+    return _TOKEN.findall(_DIACRITICS.sub("", text).replace(_TATWEEL, "").lower())
+
+
+STOPWORDS = frozenset(normalize(w) for w in _STOPWORDS_RAW)
+
+
+def light_stem(token: str) -> str:
+    """Light10-style stemming: one article/conjunction prefix and one suffix, keeping a 3-letter stem."""
+    for prefix in _PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= 2:
+            token = token[len(prefix):]
+            break
+    else:
+        if len(token) >= 4 and token[0] == "و":
+            token = token[1:]
+    for suffix in _SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+class Tokenizer:
+    """Normalization -> regex tokenization -> stopword filtering -> light stemming."""
+
+    def __init__(self, name: str, normalize: bool = True, stem: bool = True,
+                 stopwords: bool = True, intern: bool = True):
+        self.name = name
+        self._normalize = normalize
+        self._stem = stem
+        self._stopwords = stopwords
+        self._intern = intern
+
+    def __call__(self, text: str) -> List[str]:
+        return self.tokenize(text)
+
+    def tokenize(self, text: str) -> List[str]:
+        if self._normalize:
+            text = normalize(text)
+        tokens = _TOKEN.findall(text)
+        if self._stopwords:
+            tokens = [t for t in tokens if t not in STOPWORDS]
+        if self._stem:
+            tokens = [light_stem(t) for t in tokens]
+        if self._intern:
+            # One shared str object per distinct token across the whole corpus
+            tokens = [sys.intern(t) for t in tokens]
+        return tokens
+
+
+class WhitespaceTokenizer:
+    """The original `text.split(" ")` behaviour, kept for comparison benchmarks."""
+
+    name = "whitespace"
+
+    def __call__(self, text: str) -> List[str]:
+        return self.tokenize(text)
+
+    def tokenize(self, text: str) -> List[str]:
+        return text.split(" ")
+
+
+TOKENIZERS = {
+    "arabic": lambda: Tokenizer("arabic"),
+    "arabic-nostem": lambda: Tokenizer("arabic-nostem", stem=False),
+    "whitespace": WhitespaceTokenizer,
+}
+
+_tokenizers = {}
+
+# Approximate embedding/LLM model tokens: SentencePiece vocabularies cut Arabic and
+# Latin words into pieces of about 4 characters; punctuation marks are tokens of their own.
+TOKEN_PIECE = re.compile(r"\w{1,4}|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Local estimate of a Gemini model's token count for `text` (no API call)."""
+    return sum(1 for _ in TOKEN_PIECE.finditer(text))
+
+
+def get_tokenizer(name: str = None):
+    """Returns the (cached) tokenizer registered under `name`, or the configured default."""
+    if name is None:
+        name = settings.TOKENIZER
+    if name not in _tokenizers:
+        if name not in TOKENIZERS:
+            raise ValueError(f"Unknown tokenizer '{name}'. Available: {', '.join(TOKENIZERS)}")
+        _tokenizers[name] = TOKENIZERS[name]()
+    return _tokenizers[name]
@@ -0,0 +1,471 @@
+"""
+In-process vector index for the chunk embeddings.
+
+Rows are L2-normalized once when added, so cosine similarity is a plain dot
+product: a search is one (rows x dim) @ (dim x variants) matmul per segment
+followed by argpartition, for all query variants at once. Storage mirrors the
+BM25 index: immutable memory-mapped segments, an in-memory tail for rows not
+flushed yet, a tombstone bitmap and a JSON manifest swapped atomically.
+
+Rows can be stored as float32 or as int8 with one float32 scale per row
+(4x smaller, similarities within ~1e-2). For large corpora an IVF index
+(spherical k-means centroids, probing the `nprobe` closest lists) is trained
+in memory in the background (LocalVectorStore.ensure_ivf), so once it is
+ready only a fraction of the rows is scored.
+
+Only vectors and integer ids are stored here: chunk texts and metadata live
+once, in the BM25 index's chunk columns, and are resolved by chunk id through
+ChunkRegistry for the rows a search returns.
+"""
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.services import bm25_store
+from app.services.bm25_store import SectionFile
+
+FORMAT = "nibrasse-vectors"
+FORMAT_VERSION = 2
+MAGIC = b"NBVECSEG"
+MAX_SEGMENTS = 8
+# Rows converted from int8 per matmul, bounds the temporary float32 copy
+BLOCK_ROWS = 16384
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: vectors ~= codes * scales[:, None]."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class MemoryRows:
+    """
+    Rows added since the last save, kept as float32 until flushed. Appended
+    batches are kept as a list of blocks and stacked once when the rows are
+    read, so a bulk ingest that adds many batches before one save stays linear.
+    """
+
+    def __init__(self, base: int, dim: int):
+        self.base = base
+        self.dim = dim
+        self._blocks = []  # (vectors, chunk ids, document ids) per batch, stacked into one block on read
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, vectors, chunk_ids, document_ids):
+        self._blocks.append((np.asarray(vectors, dtype=np.float32),
+                             np.asarray(chunk_ids, dtype=np.int64),
+                             np.asarray(document_ids, dtype=np.int64)))
+        self._count += len(self._blocks[-1][0])
+
+    def _stacked(self):
+        if not self._blocks:
+            return np.empty((0, self.dim), dtype=np.float32), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if len(self._blocks) > 1:
+            self._blocks = [tuple(np.concatenate(column) for column in zip(*self._blocks))]
+        return self._blocks[0]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._stacked()[0]
+
+    @property
+    def chunk_ids(self) -> np.ndarray:
+        return self._stacked()[1]
+
+    @property
+    def document_ids(self) -> np.ndarray:
+        return self._stacked()[2]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(vectors.nbytes for vectors, _, _ in self._blocks)
+
+    def rows(self, local) -> np.ndarray:
+        return self.vectors[local]
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        return self.vectors @ queries.T
+
+
+class VectorSegment(SectionFile):
+    """Read-only, memory-mapped segment of rows (float32, or int8 codes plus row scales)."""
+
+    MAGIC = MAGIC
+    VERSION = FORMAT_VERSION
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.base = self.header["base"]
+        self.dim = self.header["dim"]
+        self.num_rows = self.header["num_rows"]
+        self.matrix = self.vectors.reshape(self.num_rows, self.dim)
+        self.quantized = self.matrix.dtype == np.int8
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def rows(self, local) -> np.ndarray:
+        rows = self.matrix[local]
+        if self.quantized:
+            rows = rows.astype(np.float32) * self.scales[local][..., None]
+        return rows
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        if not self.quantized:
+            return self.matrix @ queries.T
+        out = np.empty((self.num_rows, len(queries)), dtype=np.float32)
+        for start in range(0, self.num_rows, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, self.num_rows)
+            out[start:end] = (self.matrix[start:end].astype(np.float32) @ queries.T) * self.scales[start:end, None]
+        return out
+
+
+def write_vector_segment(path: str, base: int, vectors: np.ndarray, quantized: bool,
+                         chunk_ids, document_ids):
+    if quantized:
+        codes, scales = quantize(vectors)
+    else:
+        codes, scales = vectors.astype(np.float32), np.empty(0, dtype=np.float32)
+    bm25_store.write_sections(path, MAGIC, FORMAT_VERSION, {"base": base, "dim": vectors.shape[1], "num_rows": len(vectors)}, [
+        ("vectors", codes.reshape(-1)),
+        ("scales", scales),
+        ("chunk_ids", np.asarray(chunk_ids, dtype=np.int64)),
+        ("document_ids", np.asarray(document_ids, dtype=np.int64)),
+    ])
+
+
+class IVF:
+    """Inverted file over the rows: centroids plus, for each list, the global row ids assigned to it."""
+
+    def __init__(self, centroids: np.ndarray, assignment: np.ndarray):
+        self.centroids = centroids
+        self.assignment = assignment  # list id per global row, -1 once deleted
+        self._lists = None
+
+    @classmethod
+    def train(cls, rows: np.ndarray, row_ids: np.ndarray, num_slots: int, nlist: int, iterations: int = 10, seed: int = 0):
+        """Spherical k-means on a sample of the rows, then assigns every row."""
+        rng = np.random.default_rng(seed)
+        sample = rows[rng.choice(len(rows), size=min(len(rows), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            # Re-seed empty lists with random sample rows
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        assignment = np.full(num_slots, -1, dtype=np.int32)
+        ivf = cls(centroids, assignment)
+        ivf.assign(row_ids, rows)
+        return ivf
+
+    def assign(self, row_ids: np.ndarray, rows: np.ndarray):
+        if len(row_ids) and row_ids.max() >= len(self.assignment):
+            grown = np.full(int(row_ids.max()) + 1, -1, dtype=np.int32)
+            grown[:len(self.assignment)] = self.assignment
+            self.assignment = grown
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            self.assignment[row_ids[start:start + BLOCK_ROWS]] = np.argmax(block @ self.centroids.T, axis=1)
+        self._lists = None
+
+    def remove(self, row_ids):
+        self.assignment[np.asarray(row_ids, dtype=np.int64)] = -1
+        self._lists = None
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Global row ids of the `nprobe` lists closest to the query, ascending."""
+        if self._lists is None:
+            order = np.argsort(self.assignment, kind="stable")
+            counts = np.bincount(self.assignment[self.assignment >= 0], minlength=len(self.centroids))
+            start = int((self.assignment < 0).sum())
+            self._lists = (order, np.concatenate([[start], start + np.cumsum(counts)]))
+        order, offsets = self._lists
+        nprobe = min(nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in probe]))
+
+
+class VectorIndex:
+    def __init__(self, dim: int = None, quantized: bool = False):
+        self.dim = dim
+        self.quantized = quantized
+        self.segments: List[VectorSegment] = []
+        self.tail = MemoryRows(0, dim or 0)
+        self.deleted = bytearray()  # one byte per global row
+        self.num_live = 0
+        self.directory = None
+        self.generation = 0
+        self.ivf: Optional[IVF] = None
+        self._manifest_mtime = None
+        self._removed = set()  # chunk ids of saved rows removed since then (replayed by _rebase)
+        self._layout = 0       # bumped when row ids change (rebase): an IVF trained before is discarded
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        """Number of row slots (deleted rows keep their slot until a rebuild)."""
+        return len(self.deleted)
+
+    def _parts(self):
+        return [*self.segments, self.tail]
+
+    def _locate(self, row: int):
+        for part in self._parts():
+            if part.base <= row < part.base + len(part):
+                return part, row - part.base
+        raise IndexError(row)
+
+    def add(self, vectors, chunk_ids, document_ids):
+        vectors = normalize_rows(vectors)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.tail = MemoryRows(len(self), self.dim)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+            start = len(self)
+            self.tail.append(vectors, chunk_ids, document_ids)
+            self.deleted.extend(bytes(len(vectors)))
+            self.num_live += len(vectors)
+            if self.ivf is not None:
+                self.ivf.assign(np.arange(start, start + len(vectors)), vectors)
+
+    def find_document(self, document_id) -> List[int]:
+        with self._lock:
+            rows = []
+            for part in self._parts():
+                local = np.flatnonzero(np.asarray(part.document_ids) == int(document_id))
+                rows.extend(int(part.base + i) for i in local if not self.deleted[part.base + i])
+            return rows
+
+    def remove(self, rows: List[int]):
+        with self._lock:
+            for row in rows:
+                if not self.deleted[row]:
+                    self.deleted[row] = 1
+                    self.num_live -= 1
+                    if row < self.tail.base:
+                        self._removed.add(self.chunk_id(row))
+            if self.ivf is not None:
+                self.ivf.remove(rows)
+
+    def chunk_table(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(chunk ids, document ids) of the live rows."""
+        with self._lock:
+            live = np.frombuffer(self.deleted, dtype=np.uint8) == 0 if len(self) else np.empty(0, dtype=bool)
+            chunk_ids = np.concatenate([np.asarray(p.chunk_ids, dtype=np.int64) for p in self._parts()])
+            document_ids = np.concatenate([np.asarray(p.document_ids, dtype=np.int64) for p in self._parts()])
+            return chunk_ids[live], document_ids[live]
+
+    def chunk_id(self, row: int) -> int:
+        part, local = self._locate(row)
+        return int(part.chunk_ids[local])
+
+    def build_ivf(self, nlist: int = None):
+        """
+        Trains the in-memory IVF on the live rows (nlist defaults to ~sqrt(rows)).
+        k-means runs outside the index lock, so searches keep using the exact
+        scan meanwhile; rows added or removed during training are applied
+        before the IVF is installed.
+        """
+        with self._lock:
+            live = np.flatnonzero(np.frombuffer(self.deleted, dtype=np.uint8) == 0)
+            nlist = nlist or max(1, int(np.sqrt(len(live))))
+            if len(live) < nlist:
+                self.ivf = None
+                return
+            rows, num_slots, layout = self._gather(live), len(self), self._layout
+        ivf = IVF.train(rows, live, num_slots, nlist)
+        with self._lock:
+            if layout != self._layout:
+                return  # rows were renumbered meanwhile; the next ensure_ivf retrains
+            if len(self) > num_slots:
+                added = np.arange(num_slots, len(self))
+                ivf.assign(added, self._gather(added))
+            ivf.remove(np.flatnonzero(np.frombuffer(self.deleted, dtype=np.uint8)[:num_slots] != 0))
+            self.ivf = ivf
+
+    def _gather(self, rows: np.ndarray) -> np.ndarray:
+        """float32 rows for ascending global row ids."""
+        out = np.empty((len(rows), self.dim), dtype=np.float32)
+        for part in self._parts():
+            lo, hi = np.searchsorted(rows, [part.base, part.base + len(part)])
+            if hi > lo:
+                out[lo:hi] = part.rows(rows[lo:hi] - part.base)
+        return out
+
+    def search(self, queries, k: int = 10, threshold: float = None, nprobe: int = None) -> List[List[Tuple[int, float]]]:
+        """
+        Top-k rows by cosine similarity for each query, best first.
+        Rows at or below `threshold` are dropped (match_documents semantics).
+        Uses the IVF index when one is built and `nprobe` is given.
+        """
+        queries = normalize_rows(queries)
+        with self._lock:
+            if not self.num_live:
+                return [[] for _ in queries]
+            if self.ivf is not None and nprobe:
+                return [self._search_rows(self.ivf.candidates(q, nprobe), q[None, :], k, threshold)[0] for q in queries]
+            scores = np.concatenate([part.scores(queries) for part in self._parts() if len(part)])
+            scores[np.frombuffer(self.deleted, dtype=np.uint8) != 0] = -np.inf
+            return [self._top(np.arange(len(self)), scores[:, j], k, threshold) for j in range(len(queries))]
+
+    def _search_rows(self, rows: np.ndarray, queries: np.ndarray, k: int, threshold: float):
+        rows = rows[np.frombuffer(self.deleted, dtype=np.uint8)[rows] == 0]
+        scores = self._gather(rows) @ queries.T
+        return [self._top(rows, scores[:, j], k, threshold) for j in range(len(queries))]
+
+    @staticmethod
+    def _top(rows: np.ndarray, scores: np.ndarray, k: int, threshold: float):
+        if threshold is not None:
+            keep = scores > threshold
+            rows, scores = rows[keep], scores[keep]
+        else:
+            keep = np.isfinite(scores)
+            rows, scores = rows[keep], scores[keep]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def save(self, directory: str, replace: bool = False):
+        """
+        Flushes the tail as a new segment, merges small segments and swaps the
+        manifest, under the directory's inter-process lock. Changes are
+        replayed on top of an index another process saved meanwhile, as in
+        BM25Index.save; `replace` overwrites it instead (full rebuilds).
+        """
+        with self._lock, bm25_store.directory_lock(directory):
+            os.makedirs(directory, exist_ok=True)
+            if directory != self.directory and self.segments:
+                raise ValueError("Cannot save an index with on-disk segments into another directory")
+            on_disk = bm25_store.manifest_generation(directory)
+            if not replace and on_disk and (directory != self.directory or on_disk != self.generation):
+                self._rebase(directory)
+            else:
+                self.generation = max(self.generation, on_disk)
+            self.generation += 1
+            gen = self.generation
+
+            if len(self.tail):
+                path = os.path.join(directory, f"seg-{gen:06d}.bin")
+                self._write_segment(path, [self.tail])
+                self.segments.append(VectorSegment(path))
+                self.tail = MemoryRows(len(self), self.dim)
+
+            merge = 0
+            while len(self.segments) > MAX_SEGMENTS:
+                sizes = [len(a) + len(b) for a, b in zip(self.segments, self.segments[1:])]
+                i = sizes.index(min(sizes))
+                merge += 1
+                path = os.path.join(directory, f"seg-{gen:06d}-{merge}.bin")
+                self._write_segment(path, self.segments[i:i + 2])
+                self.segments[i:i + 2] = [VectorSegment(path)]
+
+            deleted_file = None
+            if any(self.deleted):
+                deleted_file = f"deleted-{gen:06d}.bin"
+                bm25_store.atomic_write(os.path.join(directory, deleted_file), [bytes(self.deleted)])
+
+            segment_files = [os.path.basename(s.path) for s in self.segments]
+            bm25_store.write_manifest(directory, {
+                "generation": gen,
+                "dim": self.dim,
+                "quantized": self.quantized,
+                "num_slots": len(self),
+                "segments": segment_files,
+                "deleted": deleted_file,
+            }, FORMAT, FORMAT_VERSION)
+            self.directory = directory
+            self._manifest_mtime = bm25_store.manifest_mtime(directory)
+            self._removed = set()
+            bm25_store.remove_unreferenced(directory, set(segment_files) | {deleted_file})
+
+    def _rebase(self, directory: str):
+        """
+        Moves the unsaved changes (tail rows, removals of saved rows) onto the
+        index another process saved in `directory` and adopts it, matching
+        rows by chunk id. Row ids change, so the IVF is dropped (rebuilt later).
+        """
+        base = VectorIndex._open(directory)
+        if self.dim is not None and base.dim is not None and base.dim != self.dim:
+            raise ValueError(f"Index in {directory} has dimension {base.dim}, this one {self.dim}")
+        chunk_ids = np.concatenate([np.asarray(p.chunk_ids, dtype=np.int64) for p in base._parts()])
+        live = np.frombuffer(base.deleted, dtype=np.uint8) == 0 if len(base) else np.empty(0, dtype=bool)
+        removed = np.fromiter(self._removed, dtype=np.int64, count=len(self._removed))
+        base.remove(np.flatnonzero(live & np.isin(chunk_ids, removed)).tolist())
+
+        tail = self.tail
+        keep = np.frombuffer(self.deleted, dtype=np.uint8)[tail.base:] == 0
+        keep &= ~np.isin(tail.chunk_ids, chunk_ids[live])
+        if keep.any():
+            base.add(tail.vectors[keep], tail.chunk_ids[keep], tail.document_ids[keep])
+        print(f"🔀 Vector index was saved by another process (generation {base.generation}): "
+              f"replaying {int(keep.sum())} new and {len(removed)} removed chunks on top of it")
+
+        for name in ("dim", "segments", "tail", "deleted", "num_live", "directory", "generation", "_manifest_mtime"):
+            setattr(self, name, getattr(base, name))
+        self.ivf = None
+        self._layout += 1
+
+    def _write_segment(self, path: str, parts: list):
+        """Writes consecutive parts as one segment; deleted rows keep their slot with a zero vector."""
+        rows = np.arange(parts[0].base, parts[-1].base + len(parts[-1]))
+        vectors = self._gather(rows)
+        live = np.frombuffer(self.deleted, dtype=np.uint8)[rows] == 0
+        vectors[~live] = 0.0
+        chunk_ids = np.concatenate([np.asarray(p.chunk_ids, dtype=np.int64) for p in parts])
+        document_ids = np.concatenate([np.asarray(p.document_ids, dtype=np.int64) for p in parts])
+        write_vector_segment(path, parts[0].base, vectors, self.quantized, chunk_ids, document_ids)
+
+    @classmethod
+    def open(cls, directory: str) -> Optional["VectorIndex"]:
+        """Opens a saved index (memory-mapped). Returns None if the directory has no manifest."""
+        with bm25_store.directory_lock(directory, shared=True):
+            return cls._open(directory)
+
+    @classmethod
+    def _open(cls, directory: str) -> Optional["VectorIndex"]:
+        manifest = bm25_store.read_manifest(directory, FORMAT, FORMAT_VERSION)
+        if manifest is None:
+            return None
+        index = cls(dim=manifest["dim"], quantized=manifest["quantized"])
+        index.directory = directory
+        index.generation = manifest["generation"]
+        index._manifest_mtime = bm25_store.manifest_mtime(directory)
+        index.segments = [VectorSegment(os.path.join(directory, name)) for name in manifest["segments"]]
+        index.deleted = bytearray(manifest["num_slots"])
+        if manifest.get("deleted"):
+            with open(os.path.join(directory, manifest["deleted"]), "rb") as f:
+                stored = f.read()
+            index.deleted[:len(stored)] = stored
+        index.tail = MemoryRows(len(index), index.dim or 0)
+        index.num_live = len(index) - sum(index.deleted)
+        return index
+
+    def is_stale(self) -> bool:
+        """True when another process has saved a newer manifest to this index's directory."""
+        if self.directory is None:
+            return False
+        return bm25_store.manifest_mtime(self.directory) != self._manifest_mtime
+
+    def memory_usage(self) -> int:
+        """Bytes of mapped segments plus the in-memory tail."""
+        return sum(s.nbytes for s in self.segments) + self.tail.nbytes
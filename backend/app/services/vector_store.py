@@ -1,18 +1,280 @@
-from app.services.database import get_supabase
+"""
+Vector search backends behind one interface:
 
-def query_vectors(query_embedding: list[float], match_threshold: float = 0.5, match_count: int = 10):
-    """
-    Search for similar documents using Supabase pgvector.
-    Calls the 'match_documents' RPC function defined in the migration SQL.
-    """
-    supabase = get_supabase()
-    
-    params = {
-        "query_embedding": query_embedding,
-        "match_threshold": match_threshold,
-        "match_count": match_count
-    }
-    
-    response = supabase.rpc("match_documents", params).execute()
-    return response.data
+    supabase   match_documents RPC on pgvector (one network round-trip per query)
+    local      in-process VectorIndex (vector_index.py) memory-mapped under
+               data/vector_index, synced from the chunk table at startup and
+               updated by ingestion; all query variants in one matmul. It
+               stores ids only: content and metadata come from the BM25
+               index's chunk columns (ChunkRegistry)
+
+Both return match_documents rows: {"id", "content", "metadata", "similarity"}.
+"""
+import json
+import threading
+from typing import List
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.chunk_registry import ChunkRegistry
+from app.services.database import execute, fetch_all, get_supabase
+from app.services.vector_index import VectorIndex
+
+VECTOR_INDEX_DIR = "data/vector_index"
+VECTOR_COLUMNS = "id,document_id,embedding"
+
+
+class SupabaseVectorStore:
+    name = "supabase"
+    # Queries are network calls: the pipeline runs the variants concurrently
+    in_process = False
+
+    def query(self, query_embedding: list[float], match_threshold: float = 0.5, match_count: int = 10) -> List[dict]:
+        """
+        Search for similar documents using Supabase pgvector.
+        Calls the 'match_documents' RPC function defined in the migration SQL.
+        """
+        supabase = get_supabase()
+
+        params = {
+            "query_embedding": query_embedding,
+            "match_threshold": match_threshold,
+            "match_count": match_count
+        }
+
+        response = execute(supabase.rpc("match_documents", params), "match_documents")
+        return response.data
+
+    def query_batch(self, query_embeddings: list, match_threshold: float = 0.5, match_count: int = 10) -> List[List[dict]]:
+        return [self.query(embedding, match_threshold, match_count) for embedding in query_embeddings]
+
+    def add_chunks(self, chunk_ids, document_ids, embeddings, save: bool = True):
+        # Embeddings are stored with the chunk rows themselves
+        pass
+
+    def save(self):
+        pass
+
+    def clear(self):
+        pass
+
+    def remove_document(self, document_id, save: bool = True) -> int:
+        return 0
+
+    def initialize_from_db(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+def parse_embedding(value) -> list:
+    # PostgREST returns pgvector columns as their text form "[0.1,0.2,...]"
+    return json.loads(value) if isinstance(value, str) else value
+
+
+class LocalVectorStore:
+    name = "local"
+    in_process = True
+
+    def __init__(self, directory: str = VECTOR_INDEX_DIR, registry: ChunkRegistry = None):
+        self.directory = directory
+        if registry is None:
+            from app.services.bm25_service import bm25_service
+            registry = ChunkRegistry(lambda: bm25_service.bm25)
+        self.registry = registry
+        self.ready = threading.Event()  # Set once the startup sync with the DB has finished
+        self.replace_on_save = False  # Next save overwrites the index on disk (after clear) instead of merging into it
+        self._ivf_thread = None
+        self._ivf_lock = threading.Lock()
+        try:
+            self.index = VectorIndex.open(directory)
+        except Exception as e:
+            print(f"Error loading vector index: {e}")
+            self.index = None
+
+    def _new_index(self) -> VectorIndex:
+        return VectorIndex(quantized=settings.VECTOR_QUANTIZE)
 
+    def initialize_from_db(self):
+        """Same delta sync as the BM25 index: watermark on chunk id plus per-document counts."""
+        self.ready.clear()
+        try:
+            if self.index is None or not self.index.num_live or not self.sync_with_db():
+                self.rebuild_from_db()
+            self.ensure_ivf()
+        except Exception as e:
+            print(f"❌ Error building vector index from DB: {e}")
+        finally:
+            self.ready.set()
+
+    def rebuild_from_db(self):
+        print("🔄 Building local vector index from database...")
+        supabase = get_supabase()
+        chunks = fetch_all(lambda: supabase.table("chunk").select(VECTOR_COLUMNS))
+        index = self._new_index()
+        self._add_rows(index, chunks)
+        index.save(self.directory, replace=True)
+        self.index = index
+        print(f"✅ Local vector index built with {index.num_live} chunks.")
+
+    def sync_with_db(self) -> bool:
+        chunk_ids, document_ids = self.index.chunk_table()
+        watermark = int(chunk_ids.max()) if len(chunk_ids) else 0
+        local_docs, local_counts = np.unique(document_ids, return_counts=True)
+        local_counts = dict(zip(local_docs.tolist(), local_counts.tolist()))
+
+        supabase = get_supabase()
+        db_counts = {
+            row['id']: row['total_chunks']
+            for row in fetch_all(lambda: supabase.table("documents").select("id,total_chunks"))
+        }
+        removed = [doc for doc in local_counts if doc not in db_counts]
+        stale = [doc for doc, count in local_counts.items() if doc in db_counts and db_counts[doc] != count]
+        for document_id in removed + stale:
+            self.index.remove(self.index.find_document(document_id))
+
+        new_chunks = []
+        if stale:
+            new_chunks.extend(fetch_all(lambda: supabase.table("chunk").select(VECTOR_COLUMNS).in_("document_id", stale)))
+        stale_set = set(stale)
+        new_chunks.extend(
+            chunk for chunk in fetch_all(lambda: supabase.table("chunk").select(VECTOR_COLUMNS).gt("id", watermark))
+            if chunk['document_id'] not in stale_set
+        )
+        self._add_rows(self.index, new_chunks)
+        if new_chunks or removed or stale:
+            self.index.save(self.directory)
+        print(f"✅ Vector index synced: +{len(new_chunks)} chunks, "
+              f"{len(removed)} documents removed, {len(stale)} re-fetched (watermark id {watermark}).")
+        return True
+
+    @staticmethod
+    def _add_rows(index: VectorIndex, chunks: list):
+        chunks = [chunk for chunk in chunks if chunk.get('embedding') is not None]
+        if chunks:
+            index.add(
+                [parse_embedding(chunk['embedding']) for chunk in chunks],
+                [chunk['id'] for chunk in chunks],
+                [chunk['document_id'] for chunk in chunks],
+            )
+
+    def add_chunks(self, chunk_ids, document_ids, embeddings, save: bool = True):
+        """Called by ingestion after the chunk rows are inserted (and added to BM25)."""
+        if self.index is None:
+            self.index = self._new_index()
+        self.index.add(embeddings, chunk_ids, document_ids)
+        if save:
+            self.save()
+
+    def clear(self):
+        """Drops the in-memory index; the next save replaces the one on disk."""
+        self.index = None
+        self.replace_on_save = True
+
+    def save(self):
+        """Flushes changes made with save=False (new rows become a new segment)."""
+        if self.index is not None:
+            self.index.save(self.directory, replace=self.replace_on_save)
+            self.replace_on_save = False
+            self.ensure_ivf()
+
+    def remove_document(self, document_id, save: bool = True) -> int:
+        if self.index is None:
+            return 0
+        rows = self.index.find_document(document_id)
+        if rows:
+            self.index.remove(rows)
+            if save:
+                self.index.save(self.directory)
+        return len(rows)
+
+    def _current_index(self):
+        index = self.index
+        if index is not None and index.is_stale() and not len(index.tail):
+            # Another worker saved new segments
+            index = self.index = VectorIndex.open(self.directory)
+        self.ensure_ivf()
+        return index
+
+    def ensure_ivf(self):
+        """
+        Starts training the IVF on a background thread once the index reaches
+        VECTOR_IVF_MIN_ROWS (one training at a time); queries use the exact
+        scan until it is installed.
+        """
+        index = self.index
+        if (index is None or index.ivf is not None or not settings.VECTOR_IVF_MIN_ROWS
+                or index.num_live < settings.VECTOR_IVF_MIN_ROWS):
+            return
+        with self._ivf_lock:
+            if self._ivf_thread is not None and self._ivf_thread.is_alive():
+                return
+            self._ivf_thread = threading.Thread(target=self._train_ivf, args=(index,), name="ivf-train", daemon=True)
+            self._ivf_thread.start()
+
+    @staticmethod
+    def _train_ivf(index: VectorIndex):
+        print(f"🔄 Training IVF index on {index.num_live} vectors...")
+        try:
+            index.build_ivf()
+        except Exception as e:
+            print(f"❌ Error training the IVF index: {e}")
+
+    def query_batch(self, query_embeddings: list, match_threshold: float = 0.5, match_count: int = 10) -> List[List[dict]]:
+        index = self._current_index()
+        if index is None or not len(query_embeddings):
+            return [[] for _ in query_embeddings]
+        hits = index.search(query_embeddings, k=match_count, threshold=match_threshold, nprobe=settings.VECTOR_IVF_NPROBE)
+        batches = []
+        for results in hits:
+            rows = []
+            for row, score in results:
+                chunk_id = index.chunk_id(row)
+                chunk = self.registry.get(chunk_id)
+                if chunk is None:
+                    continue  # not in the BM25 index (yet): nothing to return as content
+                rows.append({"id": chunk_id, "content": chunk[0], "metadata": chunk[1], "similarity": score})
+            batches.append(rows)
+        return batches
+
+    def query(self, query_embedding: list[float], match_threshold: float = 0.5, match_count: int = 10) -> List[dict]:
+        return self.query_batch([query_embedding], match_threshold, match_count)[0]
+
+    def stats(self) -> dict:
+        index = self.index
+        return {
+            "backend": self.name,
+            "ready": self.ready.is_set(),
+            "vectors": index.num_live if index else 0,
+            "quantized": index.quantized if index else settings.VECTOR_QUANTIZE,
+            "ivf_lists": len(index.ivf.centroids) if index is not None and index.ivf is not None else 0,
+            "bytes": index.memory_usage() if index else 0,
+        }
+
+
+VECTOR_STORES = {
+    "supabase": SupabaseVectorStore,
+    "local": LocalVectorStore,
+}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_vector_store(name: str = None):
+    """Returns the (cached) vector store registered under `name`, or the configured VECTOR_BACKEND."""
+    if name is None:
+        name = settings.VECTOR_BACKEND
+    with _stores_lock:
+        if name not in _stores:
+            if name not in VECTOR_STORES:
+                raise ValueError(f"Unknown vector backend '{name}'. Available: {', '.join(VECTOR_STORES)}")
+            _stores[name] = VECTOR_STORES[name]()
+        return _stores[name]
+
+
+def query_vectors(query_embedding: list[float], match_threshold: float = 0.5, match_count: int = 10):
+    """Similar chunks for one query embedding from the configured backend (match_documents rows)."""
+    return get_vector_store().query(query_embedding, match_threshold, match_count)
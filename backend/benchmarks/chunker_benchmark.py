@@ -0,0 +1,104 @@
+"""
+Compares the single-pass chunker (ingestion.chunk_text) with the previous
+one (LangChain RecursiveCharacterTextSplitter + extract_page_number on every
+chunk): throughput in chars/s, number of chunks and page assignment.
+
+Without files, a synthetic OCR book of --size-mb megabytes is used.
+
+Usage (from backend/):
+    python -m benchmarks.chunker_benchmark
+    python -m benchmarks.chunker_benchmark data/*.txt --repeat 3
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.ingestion import chunk_text, extract_page_number
+
+WORDS = ("اللغة", "العربية", "الهوية", "التاريخ", "الأدب", "الثقافة", "المجتمع", "الكتاب",
+         "الفكر", "النص", "المعنى", "الحضارة", "التراث", "الذاكرة", "الإنسان", "الزمن")
+
+
+def synthetic_book(size_mb: float, seed: int = 0) -> str:
+    """OCR-like text: page markers, paragraphs, lines and in-text page references."""
+    rng = random.Random(seed)
+    pages, size, page = [], 0, 0
+    while size < size_mb * 1_000_000:
+        page += 1
+        paragraphs = []
+        for _ in range(rng.randint(2, 6)):
+            lines = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))) + "."
+                     for _ in range(rng.randint(1, 5))]
+            if rng.random() < 0.2:
+                lines.append(f"انظر ص {rng.randint(1, 400)}.")
+            paragraphs.append("\n".join(lines))
+        text = f"--- صفحة {page} (OCR) ---\n" + "\n\n".join(paragraphs)
+        pages.append(text)
+        size += len(text.encode("utf-8"))
+    return "\n\n".join(pages)
+
+
+def legacy_chunk_text(text: str) -> list[dict]:
+    """The chunker before the single-pass rewrite."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=150,
+                                              separators=["\n\n", "\n", "。", ".", " ", ""], length_function=len)
+    chunks, current_page = [], None
+    for i, chunk in enumerate(splitter.split_text(text)):
+        page_num = extract_page_number(chunk)
+        if page_num:
+            current_page = page_num
+        chunks.append({"text": chunk, "index": i, "page_number": current_page, "has_page_marker": bool(page_num)})
+    return chunks
+
+
+def measure(name: str, chunker, text: str, repeat: int) -> dict:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = chunker(text)
+        best = min(best, time.perf_counter() - start)
+    return {
+        "chunker": name,
+        "seconds": best,
+        "chars_per_s": len(text) / best,
+        "chunks": len(chunks),
+        "max_len": max((len(c["text"]) for c in chunks), default=0),
+        "last_page": chunks[-1]["page_number"] if chunks else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help=".txt files (default: a synthetic book)")
+    parser.add_argument("--size-mb", type=float, default=4.0, help="size of the synthetic book")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.files:
+        text = "\n\n".join(open(path, encoding="utf-8").read() for path in args.files)
+    else:
+        text = synthetic_book(args.size_mb)
+    print(f"📚 {len(text):,} characters ({len(text.encode('utf-8')) / 1e6:.1f} MB)\n")
+
+    results = [measure("single-pass", chunk_text, text, args.repeat)]
+    try:
+        results.append(measure("langchain", legacy_chunk_text, text, args.repeat))
+    except ImportError:
+        print("⚠️ langchain-text-splitters is not installed, skipping the previous chunker")
+
+    print(f"{'chunker':<14}{'seconds':>10}{'chars/s':>14}{'chunks':>10}{'max len':>10}{'last page':>11}")
+    for r in results:
+        print(f"{r['chunker']:<14}{r['seconds']:>10.2f}{r['chars_per_s']:>14,.0f}{r['chunks']:>10}"
+              f"{r['max_len']:>10}{str(r['last_page']):>11}")
+    if len(results) == 2:
+        print(f"\n⚡ Speed-up: {results[1]['seconds'] / results[0]['seconds']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Chunking settings report: for each configuration, the number of chunks,
+the estimated tokens sent to the embedding model (and their cost), the text
+duplicated by overlap, and golden-dataset recall@k.
+
+Recall is measured with BM25 by default (offline). With --embed, the chunks
+and questions are embedded with the configured Gemini model (API calls, and
+cost) and recall is measured with cosine similarity instead.
+
+A question counts as found when one of the top-k chunks comes from its
+context_file ("file") and, stricter, when that chunk also holds at least
+half of the ground-truth answer's terms ("answer").
+
+Usage (from backend/):
+    python -m benchmarks.chunking_report --data-dir data
+    python -m benchmarks.chunking_report --configs chars:512:150,tokens:256:32,tokens:384:48 --price-per-mtok 0.15
+"""
+import argparse
+import csv
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.bm25_index import BM25Index
+from app.services.ingestion import chunk_text, get_splitter
+from app.services.tokenizer import estimate_tokens, get_tokenizer
+
+SAMPLE_DIR = Path(__file__).resolve().parent.parent / "tests" / "test_data"
+DEFAULT_CONFIGS = "chars:512:150,chars:512:64,tokens:192:16,tokens:256:32,tokens:384:32"
+
+
+def load_texts(data_dir: Path) -> dict:
+    files = sorted(data_dir.glob("*.txt"))
+    if not files:
+        print(f"⚠️ No .txt files in {data_dir}, using {SAMPLE_DIR}")
+        files = sorted(SAMPLE_DIR.glob("*.txt"))
+    return {path.name: path.read_text(encoding="utf-8") for path in files}
+
+
+def load_golden(golden_file: Path, filenames) -> list:
+    if not golden_file.exists():
+        return []
+    with open(golden_file, encoding="utf-8-sig") as f:
+        return [row for row in csv.DictReader(f) if row.get("context_file") in filenames]
+
+
+def parse_configs(spec: str) -> list:
+    configs = []
+    for item in spec.split(","):
+        mode, size, overlap = item.split(":")
+        configs.append((mode, int(size), int(overlap)))
+    return configs
+
+
+def bm25_ranker(texts):
+    tokenizer = get_tokenizer()
+    index = BM25Index()
+    index.add(tokenizer(text) for text in texts)
+    return lambda question, k: [doc_id for doc_id, _ in index.top_k(tokenizer(question), k)]
+
+
+def embedding_ranker(texts):
+    from app.services.embedding import get_batch_embeddings
+
+    matrix = np.array([vector for start in range(0, len(texts), 100)
+                       for vector in get_batch_embeddings(texts[start:start + 100])], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+
+    def rank(question, k):
+        query = np.array(get_batch_embeddings([question], is_query=True)[0], dtype=np.float32)
+        return list(np.argsort(-(matrix @ query))[:k])
+    return rank
+
+
+def evaluate(config, texts_by_file: dict, golden: list, top_k: int, embed: bool) -> dict:
+    mode, size, overlap = config
+    splitter = get_splitter(mode, size, overlap)
+    texts, filenames = [], []
+    source_tokens = 0
+    for filename, text in texts_by_file.items():
+        source_tokens += estimate_tokens(text)
+        for chunk in chunk_text(text, splitter):
+            texts.append(chunk["text"])
+            filenames.append(filename)
+    tokens = [estimate_tokens(text) for text in texts]
+
+    file_hits = answer_hits = 0
+    if golden and texts:
+        rank = (embedding_ranker if embed else bm25_ranker)(texts)
+        tokenizer = get_tokenizer()
+        for row in golden:
+            answer_terms = set(tokenizer(row["ground_truth"]))
+            hits = [i for i in rank(row["question"], top_k) if filenames[i] == row["context_file"]]
+            file_hits += bool(hits)
+            answer_hits += any(len(answer_terms & set(tokenizer(texts[i]))) * 2 >= len(answer_terms) for i in hits)
+
+    return {
+        "config": f"{mode}:{size}:{overlap}",
+        "chunks": len(texts),
+        "tokens": sum(tokens),
+        "mean_tokens": sum(tokens) / len(tokens) if tokens else 0.0,
+        "max_tokens": max(tokens, default=0),
+        "duplicated": sum(tokens) / source_tokens - 1 if source_tokens else 0.0,
+        "file_recall": file_hits / len(golden) if golden else float("nan"),
+        "answer_recall": answer_hits / len(golden) if golden else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--golden", default="golden_dataset_test.csv")
+    parser.add_argument("--configs", default=DEFAULT_CONFIGS, help="comma-separated mode:size:overlap")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--price-per-mtok", type=float, default=0.0, help="embedding price per million tokens")
+    parser.add_argument("--embed", action="store_true", help="measure recall with real embeddings (API calls)")
+    args = parser.parse_args()
+
+    texts_by_file = load_texts(Path(args.data_dir))
+    golden = load_golden(Path(args.golden), set(texts_by_file))
+    print(f"📚 {len(texts_by_file)} files, {len(golden)} golden questions with a matching file "
+          f"(recall with {'embeddings' if args.embed else 'BM25'})\n")
+
+    k = args.top_k
+    print(f"{'config':<18}{'chunks':>8}{'tokens':>10}{'mean':>7}{'max':>6}{'dup %':>7}{'cost $':>9}"
+          f"{f'file@{k}':>9}{f'answer@{k}':>11}")
+    for config in parse_configs(args.configs):
+        r = evaluate(config, texts_by_file, golden, k, args.embed)
+        cost = r["tokens"] / 1e6 * args.price_per_mtok
+        print(f"{r['config']:<18}{r['chunks']:>8}{r['tokens']:>10}{r['mean_tokens']:>7.0f}{r['max_tokens']:>6}"
+              f"{r['duplicated'] * 100:>7.1f}{cost:>9.4f}{r['file_recall']:>9.2f}{r['answer_recall']:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Offline pipeline benchmarks (pytest-benchmark): chunking, BM25 build and
+search, fusion, ingestion and the full query pipeline, with the fake model
+provider and the in-memory database (app/services/fakes.py), so only our own
+code is timed and no API quota is used.
+
+A synthetic corpus (Zipf-distributed vocabulary, so postings look like real
+text) is loaded into the in-memory chunk table at each scale of BENCH_SCALES
+chunks. Simulated model latency comes from FAKE_LLM_LATENCY and
+FAKE_EMBEDDING_LATENCY (0 by default: pure overhead). Query expansion is off.
+
+Usage (from backend/, after `pip install -r ../requirements-dev.txt`):
+    python -m pytest benchmarks -q
+    BENCH_SCALES=10000,100000,1000000 python -m pytest benchmarks --benchmark-group-by=func
+    python -m pytest benchmarks -k "bm25 or fusion" --benchmark-save=baseline
+"""
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark", reason="pytest-benchmark is not installed: pip install -r requirements-dev.txt")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app.services.bm25_service as bm25_module
+import app.services.fakes as fakes
+import app.services.providers as providers
+import app.services.rag as rag
+from app.core.config import settings
+from app.services.bm25_service import BM25Service
+from app.services.fakes import FakeProvider, MemoryDatabase, hash_embeddings
+from app.services.fusion import fuse_results
+from app.services.ingestion import chunk_text, process_file_content
+
+SCALES = [int(s) for s in os.getenv("BENCH_SCALES", "10000").split(",")]
+# Rounds of the benchmarks that rebuild something (the others are calibrated by pytest-benchmark)
+ROUNDS = int(os.getenv("BENCH_ROUNDS", "3"))
+DIM = int(os.getenv("BENCH_EMBEDDING_DIM", "128"))
+CHUNKS_PER_DOCUMENT = 1000
+INGEST_CHUNKS = 2000
+LETTERS = "ابتثجحخدذرزسشصضطظعغفقكلمنهوي"
+
+
+def make_vocabulary(size: int = 30000, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        word = "".join(rng.choice(LETTERS) for _ in range(rng.randint(3, 7)))
+        words.add(("ال" + word) if rng.random() < 0.4 else word)
+    return sorted(words)
+
+
+def make_chunks(count: int, seed: int = 0) -> list:
+    """`count` chunk texts of 60-90 words drawn from a Zipf distribution, a few sentences each."""
+    vocabulary = np.array(make_vocabulary(seed=seed))
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(60, 90, size=count)
+    ranks = (rng.zipf(1.1, size=int(lengths.sum())) - 1) % len(vocabulary)
+    words = vocabulary[ranks].tolist()
+    chunks, start = [], 0
+    for length in lengths.tolist():
+        sentence = words[start:start + length]
+        start += length
+        for cut in range(12, length, 15):
+            sentence[cut] += "."
+        chunks.append(" ".join(sentence) + ".")
+    return chunks
+
+
+def make_queries(chunks: list, count: int = 50, seed: int = 1) -> list:
+    """Questions made of a few words of random chunks."""
+    rng = random.Random(seed)
+    queries = []
+    for text in rng.sample(chunks, min(count, len(chunks))):
+        words = text.replace(".", "").split()
+        queries.append("ما " + " ".join(rng.sample(words, 4)) + "؟")
+    return queries
+
+
+@pytest.fixture(scope="module")
+def offline(tmp_path_factory):
+    """Fake provider and memory database for the whole module, indexes under a temporary directory."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(settings, "MODEL_PROVIDER", "fake")
+        mp.setattr(settings, "DATABASE_BACKEND", "memory")
+        mp.setattr(settings, "VECTOR_BACKEND", "supabase")
+        mp.setattr(settings, "EMBEDDING_CACHE", False)
+        mp.setattr(settings, "ANSWER_CACHE", False)
+        mp.setattr(settings, "QUERY_EXPANSION", "none")
+        mp.setitem(providers._providers, "fake", FakeProvider(dim=DIM))
+        mp.setattr(bm25_module, "INDEX_DIR", str(tmp_path_factory.mktemp("bm25")))
+        yield mp
+
+
+@pytest.fixture(scope="module", params=SCALES, ids=lambda scale: f"{scale}")
+def corpus(request, offline):
+    """Memory database holding `scale` chunks with their embeddings, and a BM25 index built from it."""
+    scale = request.param
+    chunks = make_chunks(scale)
+    db = MemoryDatabase()
+    documents = db.table("documents").insert([
+        {"filename": f"book_{n}.txt", "total_chunks": len(chunks[start:start + CHUNKS_PER_DOCUMENT])}
+        for n, start in enumerate(range(0, scale, CHUNKS_PER_DOCUMENT))
+    ]).execute().data
+    for document, start in zip(documents, range(0, scale, CHUNKS_PER_DOCUMENT)):
+        texts = chunks[start:start + CHUNKS_PER_DOCUMENT]
+        vectors = hash_embeddings(texts, DIM)
+        # Rows keep a view of the embedding matrix rather than a list of floats per chunk
+        db.table("chunk").insert([
+            {"document_id": document["id"], "content": text, "chunk_index": i,
+             "metadata": {"filename": document["filename"], "page_number": i // 4 + 1}, "embedding": vector}
+            for i, (text, vector) in enumerate(zip(texts, vectors))
+        ]).execute()
+    offline.setattr(fakes, "memory_database", db)
+
+    service = BM25Service()
+    service.rebuild_from_db()
+    offline.setattr(bm25_module, "bm25_service", service)
+    return {"scale": scale, "chunks": chunks, "queries": make_queries(chunks), "db": db, "bm25": service}
+
+
+def cycle(items):
+    state = {"i": 0}
+
+    def next_item():
+        state["i"] += 1
+        return items[state["i"] % len(items)]
+    return next_item
+
+
+def test_chunking(benchmark, corpus):
+    text = "\n\n".join(f"--- صفحة {n // 4 + 1} (OCR) ---\n{chunk}" if n % 4 == 0 else chunk
+                       for n, chunk in enumerate(corpus["chunks"]))
+    chunks = benchmark.pedantic(chunk_text, args=(text,), rounds=ROUNDS, iterations=1)
+    benchmark.extra_info.update(chars=len(text), chunks=len(chunks))
+
+
+def test_bm25_build(benchmark, corpus):
+    """BM25Service.rebuild_from_db: paging through the chunk table, tokenizing, writing the segment."""
+    service = BM25Service()
+    benchmark.pedantic(service.rebuild_from_db, rounds=ROUNDS, iterations=1)
+    assert service.bm25.num_docs == corpus["scale"]
+
+
+def test_bm25_search(benchmark, corpus):
+    next_query = cycle(corpus["queries"])
+    hits = benchmark(lambda: corpus["bm25"].search(next_query(), top_k=20, with_ids=True))
+    assert hits
+
+
+def test_vector_search(benchmark, corpus):
+    """match_documents on the in-memory table (the pgvector RPC stand-in)."""
+    embeddings = hash_embeddings(corpus["queries"], DIM).tolist()
+    next_embedding = cycle(embeddings)
+    benchmark(lambda: corpus["db"].match_documents(next_embedding(), match_threshold=0.0, match_count=20))
+
+
+def test_fusion(benchmark, corpus):
+    query = corpus["queries"][0]
+    embedding = hash_embeddings([query], DIM)[0].tolist()
+    vector_results = [corpus["db"].match_documents(embedding, match_threshold=0.0, match_count=20)] * 3
+    bm25_results = corpus["bm25"].search(query, top_k=20, with_ids=True)
+    _, top_documents, _, _ = benchmark(fuse_results, vector_results, bm25_results)
+    assert top_documents
+
+
+def test_full_pipeline(benchmark, corpus):
+    """run_rag_pipeline: BM25 and vector search, fusion, local rerank, context assembly, canned answer."""
+    next_query = cycle(corpus["queries"])
+    result = benchmark(lambda: rag.run_rag_pipeline(next_query()))
+    assert result["context"]
+
+
+def test_ingestion(benchmark, offline, tmp_path):
+    """process_file_content of an INGEST_CHUNKS-chunk book into an empty database (independent of the scale)."""
+    text = "\n\n".join(make_chunks(INGEST_CHUNKS, seed=7))
+
+    def setup():
+        offline.setattr(fakes, "memory_database", MemoryDatabase())
+        offline.setattr(bm25_module, "INDEX_DIR", str(tmp_path / f"bm25_{random.random()}"))
+        offline.setattr(bm25_module, "bm25_service", BM25Service())
+
+    result = benchmark.pedantic(process_file_content, args=(text, "book.txt"), setup=setup, rounds=ROUNDS)
+    benchmark.extra_info.update(chunks=result["total_chunks"])
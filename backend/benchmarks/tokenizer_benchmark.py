@@ -0,0 +1,89 @@
+"""
+Compares BM25 tokenizers on the local corpus: vocabulary size, index memory,
+build time and recall@k on the golden dataset.
+
+Usage (from backend/):
+    python -m benchmarks.tokenizer_benchmark --data-dir data --golden golden_dataset_test.csv
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.bm25_index import BM25Index
+from app.services.ingestion import chunk_text
+from app.services.tokenizer import TOKENIZERS, get_tokenizer
+
+SAMPLE_DIR = Path(__file__).resolve().parent.parent / "tests" / "test_data"
+
+
+def load_chunks(data_dir: Path):
+    files = sorted(data_dir.glob("*.txt"))
+    if not files:
+        print(f"⚠️ No .txt files in {data_dir}, using {SAMPLE_DIR}")
+        files = sorted(SAMPLE_DIR.glob("*.txt"))
+    texts, filenames = [], []
+    for path in files:
+        for chunk in chunk_text(path.read_text(encoding="utf-8")):
+            texts.append(chunk["text"])
+            filenames.append(path.name)
+    return texts, filenames
+
+
+def load_questions(golden_file: Path, filenames: set):
+    if not golden_file.exists():
+        return []
+    with open(golden_file, encoding="utf-8-sig") as f:
+        return [
+            (row["question"], row["context_file"])
+            for row in csv.DictReader(f)
+            if row.get("context_file") in filenames
+        ]
+
+
+def evaluate(name: str, texts, filenames, questions, top_k: int):
+    tokenizer = get_tokenizer(name)
+    start = time.perf_counter()
+    index = BM25Index()
+    index.add(tokenizer(text) for text in texts)
+    build_time = time.perf_counter() - start
+
+    hits = 0
+    for question, expected_file in questions:
+        results = index.top_k(tokenizer(question), top_k)
+        if any(filenames[doc_id] == expected_file for doc_id, _ in results):
+            hits += 1
+    recall = hits / len(questions) if questions else float("nan")
+
+    return {
+        "tokenizer": name,
+        "vocab": len(index.vocab),
+        "memory_kb": index.memory_usage() / 1024,
+        "build_s": build_time,
+        "recall": recall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--golden", default="golden_dataset_test.csv")
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    texts, filenames = load_chunks(Path(args.data_dir))
+    questions = load_questions(Path(args.golden), set(filenames))
+    print(f"📚 {len(texts)} chunks, {len(questions)} golden questions with a matching file\n")
+
+    print(f"{'tokenizer':<16}{'vocab':>10}{'memory KB':>12}{'build s':>10}{f'recall@{args.top_k}':>12}")
+    for name in TOKENIZERS:
+        r = evaluate(name, texts, filenames, questions, args.top_k)
+        print(f"{r['tokenizer']:<16}{r['vocab']:>10}{r['memory_kb']:>12.1f}{r['build_s']:>10.3f}{r['recall']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
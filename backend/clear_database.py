@@ -1,5 +1,5 @@
 """
-Script لإفراغ قاعدة البيانات بالكامل (Supabase + ChromaDB + BM25)
+Script لإفراغ قاعدة البيانات بالكامل (Supabase + فهرس المتجهات المحلي + BM25)
 بدون إعادة بناء - فقط مسح كل شيء
 """
 import os
@@ -27,28 +27,32 @@ def clear_database():
     print("🔄 بدء عملية المسح...")
     print()
     
-    # 1. مسح ChromaDB
-    chroma_path = Path("data/chroma_db")
-    if chroma_path.exists():
-        print("🗑️  [1/3] مسح ChromaDB...")
+    # 1. مسح فهرس المتجهات المحلي (VECTOR_BACKEND=local)
+    vector_path = Path("data/vector_index")
+    if vector_path.exists():
+        print("🗑️  [1/3] مسح فهرس المتجهات المحلي...")
         try:
-            shutil.rmtree(chroma_path)
-            print("   ✅ تم مسح ChromaDB بنجاح")
+            shutil.rmtree(vector_path)
+            print("   ✅ تم مسح فهرس المتجهات بنجاح")
         except PermissionError:
             print("   ❌ خطأ: لا يمكن مسح الملفات لأنها قيد الاستخدام!")
             print("   ⚠️  يرجى إغلاق التطبيق (النافذة السوداء) أولاً ثم المحاولة مرة أخرى.")
             print("   Error: Files are in use. Please STOP the application first.")
         except Exception as e:
-            print(f"   ⚠️  خطأ في مسح ChromaDB: {e}")
+            print(f"   ⚠️  خطأ في مسح فهرس المتجهات: {e}")
     else:
-        print("ℹ️  [1/3] ChromaDB فارغة بالفعل")
+        print("ℹ️  [1/3] فهرس المتجهات فارغ بالفعل")
     
-    # 2. مسح BM25 Index
+    # 2. مسح BM25 Index (المجلد الجديد + ملف pickle القديم إن وُجد)
+    bm25_dir = Path("data/bm25_index")
     bm25_path = Path("data/bm25_index.pkl")
-    if bm25_path.exists():
+    if bm25_dir.exists() or bm25_path.exists():
         print("🗑️  [2/3] مسح BM25 Index...")
         try:
-            bm25_path.unlink()
+            if bm25_dir.exists():
+                shutil.rmtree(bm25_dir)
+            if bm25_path.exists():
+                bm25_path.unlink()
             print("   ✅ تم مسح BM25 Index بنجاح")
         except Exception as e:
             print(f"   ⚠️  خطأ في مسح BM25: {e}")
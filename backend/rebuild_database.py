@@ -1,48 +1,57 @@
 """
-Script to rebuild the vector database with correct embeddings
+Bulk (re)ingestion of text files into Supabase and the local indexes.
+
+Chunking runs in a process pool, embedding in rate-limited worker threads,
+chunk rows are inserted in large batches across files and the BM25 index is
+written once at the end. Prints a throughput report.
+
+Usage (from backend/):
+    python rebuild_database.py                      # append data/*.txt
+    python rebuild_database.py --reset              # empty the tables and indexes first
+    python rebuild_database.py --replace            # remove older documents with the same filenames
+    python rebuild_database.py books/*.txt --processes 8 --embed-workers 8 --rpm 1500
 """
+import argparse
+import glob
 import os
-import shutil
-from pathlib import Path
-from app.services.ingestion import process_document
-from app.services.database import get_supabase
-
-def rebuild_database():
-    print("🔄 Starting database rebuild...")
-    
-    # 1. Delete ChromaDB
-    chroma_path = Path("data/chroma_db")
-    if chroma_path.exists():
-        print("🗑️  Deleting old ChromaDB...")
-        shutil.rmtree(chroma_path)
-        print("✅ ChromaDB deleted")
-    
-    # 2. Clear Supabase
-    print("🗑️  Clearing Supabase tables...")
-    supabase = get_supabase()
-    try:
-        supabase.table("chunks").delete().neq("id", "00000000-0000-0000-0000-000000000000").execute()
-        supabase.table("documents").delete().neq("id", "00000000-0000-0000-0000-000000000000").execute()
-        print("✅ Supabase cleared")
-    except Exception as e:
-        print(f"⚠️  Supabase clear warning: {e}")
-    
-    # 3. Re-process all documents
-    data_dir = Path("data")
-    txt_files = list(data_dir.glob("*.txt"))
-    
-    print(f"\n📚 Found {len(txt_files)} documents to process")
-    
-    for i, file_path in enumerate(txt_files, 1):
-        print(f"\n[{i}/{len(txt_files)}] Processing: {file_path.name}")
-        try:
-            result = process_document(str(file_path))
-            print(f"  ✅ Processed {result['total_chunks']} chunks")
-        except Exception as e:
-            print(f"  ❌ Error: {e}")
-    
-    print("\n🎉 Database rebuild complete!")
-    print("🔍 Test with: 'ما العلاقة بين اللغة والهوية الثقافية؟'")
+
+from app.core.config import settings
+from app.services.bulk_ingest import bulk_ingest, format_report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk ingestion of .txt files")
+    parser.add_argument("paths", nargs="*", default=["data/*.txt"], help="files or glob patterns (default: data/*.txt)")
+    parser.add_argument("--reset", action="store_true", help="delete all documents, chunks and local indexes first")
+    parser.add_argument("--replace", action="store_true",
+                        help="remove the stored documents that have the filename of an ingested file")
+    parser.add_argument("--yes", action="store_true", help="do not ask for confirmation with --reset")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="chunking processes (0 = in-process)")
+    parser.add_argument("--embed-workers", type=int, default=settings.INGEST_EMBED_CONCURRENCY,
+                        help="concurrent embedding requests")
+    parser.add_argument("--rpm", type=float, default=settings.INGEST_EMBED_RPM,
+                        help="embedding requests per minute, shared by all workers (0 = no limit)")
+    parser.add_argument("--insert-batch", type=int, default=500, help="chunk rows per insert request")
+    args = parser.parse_args()
+
+    paths = sorted({path for pattern in args.paths for path in glob.glob(pattern)})
+    if not paths:
+        print(f"⚠️ No files match {' '.join(args.paths)}")
+        return
+    print(f"📚 Found {len(paths)} documents to process")
+
+    if args.reset and not args.yes:
+        response = input("⚠️  --reset deletes ALL documents and chunks. Type 'yes' to continue: ")
+        if response.lower() not in ['نعم', 'yes', 'y']:
+            print("❌ Cancelled")
+            return
+
+    stats = bulk_ingest(paths, processes=args.processes, embed_workers=args.embed_workers,
+                        requests_per_minute=args.rpm, insert_batch=args.insert_batch, reset=args.reset,
+                        replace=args.replace)
+    print("\n🎉 Bulk ingestion complete!")
+    print(format_report(stats))
+
 
 if __name__ == "__main__":
-    rebuild_database()
+    main()
@@ -35,3 +35,10 @@ $$;
 
 -- 4. Create an index for faster queries (HNSW)
 create index on chunk using hnsw (embedding vector_cosine_ops);
+
+-- 5. Content hashes for idempotent ingestion (unchanged files are skipped,
+--    chunk embeddings are reused by hash)
+alter table documents add column if not exists content_hash text;
+alter table chunk add column if not exists content_hash text;
+create index if not exists documents_content_hash_idx on documents (content_hash);
+create index if not exists chunk_content_hash_idx on chunk (content_hash);
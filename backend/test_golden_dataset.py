@@ -1,87 +1,160 @@
-import pandas as pd
-import sys
+"""
+Golden dataset evaluation.
+
+    python test_golden_dataset.py                      # full pipeline, default reranker
+    python test_golden_dataset.py gemini               # compare rerankers
+    python test_golden_dataset.py --retrieval-only --sweep FUSION_RRF_K=30,60,90 --sweep candidates=10,20
+
+Questions run concurrently (--concurrency) under a rate limit (--rpm, API
+calls started per minute). Every run scores the source ranking against the
+expected `context_file` (recall@k, MRR, nDCG@k, see app/services/evaluation.py);
+--retrieval-only skips generation. Retrieval outputs are cached in
+--cache, so a sweep over fusion settings or candidate counts only calls the
+APIs for the first configuration. Per-question rows go to --output, a summary
+with the mean metrics and per-stage latency percentiles is printed.
+"""
+import argparse
+import csv
+import itertools
 import os
+import sys
 import time
-from app.services.rag import rag_pipeline
+from concurrent.futures import ThreadPoolExecutor
 
 # Add project root to path
 sys.path.append(os.getcwd())
 
-def evaluate_dataset(input_file='golden_dataset_test.csv', output_file='test_results.csv'):
+from app.services.concurrency import RateLimiter, retry
+from app.services.evaluation import (
+    CANDIDATES, DEFAULT_KS, PERCENTILES, StageCache, evaluate_question, expected_sources,
+    override_settings, parse_sweep, percentiles,
+)
+
+DEFAULT_CACHE = "data/eval_cache.json"
+
+
+def load_dataset(input_file: str) -> list:
+    # utf-8-sig: the dataset is exported from a spreadsheet with a BOM
+    with open(input_file, encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def sweep_grid(specs: list) -> list:
+    """Every combination of the swept values, as {name: value} dicts ([{}] without sweeps)."""
+    sweeps = [parse_sweep(spec) for spec in specs]
+    names = [name for name, _ in sweeps]
+    return [dict(zip(names, values)) for values in itertools.product(*(values for _, values in sweeps))]
+
+
+def config_label(config: dict) -> str:
+    return " ".join(f"{name}={value}" for name, value in config.items()) or "default"
+
+
+def run_question(index: int, total: int, row: dict, args, config: dict, cache, limiter) -> dict:
+    question = row['question']
+    relevant = expected_sources(row.get('context_file'))
+    print(f"Processing Q{index + 1}/{total}: {question}")
+    start_time = time.time()
+    try:
+        response = retry(evaluate_question, question, relevant, ks=args.k, fetch_k=args.fetch_k,
+                         candidates=config.get(CANDIDATES), reranker=args.reranker, cache=cache,
+                         limiter=limiter, generate=not args.retrieval_only, attempts=3, base_delay=2.0)
+    except Exception as e:
+        print(f"Error processing question: {e}")
+        response = {"metrics": {}, "sources": [], "answer": f"ERROR: {str(e)}", "context": [], "timings": None}
+
+    result = {
+        'config': config_label(config),
+        'question': question,
+        'ground_truth': row.get('ground_truth', ''),
+        'generated_answer': response['answer'] or '',
+        'expected_sources': ", ".join(relevant),
+        'sources': ", ".join(response['sources']),
+        'retrieved_context': " ||| ".join(response['context']),
+        'question_type': row.get('question_type', ''),
+        'reranker': args.reranker or 'default',
+        'time_taken': round(time.time() - start_time, 2),
+    }
+    result.update({name: round(value, 4) for name, value in response['metrics'].items()})
+    result['timings'] = response['timings']
+    return result
+
+
+def summarize(label: str, results: list, ks: list):
+    scored = [r for r in results if r['timings'] is not None]
+    metrics = [f"recall@{k}" for k in ks] + ["mrr"] + [f"ndcg@{k}" for k in ks]
+    print(f"\n=== {label} ({len(scored)}/{len(results)} questions) ===")
+    print("  " + "  ".join(f"{name}={sum(r[name] for r in scored) / len(scored):.3f}" for name in metrics)
+          if scored else "  no successful question")
+
+    stages = {}
+    for r in scored:
+        stages.setdefault("total", []).append(r['timings']['total_ms'])
+        for stage, ms in r['timings']['stages'].items():
+            stages.setdefault(stage, []).append(ms)
+    print(f"  {'stage (ms)':<12}{'n':>5}" + "".join(f"{f'p{q}':>10}" for q in PERCENTILES))
+    for stage, values in stages.items():
+        row = percentiles(values)
+        print(f"  {stage:<12}{len(values):>5}" + "".join(f"{row[f'p{q}']:>10.1f}" for q in PERCENTILES))
+
+
+def evaluate_dataset(input_file='golden_dataset_test.csv', output_file='test_results.csv', reranker=None, args=None):
+    args = args or parse_args([] if reranker is None else [reranker])
     print(f"Loading dataset from {input_file}...")
     try:
-        df = pd.read_csv(input_file)
+        rows = load_dataset(input_file)
     except FileNotFoundError:
         print(f"Error: File {input_file} not found.")
         return
 
+    cache = StageCache(None if args.no_cache else args.cache)
+    limiter = RateLimiter(args.rpm, burst=args.concurrency)
+    mode = "retrieval-only" if args.retrieval_only else "full pipeline"
     results = []
-    
-    print(f"Starting evaluation of {len(df)} questions...")
-    
-    for index, row in df.iterrows():
-        question = row['question']
-        ground_truth = row['ground_truth']
-        question_type = row['question_type']
-        
-        print(f"\nProcessing Q{index+1}/{len(df)}: {question}")
-        
-        start_time = time.time()
-        try:
-            # Add a simple retry mechanism
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = rag_pipeline(question)
-                    break
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        raise e
-                    print(f"  Retry {attempt+1}/{max_retries} due to error: {e}")
-                    time.sleep(2)
-            
-            generated_answer = response['answer']
-            
-            # Extract source titles if available
-            sources = []
-            if 'metadatas' in response:
-                for meta in response['metadatas']:
-                    if meta and 'filename' in meta:
-                        sources.append(meta['filename'])
-            
-            sources_str = ", ".join(sources)
-
-            # Extract retrieved context text
-            retrieved_contexts = response.get('context', [])
-            contexts_str = " ||| ".join(retrieved_contexts)
-            
-        except Exception as e:
-            print(f"Error processing question: {e}")
-            generated_answer = f"ERROR: {str(e)}"
-            sources_str = ""
-            contexts_str = ""
-            
-        elapsed_time = time.time() - start_time
-        
-        results.append({
-            'question': question,
-            'ground_truth': ground_truth,
-            'generated_answer': generated_answer,
-            'sources': sources_str,
-            'retrieved_context': contexts_str,
-            'question_type': question_type,
-            'time_taken': round(elapsed_time, 2)
-        })
-        
-        # Optional: Add a small delay to avoid hitting rate limits too hard
-        time.sleep(1)
-
-    # Create results DataFrame
-    results_df = pd.DataFrame(results)
-    
-    # Save to CSV
-    results_df.to_csv(output_file, index=False, encoding='utf-8-sig')
+    for config in sweep_grid(args.sweep):
+        print(f"\nStarting evaluation of {len(rows)} questions ({mode}, {config_label(config)})...")
+        with override_settings(config), ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = [pool.submit(run_question, i, len(rows), row, args, config, cache, limiter)
+                       for i, row in enumerate(rows)]
+            config_results = [future.result() for future in futures]
+        cache.save()
+        summarize(config_label(config), config_results, args.k)
+        results.extend(config_results)
+
+    print(f"\nStage cache: {cache.hits} hits, {cache.misses} misses")
+    # Union of the columns: a failed question has no metric columns
+    fieldnames = list(dict.fromkeys(name for r in results for name in r if name != 'timings'))
+    with open(output_file, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
     print(f"\nEvaluation complete. Results saved to {output_file}")
 
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate the RAG pipeline on the golden dataset.")
+    # Optional reranker name to compare rerankers: python test_golden_dataset.py gemini
+    parser.add_argument("reranker", nargs="?", default=None)
+    parser.add_argument("--input", default="golden_dataset_test.csv")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--retrieval-only", action="store_true", help="score retrieval, skip answer generation")
+    parser.add_argument("--concurrency", type=int, default=4, help="questions evaluated at once")
+    parser.add_argument("--rpm", type=float, default=60, help="API calls started per minute (0: no limit)")
+    parser.add_argument("--k", type=lambda v: sorted({int(k) for k in v.split(",")}), default=list(DEFAULT_KS),
+                        help="cut-offs for recall@k and nDCG@k, e.g. 1,3,5,10")
+    parser.add_argument("--fetch-k", type=int, default=20, help="hits retrieved per list (vector variants, BM25)")
+    parser.add_argument("--sweep", action="append", default=[],
+                        help="NAME=v1,v2 over a setting (FUSION_RRF_K, FUSION_VECTOR_WEIGHT, ...) or candidates; "
+                             "repeat for a grid")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="stage cache file")
+    parser.add_argument("--no-cache", action="store_true", help="always call the services")
+    args = parser.parse_args(argv)
+    if args.output is None:
+        prefix = "retrieval_results" if args.retrieval_only else "test_results"
+        args.output = f"{prefix}_{args.reranker}.csv" if args.reranker else f"{prefix}.csv"
+    return args
+
+
 if __name__ == "__main__":
-    evaluate_dataset()
+    args = parse_args()
+    evaluate_dataset(input_file=args.input, output_file=args.output, reranker=args.reranker, args=args)
@@ -0,0 +1,85 @@
+"""
+إعدادات مشتركة بين الاختبارات: تشغيل الخدمات دون اتصال (Gemini و Supabase محليان) واستبدال خدمات مسار RAG
+"""
+import sys
+import os
+import time
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app.services.bm25_service as bm25_module
+import app.services.fakes as fakes
+import app.services.providers as providers
+import app.services.rag as rag
+from app.core.config import settings
+from app.services.bm25_service import bm25_service
+from app.services.fakes import FakeProvider, MemoryDatabase
+
+# Settings of an offline run; a test overrides some of them with
+# @pytest.mark.parametrize("offline", [{"NAME": value}], indirect=True)
+OFFLINE_SETTINGS = {
+    "MODEL_PROVIDER": "fake",
+    "DATABASE_BACKEND": "memory",
+    "VECTOR_BACKEND": "supabase",
+    "EMBEDDING_CACHE": False,
+    "ANSWER_CACHE": False,
+    "RERANKER": "local",
+    "QUERY_EXPANSION": "none",
+}
+
+
+@pytest.fixture
+def offline(request, monkeypatch, tmp_path):
+    """Fake model provider, fresh in-memory tables and an empty BM25 index in tmp_path; returns the provider."""
+    provider = FakeProvider(dim=64)
+    for name, value in {**OFFLINE_SETTINGS, **getattr(request, "param", {})}.items():
+        monkeypatch.setattr(settings, name, value)
+    monkeypatch.setitem(providers._providers, "fake", provider)
+    monkeypatch.setattr(fakes, "memory_database", MemoryDatabase())
+    monkeypatch.setattr(bm25_module, "INDEX_DIR", str(tmp_path / "bm25"))
+    monkeypatch.setattr(bm25_service, "bm25", None)
+    monkeypatch.setattr(bm25_service, "expansion", None)
+    return provider
+
+
+VECTOR_HITS = [
+    {"id": 1, "content": "الذكاء الاصطناعي يغير العالم", "metadata": {"filename": "ia.txt"}, "similarity": 0.9},
+    {"id": 2, "content": "اللغة والهوية الثقافية", "metadata": {"filename": "lang.txt"}, "similarity": 0.8},
+]
+
+
+@pytest.fixture
+def rag_services(monkeypatch):
+    """
+    Returns patch(delay=0.0, provider=None), which replaces the services of
+    the RAG pipeline, each call sleeping `delay`: two query variants,
+    constant embeddings, VECTOR_HITS from the vector search and no BM25 hit.
+    With `provider`, generation goes through it; without, the Gemini
+    reranker grades every chunk 1.0 and the answer is "إجابة".
+    patch() returns VECTOR_HITS.
+    """
+    def patch(delay: float = 0.0, provider=None):
+        def slow(result):
+            def call(*args, **kwargs):
+                time.sleep(delay)
+                return result(*args, **kwargs) if callable(result) else result
+            return call
+
+        monkeypatch.setattr(settings, "ANSWER_CACHE", False)
+        monkeypatch.setattr(settings, "VECTOR_BACKEND", "supabase")
+        monkeypatch.setattr(rag, "query_variants", slow(lambda q: [q, q + " تفصيل"]))
+        monkeypatch.setattr(rag, "get_batch_embeddings", slow(lambda texts, is_query=False: [[0.1, 0.2]] * len(texts)))
+        monkeypatch.setattr(rag, "query_vectors", slow(VECTOR_HITS))
+        monkeypatch.setattr(bm25_service, "search", slow([]))
+        if provider is not None:
+            monkeypatch.setattr(rag, "get_provider", lambda: provider)
+        else:
+            monkeypatch.setattr(settings, "RERANKER", "gemini")
+            monkeypatch.setattr(rag, "gemini_relevance_scores", slow(lambda q, chunks: [1.0] * len(chunks)))
+            monkeypatch.setattr(rag, "generate_answer", slow(lambda q, context, metadatas: "إجابة"))
+        return VECTOR_HITS
+
+    return patch
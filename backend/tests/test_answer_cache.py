@@ -0,0 +1,81 @@
+"""
+اختبار ذاكرة الإجابات الدلالية أمام مسار RAG
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app.services.rag as rag
+import app.services.answer_cache as answer_cache_module
+from app.services.answer_cache import AnswerCache, normalize_query
+
+EMBEDDINGS = {
+    "ما هو الذكاء الاصطناعي؟": [1.0, 0.0, 0.0],
+    "ما هُوَ الذكاء الإصطناعي": [1.0, 0.0, 0.0],
+    "عرّف الذكاء الاصطناعي": [0.98, 0.2, 0.0],
+    "ما هي الهوية الثقافية": [0.0, 1.0, 0.0],
+}
+
+
+def setup_pipeline(monkeypatch):
+    cache = AnswerCache(max_entries=10, threshold=0.95)
+    runs = []
+    monkeypatch.setattr(rag, "answer_cache", cache)
+    monkeypatch.setattr(answer_cache_module, "_corpus_version", lambda: 1)
+    monkeypatch.setattr(rag.settings, "ANSWER_CACHE", True)
+    monkeypatch.setattr(rag, "get_batch_embeddings", lambda texts, is_query=False: [EMBEDDINGS[t] for t in texts])
+
+    def run(query, reranker=None):
+        runs.append(query)
+        return {"query": query, "context": ["نص"], "metadatas": [{}], "answer": f"إجابة {len(runs)}"}
+
+    monkeypatch.setattr(rag, "run_rag_pipeline", run)
+    return cache, runs
+
+
+def test_normalized_and_similar_queries_hit_cache(monkeypatch):
+    """اختبار أن الأسئلة المتطابقة بعد التطبيع أو المتشابهة دلالياً تُجاب من الذاكرة"""
+    cache, runs = setup_pipeline(monkeypatch)
+
+    first = rag.rag_pipeline("ما هو الذكاء الاصطناعي؟")
+    exact = rag.rag_pipeline("ما هُوَ الذكاء الإصطناعي")
+    similar = rag.rag_pipeline("عرّف الذكاء الاصطناعي")
+    other = rag.rag_pipeline("ما هي الهوية الثقافية")
+
+    assert runs == ["ما هو الذكاء الاصطناعي؟", "ما هي الهوية الثقافية"]
+    assert exact["answer"] == similar["answer"] == first["answer"]
+    assert similar["query"] == "عرّف الذكاء الاصطناعي"
+    assert other["answer"] != first["answer"]
+    assert cache.stats() == {"entries": 2, "hits_exact": 1, "hits_semantic": 1, "misses": 2}
+    print("✅ test_normalized_and_similar_queries_hit_cache passed")
+
+
+def test_ingestion_invalidates_cache(monkeypatch):
+    """اختبار أن إضافة مقاطع جديدة تُبطل الإجابات المخزنة"""
+    cache, runs = setup_pipeline(monkeypatch)
+
+    rag.rag_pipeline("ما هو الذكاء الاصطناعي؟")
+    cache.invalidate()
+    rag.rag_pipeline("ما هو الذكاء الاصطناعي؟")
+    assert len(runs) == 2
+
+    # Another worker rewrote the BM25 index
+    monkeypatch.setattr(answer_cache_module, "_corpus_version", lambda: 2)
+    rag.rag_pipeline("ما هو الذكاء الاصطناعي؟")
+    assert len(runs) == 3
+
+    # An answer computed before an invalidation is not stored
+    version = cache.version()
+    cache.invalidate()
+    cache.store("سؤال قديم", [0.0, 0.0, 1.0], {"answer": "قديم"}, version)
+    assert cache.get("سؤال قديم") is None
+    print("✅ test_ingestion_invalidates_cache passed")
+
+
+def test_normalize_query():
+    """اختبار تطبيع نص السؤال"""
+    assert normalize_query("  ما هُوَ   الذكاء الإصطناعي؟ ") == normalize_query("ما هو الذكاء الاصطناعي")
+    assert normalize_query("ما هو") != normalize_query("هو")
+    print("✅ test_normalize_query passed")
@@ -0,0 +1,196 @@
+"""
+اختبار وحدوي لمحرك BM25 التزايدي
+"""
+import sys
+import os
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.bm25_index import BM25Index
+
+
+CORPUS = [
+    "الذكاء الاصطناعي يغير العالم",
+    "البيانات التدريبية تؤثر على الذكاء الاصطناعي",
+    "عرض العمرة الاقتصادية يشمل التأشيرة والإقامة",
+    "الإقامة في فندق قريب من الحرم",
+    "اللغة والهوية الثقافية",
+    "الذكاء الاصطناعي واللغة العربية",
+]
+
+QUERIES = [
+    "الذكاء الاصطناعي",
+    "الإقامة الحرم",
+    "اللغة العربية الهوية",
+    "كلمة غير موجودة",
+]
+
+
+def tokenize(text):
+    return text.split(" ")
+
+
+def test_scores_match_bm25okapi():
+    """اختبار تطابق الدرجات مع BM25Okapi"""
+    reference = BM25Okapi([tokenize(d) for d in CORPUS])
+    index = BM25Index()
+    index.add(tokenize(d) for d in CORPUS)
+
+    for query in QUERIES:
+        expected = reference.get_scores(tokenize(query))
+        actual = index.get_scores(tokenize(query))
+        assert np.allclose(actual, expected), f"Score mismatch for '{query}'"
+    print("✅ test_scores_match_bm25okapi passed")
+
+
+def test_incremental_add_matches_full_build():
+    """اختبار أن الإضافة التدريجية تعطي نفس نتيجة البناء الكامل"""
+    reference = BM25Okapi([tokenize(d) for d in CORPUS])
+    index = BM25Index()
+    index.add(tokenize(d) for d in CORPUS[:2])
+    index.add(tokenize(d) for d in CORPUS[2:4])
+    index.add(tokenize(d) for d in CORPUS[4:])
+
+    for query in QUERIES:
+        assert np.allclose(index.get_scores(tokenize(query)), reference.get_scores(tokenize(query)))
+    print("✅ test_incremental_add_matches_full_build passed")
+
+
+def test_remove_matches_rebuild_without_document():
+    """اختبار أن الحذف يعطي نفس نتيجة إعادة البناء بدون المستند"""
+    removed = [1, 3]
+    remaining = [d for i, d in enumerate(CORPUS) if i not in removed]
+    reference = BM25Okapi([tokenize(d) for d in remaining])
+
+    index = BM25Index()
+    index.add(tokenize(d) for d in CORPUS)
+    index.remove(removed, [tokenize(CORPUS[i]) for i in removed])
+
+    assert index.num_docs == len(remaining)
+    for query in QUERIES:
+        actual = index.get_scores(tokenize(query))
+        assert np.all(actual[removed] == 0)
+        kept = np.delete(actual, removed)
+        assert np.allclose(kept, reference.get_scores(tokenize(query)))
+    print("✅ test_remove_matches_rebuild_without_document passed")
+
+
+def test_save_and_open_memory_mapped(tmp_path):
+    """اختبار حفظ الفهرس على القرص وفتحه عبر mmap"""
+    directory = str(tmp_path / "bm25")
+    index = BM25Index()
+    index.add((tokenize(d) for d in CORPUS[:3]), CORPUS[:3], [{"document_id": 1}] * 3, [10, 11, 12])
+    index.save(directory)
+    index.add((tokenize(d) for d in CORPUS[3:]), CORPUS[3:], [{"document_id": 2}] * 3, [13, 14, 15])
+    index.save(directory)
+
+    restored = BM25Index.open(directory)
+    assert len(restored.segments) == 2
+    assert restored.text(4) == CORPUS[4]
+    assert restored.metadata(4) == {"document_id": 2}
+    assert restored.chunk_id(5) == 15
+    reference = BM25Okapi([tokenize(d) for d in CORPUS])
+    for query in QUERIES:
+        assert np.allclose(restored.get_scores(tokenize(query)), reference.get_scores(tokenize(query)))
+    print("✅ test_save_and_open_memory_mapped passed")
+
+
+def test_deletes_and_merges_survive_reopen(tmp_path, monkeypatch):
+    """اختبار أن الحذف والدمج يُحفظان بشكل صحيح"""
+    import app.services.bm25_index as bm25_index
+    monkeypatch.setattr(bm25_index, "MAX_SEGMENTS", 2)
+    directory = str(tmp_path / "bm25")
+
+    index = BM25Index()
+    for i, doc in enumerate(CORPUS):
+        index.add([tokenize(doc)], [doc], [{"document_id": i % 2}])
+        index.save(directory)
+    assert len(index.segments) <= 2
+
+    removed = index.find_document(1)
+    index.remove(removed, [tokenize(index.text(i)) for i in removed])
+    index.save(directory)
+
+    restored = BM25Index.open(directory)
+    kept = [d for i, d in enumerate(CORPUS) if i % 2 == 0]
+    reference = BM25Okapi([tokenize(d) for d in kept])
+    assert restored.num_docs == len(kept)
+    assert restored.find_document(1) == []
+    for query in QUERIES:
+        scores = restored.get_scores(tokenize(query))
+        assert np.allclose(scores[0::2], reference.get_scores(tokenize(query)))
+        assert np.all(scores[1::2] == 0)
+    print("✅ test_deletes_and_merges_survive_reopen passed")
+
+
+def test_concurrent_writers_merge_on_save(tmp_path):
+    """اختبار أن عمليتين تكتبان في نفس المجلد لا تفقد إحداهما تعديلات الأخرى"""
+    directory = str(tmp_path / "bm25")
+    index = BM25Index()
+    index.add((tokenize(d) for d in CORPUS[:3]), CORPUS[:3], [{"document_id": i} for i in range(3)], [0, 1, 2])
+    index.save(directory)
+
+    # Two workers open the same generation, then each changes and saves its copy
+    a, b = BM25Index.open(directory), BM25Index.open(directory)
+    a.add([tokenize(CORPUS[3])], [CORPUS[3]], [{"document_id": 3}], [3])
+    a.save(directory)
+    removed = b.find_document(1)
+    b.remove(removed, [tokenize(b.text(i)) for i in removed])
+    b.add([tokenize(CORPUS[4])], [CORPUS[4]], [{"document_id": 4}], [4])
+    b.add([tokenize(CORPUS[3])], [CORPUS[3]], [{"document_id": 3}], [3])  # also synced by a: kept once
+    b.save(directory)
+    a.add([tokenize(CORPUS[5])], [CORPUS[5]], [{"document_id": 5}], [5])
+    a.save(directory)
+
+    restored = BM25Index.open(directory)
+    chunk_ids, _ = restored.chunk_table()
+    assert sorted(chunk_ids.tolist()) == [0, 2, 3, 4, 5]
+    assert sorted(os.listdir(directory)) == sorted(
+        ["manifest.json", "index.lock", *[os.path.basename(s.path) for s in restored.segments],
+         f"deleted-{restored.generation:06d}.bin"])
+    live = [0, 2, 3, 4, 5]
+    reference = BM25Okapi([tokenize(CORPUS[i]) for i in live])
+    for query in QUERIES:
+        scores = restored.get_scores(tokenize(query))
+        by_chunk = {restored.chunk_id(i): scores[i] for i in range(len(restored)) if not restored.is_deleted(i)}
+        assert np.allclose([by_chunk[i] for i in live], reference.get_scores(tokenize(query)))
+    print("✅ test_concurrent_writers_merge_on_save passed")
+
+
+def test_replace_overwrites_directory(tmp_path):
+    """اختبار أن إعادة البناء الكاملة تستبدل الفهرس المحفوظ بدلاً من دمجه"""
+    directory = str(tmp_path / "bm25")
+    index = BM25Index()
+    index.add((tokenize(d) for d in CORPUS[:3]), CORPUS[:3], [{}] * 3, [0, 1, 2])
+    index.save(directory)
+
+    rebuilt = BM25Index()
+    rebuilt.add([tokenize(CORPUS[4])], [CORPUS[4]], [{}], [4])
+    rebuilt.save(directory, replace=True)
+    assert BM25Index.open(directory).chunk_table()[0].tolist() == [4]
+    print("✅ test_replace_overwrites_directory passed")
+
+
+def test_top_k_matches_full_sort():
+    """اختبار أن البحث المتفرق يعطي نفس أفضل النتائج مثل الترتيب الكامل"""
+    import random
+    random.seed(7)
+    words = [f"w{i}" for i in range(40)]
+    docs = [[random.choice(words[:4] if random.random() < 0.5 else words) for _ in range(random.randint(1, 25))]
+            for _ in range(500)]
+    index = BM25Index()
+    index.add(docs)
+
+    for query in (["w0", "w7"], ["w1", "w2", "w30", "w30"], ["w39"], ["missing"]):
+        scores = index.get_scores(query)
+        expected = sorted(((i, s) for i, s in enumerate(scores) if s > 0), key=lambda x: x[1], reverse=True)[:10]
+        for mode in ("sparse", "maxscore"):
+            actual = index.top_k(query, 10, mode=mode)
+            assert len(actual) == len(expected), f"{mode}: wrong result count for {query}"
+            assert np.allclose([s for _, s in actual], [s for _, s in expected]), f"{mode}: wrong scores for {query}"
+            assert all(np.isclose(scores[i], s) for i, s in actual)
+    print("✅ test_top_k_matches_full_sort passed")
@@ -0,0 +1,87 @@
+"""
+اختبار المزامنة التفاضلية لفهرس BM25 مع قاعدة البيانات
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app.services.bm25_service as bm25_module
+from app.services.bm25_service import BM25Service
+
+
+class FakeQuery:
+    """Minimal stand-in for the Supabase query builder used by BM25Service."""
+
+    def __init__(self, rows, log):
+        self.rows = rows
+        self.log = log
+
+    @property
+    def data(self):
+        return self.rows
+
+    def select(self, columns):
+        return self
+
+    def gt(self, column, value):
+        return FakeQuery([r for r in self.rows if r[column] > value], self.log)
+
+    def in_(self, column, values):
+        return FakeQuery([r for r in self.rows if r[column] in values], self.log)
+
+    def order(self, column):
+        return FakeQuery(sorted(self.rows, key=lambda r: r[column]), self.log)
+
+    def range(self, start, end):
+        return FakeQuery(self.rows[start:end + 1], self.log)
+
+    def execute(self):
+        self.log.append(len(self.rows))
+        return self
+
+
+class FakeSupabase:
+    def __init__(self, documents, chunks):
+        self.tables = {"documents": documents, "chunk": chunks}
+        self.fetched = []
+
+    def table(self, name):
+        return FakeQuery(self.tables[name], self.fetched if name == "chunk" else [])
+
+
+def make_chunk(chunk_id, document_id, content):
+    return {"id": chunk_id, "document_id": document_id, "content": content, "metadata": {"filename": f"{document_id}.txt"}}
+
+
+def test_sync_fetches_only_delta(tmp_path, monkeypatch):
+    """اختبار أن بدء التشغيل يجلب فقط القطع الجديدة ويحذف المستندات المحذوفة"""
+    monkeypatch.setattr(bm25_module, "INDEX_DIR", str(tmp_path / "bm25"))
+    chunks = [
+        make_chunk(1, 1, "الذكاء الاصطناعي"),
+        make_chunk(2, 1, "التعلم الآلي"),
+        make_chunk(3, 2, "اللغة العربية"),
+    ]
+    documents = [{"id": 1, "total_chunks": 2}, {"id": 2, "total_chunks": 1}]
+    db = FakeSupabase(documents, chunks)
+    monkeypatch.setattr(bm25_module, "get_supabase", lambda: db)
+
+    service = BM25Service()
+    service.initialize_from_db()
+    assert service.bm25.num_docs == 3
+    assert db.fetched == [3]
+
+    # Document 2 deleted, document 3 uploaded meanwhile
+    db.tables["documents"] = [{"id": 1, "total_chunks": 2}, {"id": 3, "total_chunks": 1}]
+    db.tables["chunk"] = chunks[:2] + [make_chunk(4, 3, "الهوية الثقافية")]
+    db.fetched.clear()
+
+    restarted = BM25Service()
+    restarted.initialize_from_db()
+    assert db.fetched == [1], f"Only the new chunk should be fetched, got {db.fetched}"
+    assert restarted.bm25.num_docs == 3
+    assert restarted.bm25.find_document(2) == []
+    assert [restarted.bm25.text(i) for i in restarted.bm25.find_document(3)] == ["الهوية الثقافية"]
+    assert restarted.ready.is_set()
+    print("✅ test_sync_fetches_only_delta passed")
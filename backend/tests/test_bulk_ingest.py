@@ -0,0 +1,196 @@
+"""
+اختبار الإدخال الجماعي (تقطيع في عمليات متوازية، تضمين محدود المعدل، إدراج على دفعات كبيرة، حفظ BM25 مرة واحدة)
+"""
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+
+import app.services.bm25_service as bm25_module
+import app.services.bulk_ingest as bulk
+import app.services.fakes as fakes
+import app.services.ingestion as ingestion
+from app.core.config import settings
+from app.services.bm25_index import BM25Index
+from app.services.bm25_service import bm25_service
+from app.services.concurrency import RateLimiter
+
+
+def write_books(directory, count=5):
+    paths = []
+    for n in range(count):
+        path = directory / f"book{n}.txt"
+        path.write_text("\n\n".join(f"--- صفحة {p} ---\n" + f"الكتاب {n} الصفحة {p} نص طويل عن اللغة والهوية. " * 12
+                                    for p in range(1, 8)), encoding="utf-8")
+        paths.append(str(path))
+    (directory / "empty.txt").write_text("", encoding="utf-8")
+    return paths + [str(directory / "empty.txt"), str(directory / "missing.txt")]
+
+
+def test_bulk_ingest_batches_across_files(tmp_path, monkeypatch):
+    """اختبار أن الإدخال الجماعي يجمع المقاطع من عدة ملفات في طلبات إدراج كبيرة ويحفظ الفهرس مرة واحدة"""
+    documents, inserts, saves, indexed, totals = [], [], [], [], {}
+    lock = threading.Lock()
+
+    def insert_chunks(rows):
+        with lock:
+            start = sum(len(batch) for batch in inserts)
+            inserts.append(rows)
+        return [{"id": start + i + 1} for i in range(len(rows))]
+
+    monkeypatch.setattr(bulk, "insert_document_record",
+                        lambda filename, total, content_hash: documents.append((filename, total)) or {"id": len(documents)})
+    monkeypatch.setattr(bulk, "update_document_total_chunks", lambda document_id, total: totals.update({document_id: total}))
+    monkeypatch.setattr(bulk, "find_document_by_hash", lambda content_hash: None)
+    monkeypatch.setattr(ingestion, "fetch_embeddings_by_hash", lambda hashes: {})
+    monkeypatch.setattr(bulk, "delete_all_documents", lambda: documents.clear())
+    monkeypatch.setattr(ingestion, "insert_chunks_records", insert_chunks)
+    monkeypatch.setattr(ingestion, "get_batch_embeddings", lambda texts, is_query=False: [[1.0] for _ in texts])
+
+    def add_documents(texts, metadatas, chunk_ids, save=True):
+        bm25_service.bm25 = "index"
+        indexed.extend(chunk_ids)
+
+    monkeypatch.setattr(bm25_service, "add_documents", add_documents)
+    monkeypatch.setattr(bm25_service, "save_index", lambda: saves.append(True))
+    monkeypatch.setattr(bm25_service, "bm25", None)
+    monkeypatch.setattr(settings, "VECTOR_BACKEND", "supabase")
+    monkeypatch.setattr(settings, "INGEST_EMBED_BATCH", 7)
+
+    paths = write_books(tmp_path)
+    expected = {os.path.basename(p): len(bulk.chunk_file(p)["chunks"]) for p in paths[:5]}
+    stats = bulk.bulk_ingest(paths, processes=2, embed_workers=3, requests_per_minute=0,
+                             insert_batch=50, reset=True)
+
+    assert stats["files"] == 6 and stats["failed_files"] == 1
+    # Created empty, counted once their last chunk is stored
+    assert dict(documents) == dict.fromkeys(expected, 0)
+    assert {documents[document_id - 1][0]: total for document_id, total in totals.items()} == expected
+    assert stats["chunks"] == stats["embeddings"] == stats["inserted"] == sum(expected.values())
+    # Rows of several files share insert requests; only the last one is partial
+    assert [len(rows) for rows in inserts[:-1]] == [50] * (len(inserts) - 1)
+    assert len({row["document_id"] for row in inserts[0]}) > 1
+    assert sorted(indexed) == list(range(1, stats["inserted"] + 1))
+    assert saves == [True]
+    report = bulk.format_report(stats)
+    assert "files/s" in report and "chunks/s" in report and "embeddings/s" in report
+    print("✅ test_bulk_ingest_batches_across_files passed")
+    print(report)
+
+
+# Small embedding batches, no retry: a failure stops the run at once
+BULK_SETTINGS = pytest.mark.parametrize("offline", [{"INGEST_EMBED_BATCH": 7, "INGEST_RETRIES": 1}], indirect=True)
+
+
+def stored(db):
+    """{filename: (total_chunks, chunk rows)} of the documents table."""
+    rows = db.tables["chunk"].values()
+    return {doc["filename"]: (doc["total_chunks"], sum(row["document_id"] == doc["id"] for row in rows))
+            for doc in db.tables["documents"].values()}
+
+
+def failing_embeddings(monkeypatch, after: int) -> dict:
+    """Embedding calls fail from the (after + 1)-th on, until state["fail"] is cleared."""
+    embed = ingestion.get_batch_embeddings
+    state = {"calls": 0, "fail": True}
+
+    def flaky(texts, is_query=False):
+        state["calls"] += 1
+        if state["fail"] and state["calls"] > after:
+            raise RuntimeError("embedding quota exceeded")
+        return embed(texts, is_query)
+
+    monkeypatch.setattr(ingestion, "get_batch_embeddings", flaky)
+    return state
+
+
+@BULK_SETTINGS
+def test_failed_run_removes_incomplete_documents(offline, tmp_path, monkeypatch):
+    """اختبار أن فشل التضمين لا يترك وثائق ناقصة وأن إعادة التشغيل تكمل الملفات المتبقية"""
+    paths = write_books(tmp_path, count=3)[:3]
+    # book0 (6 batches of 7 chunks) is stored, book1 fails half-way
+    state = failing_embeddings(monkeypatch, after=9)
+    with pytest.raises(RuntimeError, match="quota"):
+        bulk.bulk_ingest(paths, processes=0, embed_workers=1, requests_per_minute=0, insert_batch=10)
+
+    # Only documents whose chunks were all stored survive, with their count
+    after_failure = stored(fakes.memory_database)
+    expected = {os.path.basename(p): len(bulk.chunk_file(p)["chunks"]) for p in paths}
+    assert after_failure == {"book0.txt": (expected["book0.txt"], expected["book0.txt"])}
+    # The saved index matches the stored chunks
+    assert BM25Index.open(bm25_module.INDEX_DIR).num_docs == expected["book0.txt"]
+
+    state["fail"] = False
+    stats = bulk.bulk_ingest(paths, processes=0, embed_workers=1, requests_per_minute=0, insert_batch=10)
+    assert stats["unchanged_files"] == 1
+    assert stored(fakes.memory_database) == {name: (count, count) for name, count in expected.items()}
+    assert bm25_service.bm25.num_docs == sum(expected.values())
+    print("✅ test_failed_run_removes_incomplete_documents passed")
+
+
+@BULK_SETTINGS
+def test_rerun_does_not_skip_documents_missing_chunks(offline, tmp_path):
+    """اختبار أن الوثيقة التي سُجل عدد مقاطعها دون تخزينها لا تُعدّ غير متغيرة عند إعادة التشغيل"""
+    paths = write_books(tmp_path, count=2)[:2]
+    # Left by a run that died after setting the count (or by an older version of the pipeline)
+    broken = bulk.chunk_file(paths[0])
+    fakes.memory_database.table("documents").insert({"filename": broken["filename"], "total_chunks": len(broken["chunks"]),
+                                       "content_hash": broken["content_hash"]}).execute()
+
+    stats = bulk.bulk_ingest(paths, processes=0, embed_workers=1, requests_per_minute=0, insert_batch=10,
+                             replace=True)
+    assert stats["unchanged_files"] == 0
+    expected = {os.path.basename(p): len(bulk.chunk_file(p)["chunks"]) for p in paths}
+    # With replace=True, the broken row was replaced by the new version of the file
+    assert stored(fakes.memory_database) == {name: (count, count) for name, count in expected.items()}
+    assert len(fakes.memory_database.tables["documents"]) == 2
+
+    stats = bulk.bulk_ingest(paths, processes=0, embed_workers=1, requests_per_minute=0, insert_batch=10)
+    assert stats["unchanged_files"] == 2 and stats["chunks"] == 0
+    print("✅ test_rerun_does_not_skip_documents_missing_chunks passed")
+
+
+@BULK_SETTINGS
+def test_files_sharing_a_filename_both_survive(offline, tmp_path):
+    """اختبار أن ملفين مختلفين بنفس الاسم في مجلدين مختلفين يبقيان معًا، حتى مع الاستبدال في نفس التشغيل"""
+    paths = []
+    for folder, text in (("history", "تاريخ الأندلس والعمارة. "), ("grammar", "النحو العربي والصرف. ")):
+        (tmp_path / folder).mkdir()
+        path = tmp_path / folder / "notes.txt"
+        path.write_text(text * 40, encoding="utf-8")
+        paths.append(str(path))
+
+    bulk.bulk_ingest(paths[:1], processes=0, embed_workers=1, requests_per_minute=0, insert_batch=10)
+    bulk.bulk_ingest(paths[1:], processes=0, embed_workers=1, requests_per_minute=0, insert_batch=10)
+    documents = fakes.memory_database.tables["documents"].values()
+    assert [doc["filename"] for doc in documents] == ["notes.txt", "notes.txt"]
+    chunks = fakes.memory_database.tables["chunk"].values()
+    assert {row["document_id"] for row in chunks} == {doc["id"] for doc in documents}
+
+    # Files of one run never replace each other; only the documents stored before it are removed
+    for path, text in zip(paths, ("تاريخ المغرب. ", "البلاغة. ")):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(text)
+    bulk.bulk_ingest(paths, processes=0, embed_workers=1, requests_per_minute=0, insert_batch=10, replace=True)
+    assert len(fakes.memory_database.tables["documents"]) == 2
+    print("✅ test_files_sharing_a_filename_both_survive passed")
+
+
+def test_rate_limiter_spaces_requests():
+    """اختبار أن محدد المعدل المشترك يوزع الطلبات بين عدة خيوط"""
+    limiter = RateLimiter(per_minute=1200, burst=2)  # 20/s
+    start = time.perf_counter()
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    # 2 immediately (burst), then 6 more at 20/s
+    assert elapsed >= 0.25, elapsed
+    print(f"✅ test_rate_limiter_spaces_requests passed ({elapsed:.2f}s)")
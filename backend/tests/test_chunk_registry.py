@@ -0,0 +1,72 @@
+"""
+اختبار جدول المقاطع المضغوط (نصوص في مخزن واحد، بيانات وصفية في أعمدة) وسجل المعرّفات
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from app.services.bm25_index import BM25Index
+from app.services.bm25_store import SectionFile, write_sections
+from app.services.chunk_registry import ChunkColumns, ChunkRegistry, ColumnsView, read_filenames
+
+METADATAS = [
+    {"document_id": 7, "chunk_index": 0, "filename": "كتاب.pdf", "page_number": "12", "has_page_marker": True},
+    {"document_id": 7, "chunk_index": 1, "filename": "كتاب.pdf", "page_number": ""},
+    {"document_id": "9", "filename": None, "page_number": "iv", "source": "upload"},
+    {},
+]
+
+
+class MappedColumns(SectionFile, ColumnsView):
+    MAGIC = b"NBTESTCL"
+    VERSION = 1
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.filenames = read_filenames(self.filename_offsets, self.filename_blob)
+
+
+def test_columns_round_trip(tmp_path):
+    """اختبار استرجاع النصوص والبيانات الوصفية كما هي، في الذاكرة وبعد mmap"""
+    columns = ChunkColumns()
+    texts = ["الفقرة الأولى، مع فاصلة عربية", "الثانية؟", "ثالثة", ""]
+    for i, (text, meta) in enumerate(zip(texts, METADATAS)):
+        columns.append(text, meta, chunk_id=100 + i)
+
+    # Repeated filenames are stored once
+    assert columns.filenames == ["كتاب.pdf"]
+    # A numeric string document id is still indexed under its document
+    assert list(columns.document_ids) == [7, 7, 9, -1]
+
+    path = str(tmp_path / "columns.bin")
+    write_sections(path, MappedColumns.MAGIC, MappedColumns.VERSION, {}, columns.sections())
+    mapped = MappedColumns(path)
+    for view in (columns, mapped):
+        assert [view.text(i) for i in range(4)] == texts
+        assert [view.metadata(i) for i in range(4)] == METADATAS
+        assert view.filename(0) == "كتاب.pdf" and view.filename(2) is None
+    assert list(mapped.chunk_ids) == [100, 101, 102, 103]
+    print("✅ test_columns_round_trip passed")
+
+
+def test_registry_follows_index(tmp_path):
+    """اختبار ربط معرّف المقطع بموضعه في فهرس BM25 بعد الإضافة والحذف والحفظ"""
+    index = BM25Index()
+    index.add([["أ"], ["ب"], ["ج"]], ["أ", "ب", "ج"],
+              [{"document_id": 1}, {"document_id": 1}, {"document_id": 2}], [10, 20, 30])
+    registry = ChunkRegistry(lambda: index)
+
+    assert registry.slots([30, 10, 99]).tolist() == [2, 0, -1]
+    assert registry.get(20) == ("ب", {"document_id": 1})
+
+    index.remove(index.find_document(1), [["أ"], ["ب"]])
+    index.add([["د"]], ["د"], [{"document_id": 3}], [40])
+    index.save(str(tmp_path / "bm25"))
+    assert registry.get(10) is None
+    assert registry.get(40) == ("د", {"document_id": 3})
+    assert np.array_equal(registry.slots([30, 40]), [2, 3])
+    print("✅ test_registry_follows_index passed")
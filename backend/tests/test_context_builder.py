@@ -0,0 +1,66 @@
+"""
+اختبار تجميع السياق (إزالة التداخل بين المقاطع، ضغط المقاطع إلى أفضل الجمل ضمن ميزانية الرموز)
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.context_builder import SOURCE_HEADER_TOKENS, assemble_context, remove_overlap
+from app.services.ingestion import chunk_text, get_splitter
+from app.services.tokenizer import estimate_tokens
+
+FILLER = [
+    "تناول المؤلف في هذا الفصل تاريخ المدينة القديمة وأسواقها.",
+    "ووصف الرحالة طرق القوافل التي كانت تمر بها.",
+    "وذكر أسماء العلماء الذين درسوا في مساجدها.",
+    "ثم انتقل إلى الحديث عن العمارة والبساتين المحيطة بها.",
+]
+ANSWER = "وتُعد اللغة العربية ركيزة أساسية للهوية الوطنية لأنها تحفظ الذاكرة الجماعية للأمة."
+
+
+def test_remove_overlap_between_chunks_of_a_document():
+    """اختبار حذف النص المكرر بين مقطعين متتاليين من نفس الوثيقة فقط"""
+    text = "\n".join(f"{sentence[:-1]} في الجزء {n}." for n in range(3) for sentence in FILLER)
+    chunks = chunk_text(text, get_splitter("chars", 200, 80))
+    first, second = chunks[0]["text"], chunks[1]["text"]
+    assert second[:30] in first  # consecutive chunks overlap
+
+    docs, metas = remove_overlap([second, first, first[:50]],
+                                 [{"filename": "a.txt"}, {"filename": "a.txt"}, {"filename": "a.txt"}])
+    # The better-ranked chunk keeps the shared text, the other loses it; a contained chunk is dropped
+    assert docs[0] == second and len(docs) == 2
+    assert docs[1] and docs[1] in first and docs[1][-30:] not in second
+    # Chunks of different documents are never trimmed
+    other, _ = remove_overlap([second, first], [{"filename": "a.txt"}, {"filename": "b.txt"}])
+    assert other == [second, first]
+    print("✅ test_remove_overlap_between_chunks_of_a_document passed")
+
+
+def test_assemble_context_keeps_best_sentences_within_budget():
+    """اختبار الإبقاء على الجمل الأكثر صلة بالسؤال مع احترام ميزانية الرموز"""
+    query = "ما دور اللغة العربية في الهوية الوطنية؟"
+    documents = [
+        " ".join(FILLER[:2] + [ANSWER] + FILLER[2:]),
+        " ".join(FILLER[1:] + ["واللغة العربية لغة القرآن الكريم."]),
+        " ".join(reversed(FILLER)),
+    ]
+    metadatas = [{"filename": f"{n}.txt"} for n in range(3)]
+    total = sum(estimate_tokens(d) + SOURCE_HEADER_TOKENS for d in documents)
+
+    # Enough room: nothing changes
+    assert assemble_context(query, documents, metadatas, budget=total) == (documents, metadatas)
+
+    budget = total // 2
+    docs, metas = assemble_context(query, documents, metadatas, budget=budget)
+    assert sum(estimate_tokens(d) + SOURCE_HEADER_TOKENS for d in docs) <= budget
+    # The quotable answer is kept verbatim, and every chunk keeps its best sentence
+    assert ANSWER in docs[0]
+    assert "واللغة العربية لغة القرآن الكريم." in docs[1]
+    # Sentences already sent in another chunk are not repeated
+    assert sum(d.count(FILLER[1]) for d in docs) <= 1
+    assert metas == metadatas[:len(docs)]
+    assert "…" in docs[0]
+    print(f"✅ test_assemble_context_keeps_best_sentences_within_budget passed ({total} -> "
+          f"{sum(estimate_tokens(d) + SOURCE_HEADER_TOKENS for d in docs)} tokens)")
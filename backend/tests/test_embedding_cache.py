@@ -0,0 +1,87 @@
+"""
+اختبار ذاكرة التخزين المؤقت للتضمينات (LRU في الذاكرة + SQLite على القرص)
+"""
+import sys
+import os
+from types import SimpleNamespace
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+import app.services.embedding as embedding
+from app.services.embedding_cache import EmbeddingCache, cache_key
+
+
+def fake_embed(calls):
+    def embed(texts, task_type):
+        calls.append(list(texts))
+        return [[float(len(text)), 0.5, hash(task_type) % 7 / 10] for text in texts]
+    return SimpleNamespace(embedding_model="model", embed=embed)
+
+
+def test_batch_embeddings_only_call_api_for_misses(monkeypatch, tmp_path):
+    """اختبار أن النصوص المخزنة لا تُرسل إلى Gemini مرة أخرى"""
+    cache = EmbeddingCache(path=str(tmp_path / "cache.sqlite3"), memory_items=100)
+    calls = []
+    monkeypatch.setattr(embedding, "embedding_cache", cache)
+    provider = fake_embed(calls)
+    monkeypatch.setattr(embedding, "get_provider", lambda: provider)
+    monkeypatch.setattr(embedding.settings, "EMBEDDING_CACHE", True)
+
+    first = embedding.get_batch_embeddings(["نص أول", "نص ثان", "نص أول"])
+    assert calls == [["نص أول", "نص ثان"]]
+    assert first[0] == first[2]
+
+    second = embedding.get_batch_embeddings(["نص ثان", "نص ثالث"])
+    assert calls[-1] == ["نص ثالث"]
+    assert second[0] == first[1]
+
+    # Queries use another task_type and therefore another cache entry
+    embedding.get_embedding("نص أول", is_query=True)
+    assert calls[-1] == ["نص أول"]
+
+    stats = cache.stats()
+    assert stats["misses"] == 4 and stats["hits_memory"] == 1
+    print("✅ test_batch_embeddings_only_call_api_for_misses passed")
+
+
+def test_disk_tier_survives_restart_and_evicts_lru(tmp_path):
+    """اختبار بقاء التضمينات على القرص بعد إعادة التشغيل وحذف الأقدم استخداماً"""
+    path = str(tmp_path / "cache.sqlite3")
+    keys = [cache_key("model", "retrieval_document", f"chunk {i}") for i in range(5)]
+
+    cache = EmbeddingCache(path=path, memory_items=2, max_entries=4)
+    cache.put_many({key: [float(i), 1.0] for i, key in enumerate(keys[:4])})
+    cache.get_many([keys[0]])  # keys[0] is now the most recently used
+    cache.put_many({keys[4]: [4.0, 1.0]})
+    assert cache.stats()["evictions"] == 1
+
+    reopened = EmbeddingCache(path=path, memory_items=2, max_entries=4)
+    found = reopened.get_many(keys)
+    assert set(found) == {keys[0], keys[2], keys[3], keys[4]}
+    assert np.allclose(found[keys[3]], [3.0, 1.0])
+    assert reopened.stats()["hits_disk"] == 4 and reopened.stats()["misses"] == 1
+    print("✅ test_disk_tier_survives_restart_and_evicts_lru passed")
+
+
+def test_cache_key_depends_on_model_and_task():
+    """اختبار أن المفتاح يتغير مع النموذج ونوع المهمة"""
+    base = cache_key("m1", "retrieval_document", "نص")
+    assert base != cache_key("m2", "retrieval_document", "نص")
+    assert base != cache_key("m1", "retrieval_query", "نص")
+    assert cache_key("a", "b", "c") != cache_key("ab", "", "c")
+    print("✅ test_cache_key_depends_on_model_and_task passed")
+
+
+def test_stats_do_not_create_database(tmp_path):
+    """اختبار أن قراءة الإحصاءات (مثل /health) لا تنشئ ملف قاعدة البيانات"""
+    path = tmp_path / "data" / "cache.sqlite3"
+    cache = EmbeddingCache(path=str(path))
+    assert cache.stats()["disk_entries"] == 0
+    cache.clear()
+    assert not path.exists()
+    cache.put_many({cache_key("model", "retrieval_document", "نص"): [1.0, 0.0]})
+    assert path.exists() and cache.stats()["disk_entries"] == 1
+    print("✅ test_stats_do_not_create_database passed")
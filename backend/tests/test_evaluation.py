@@ -0,0 +1,74 @@
+"""
+اختبار تقييم الاسترجاع: مقاييس recall@k و MRR و nDCG، وإعادة تشغيل مسح المعاملات من ذاكرة المراحل المؤقتة
+"""
+import sys
+import os
+from pathlib import Path
+
+import pytest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.core.config import settings
+from app.services.evaluation import (
+    StageCache, evaluate_question, expected_sources, ndcg_at_k, override_settings, parse_sweep,
+    percentiles, recall_at_k, reciprocal_rank, source_ranking,
+)
+from app.services.ingestion import process_file_content
+
+SAMPLE = Path(__file__).parent / "test_data" / "sample_ocr_document.txt"
+OTHER = "رحلات العمرة الاقتصادية تشمل التأشيرة والإقامة في فندق قريب من الحرم. " * 5
+
+
+@pytest.fixture
+def corpus(offline):
+    """The offline services with two documents ingested; returns the fake provider."""
+    process_file_content(SAMPLE.read_text(encoding="utf-8"), SAMPLE.name)
+    process_file_content(OTHER, "omra.txt")
+    return offline
+
+
+def test_retrieval_metrics():
+    """اختبار قيم المقاييس على ترتيب مصادر معروف"""
+    ranking = source_ranking([{"filename": "b.txt"}, {"filename": "b.txt"}, {}, {"filename": "a.txt"}])
+    assert ranking == ["b.txt", "a.txt"]
+    assert expected_sources("a.txt; c.txt") == ["a.txt", "c.txt"] and expected_sources("") == []
+
+    assert recall_at_k(ranking, ["a.txt"], 1) == 0.0 and recall_at_k(ranking, ["a.txt"], 2) == 1.0
+    assert recall_at_k(ranking, ["a.txt", "c.txt"], 5) == 0.5
+    assert reciprocal_rank(ranking, ["a.txt"]) == 0.5 and reciprocal_rank(ranking, ["c.txt"]) == 0.0
+    assert ndcg_at_k(ranking, ["b.txt"], 3) == 1.0
+    assert ndcg_at_k(ranking, ["a.txt"], 3) == pytest.approx(1 / 1.5849625, rel=1e-6)
+    assert percentiles([10, 20, 30, 40]) == pytest.approx({"p50": 25.0, "p90": 37.0, "p95": 38.5, "p99": 39.7})
+    print("✅ test_retrieval_metrics passed")
+
+
+def test_sweep_replays_from_stage_cache(corpus, tmp_path):
+    """اختبار أن مسح معاملات الدمج وعدد المرشحين يعيد استخدام المخرجات المخزنة دون استدعاء الخدمات"""
+    question = "ما هي تقنيات الذكاء الاصطناعي؟"
+    cache = StageCache(str(tmp_path / "eval_cache.json"))
+
+    first = evaluate_question(question, [SAMPLE.name], cache=cache)
+    assert first["sources"][0] == SAMPLE.name and first["metrics"]["mrr"] == 1.0
+    assert "embed" in first["timings"]["stages"] and first["answer"] is None
+    embeds = corpus.calls["embed"]
+    cache.save()
+
+    # A fresh cache object reads the file: a new run of the script replays too
+    replay = StageCache(cache.path)
+    name, values = parse_sweep("rrf_k=10,90")
+    assert name == "FUSION_RRF_K" and values == [10, 90]
+    for value in values:
+        with override_settings({name: value}):
+            for candidates in (1, 20):
+                result = evaluate_question(question, [SAMPLE.name], cache=replay, candidates=candidates)
+                assert "embed" not in result["timings"]["stages"]
+                assert result["metrics"]["recall@10"] == 1.0
+    assert settings.FUSION_RRF_K == 60
+    assert corpus.calls["embed"] == embeds and replay.hits == 4 and replay.misses == 0
+
+    # Generation still runs on cached retrieval
+    answered = evaluate_question(question, [SAMPLE.name], cache=replay, generate=True)
+    assert answered["answer"] and answered["context"] and corpus.calls["generate"] == 1
+    print("✅ test_sweep_replays_from_stage_cache passed")
@@ -0,0 +1,87 @@
+"""
+اختبار دمج نتائج البحث المتجهي (لكل صيغة من صيغ السؤال) ونتائج BM25
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+import pytest
+
+from app.services.fusion import candidate_table, fuse_results, fuse_scores
+
+
+def hit(chunk_id, similarity):
+    return {"id": chunk_id, "content": f"مقطع {chunk_id}", "metadata": {"chunk": chunk_id}, "similarity": similarity}
+
+
+VECTOR_RESULTS = [
+    [hit(1, 0.9), hit(2, 0.8), hit(3, 0.7)],
+    [hit(4, 0.95), hit(1, 0.85)],
+]
+BM25_RESULTS = [(2, "مقطع 2", 7.0, {"chunk": 2}), (5, "مقطع 5", 3.0, {"chunk": 5})]
+
+
+def test_candidates_are_keyed_by_chunk_id_with_per_list_ranks():
+    """اختبار أن كل مقطع مرشح واحد وأن الترتيب يُحسب داخل كل قائمة"""
+    ids, texts, _, hits = candidate_table(VECTOR_RESULTS, BM25_RESULTS)
+    assert ids == [1, 2, 3, 4, 5]
+    assert texts == ["مقطع 1", "مقطع 2", "مقطع 3", "مقطع 4", "مقطع 5"]
+    # The top hit of the second variant is rank 1, not rank 4 of a concatenated list
+    first_of_variant_2 = np.flatnonzero(hits["list"] == 1)[0]
+    assert hits["candidate"][first_of_variant_2] == 3 and hits["rank"][first_of_variant_2] == 1
+
+    # Legacy BM25 hits without a chunk id join the vector hit with the same text
+    ids, _, _, _ = candidate_table(VECTOR_RESULTS, [("مقطع 1", 4.0, {}), ("مقطع 9", 2.0, {})])
+    assert ids[:4] == [1, 2, 3, 4] and len(ids) == 5 and ids[4] < 0
+    print("✅ test_candidates_are_keyed_by_chunk_id_with_per_list_ranks passed")
+
+
+def test_rrf_scores():
+    """اختبار حساب RRF الموزون"""
+    top_ids, top, chunk_to_meta, signals = fuse_results(VECTOR_RESULTS, BM25_RESULTS, method="rrf")
+    expected_1 = 0.3 / 61 + 0.3 / 62
+    expected_2 = 0.3 / 62 + 0.7 / 61
+    # Signals and metadata are keyed by chunk id, ids and texts are parallel
+    assert signals[1]["fusion"] == pytest.approx(expected_1)
+    assert signals[2]["fusion"] == pytest.approx(expected_2)
+    assert top_ids[0] == 2 and top[0] == "مقطع 2"
+    assert all(text == f"مقطع {chunk_id}" for chunk_id, text in zip(top_ids, top))
+    assert chunk_to_meta[2] == {"chunk": 2}
+    assert signals[2]["bm25"] == 7.0 and signals[1]["vector"] == 0.9
+    print("✅ test_rrf_scores passed")
+
+
+def test_combsum_and_weighted():
+    """اختبار طريقتي CombSUM والدمج الموزون"""
+    _, texts, _, hits = candidate_table(VECTOR_RESULTS, BM25_RESULTS)
+    combsum = fuse_scores(hits, len(texts), "combsum")
+    # chunk 1: top of list 0 (1.0) + bottom of list 1 (0.0)
+    assert combsum[0] == pytest.approx(1.0)
+    weighted = fuse_scores(hits, len(texts), "weighted", vector_weight=0.3, bm25_weight=0.7)
+    # chunk 2: vector 0.5 (middle of list 0), bm25 1.0
+    assert weighted[1] == pytest.approx(0.3 * 0.5 + 0.7 * 1.0)
+    with pytest.raises(ValueError):
+        fuse_scores(hits, len(texts), "unknown")
+    print("✅ test_combsum_and_weighted passed")
+
+
+def test_top_n_and_empty_inputs():
+    """اختبار حد عدد المرشحين والمدخلات الفارغة"""
+    many = [[hit(i, 1.0 - i / 1000) for i in range(300)] for _ in range(4)]
+    top_ids, top, _, _ = fuse_results(many, [], method="rrf", top_n=15)
+    assert top_ids == list(range(15)) and top == [f"مقطع {i}" for i in range(15)]
+    assert fuse_results([], [], method="rrf") == ([], [], {}, {})
+    print("✅ test_top_n_and_empty_inputs passed")
+
+
+def test_identical_texts_stay_distinct_chunks():
+    """اختبار أن مقطعين مختلفين بنفس النص يبقيان مرشحين منفصلين ولكل منهما بياناته"""
+    same = [{"id": 7, "content": "نص مكرر", "metadata": {"document_id": 1}, "similarity": 0.9},
+            {"id": 8, "content": "نص مكرر", "metadata": {"document_id": 2}, "similarity": 0.8}]
+    top_ids, top, chunk_to_meta, _ = fuse_results([same], [], method="rrf")
+    assert top_ids == [7, 8] and top == ["نص مكرر", "نص مكرر"]
+    assert chunk_to_meta[7] == {"document_id": 1} and chunk_to_meta[8] == {"document_id": 2}
+    print("✅ test_identical_texts_stay_distinct_chunks passed")
@@ -0,0 +1,221 @@
+"""
+اختبار مسار الإدخال المتدفق (تقطيع تدريجي، تضمين على دفعات متوازية مع إعادة المحاولة، إدراج مرتب)
+"""
+import sys
+import os
+import io
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+
+import app.services.ingestion as ingestion
+from app.core.config import settings
+from app.services.bm25_service import bm25_service
+from app.services.tokenizer import estimate_tokens
+
+
+def make_book(pages=40):
+    return "\n\n".join(
+        f"--- صفحة {page} ---\n" + "\n\n".join(f"فقرة {i} من الصفحة {page} في كتاب طويل عن التاريخ والأدب." * 3 for i in range(4))
+        for page in range(1, pages + 1)
+    )
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.documents = {}
+        self.chunks = []
+        self.lock = threading.Lock()
+
+    def insert_document(self, filename, total_chunks, content_hash=None):
+        doc_id = max(self.documents, default=0) + 1
+        self.documents[doc_id] = {"id": doc_id, "filename": filename, "total_chunks": total_chunks,
+                                  "content_hash": content_hash}
+        return self.documents[doc_id]
+
+    def insert_chunks(self, rows):
+        with self.lock:
+            inserted = [{"id": len(self.chunks) + i + 1} for i in range(len(rows))]
+            self.chunks.extend(rows)
+        return inserted
+
+    def update_total(self, document_id, total_chunks):
+        self.documents[document_id]["total_chunks"] = total_chunks
+
+    def find_by_hash(self, content_hash):
+        return next((doc for doc in self.documents.values()
+                     if doc["content_hash"] == content_hash and doc["total_chunks"] > 0), None)
+
+    def find_by_filename(self, filename):
+        return [doc for doc in self.documents.values() if doc["filename"] == filename]
+
+    def embeddings_by_hash(self, hashes):
+        with self.lock:
+            return {row["content_hash"]: row["embedding"] for row in self.chunks if row["content_hash"] in hashes}
+
+    def delete(self, document_id):
+        self.documents.pop(document_id, None)
+        self.chunks = [row for row in self.chunks if row["document_id"] != document_id]
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeDatabase()
+    monkeypatch.setattr(ingestion, "insert_document_record", db.insert_document)
+    monkeypatch.setattr(ingestion, "insert_chunks_records", db.insert_chunks)
+    monkeypatch.setattr(ingestion, "update_document_total_chunks", db.update_total)
+    monkeypatch.setattr(ingestion, "delete_document_record", db.delete)
+    monkeypatch.setattr(ingestion, "find_document_by_hash", db.find_by_hash)
+    monkeypatch.setattr(ingestion, "find_documents_by_filename", db.find_by_filename)
+    monkeypatch.setattr(ingestion, "fetch_embeddings_by_hash", db.embeddings_by_hash)
+    monkeypatch.setattr(bm25_service, "add_documents", lambda *args, **kwargs: None)
+    monkeypatch.setattr(bm25_service, "remove_document", lambda *args, **kwargs: 0)
+    monkeypatch.setattr(bm25_service, "save_index", lambda: None)
+    monkeypatch.setattr(settings, "INGEST_EMBED_BATCH", 8)
+    monkeypatch.setattr(settings, "INGEST_EMBED_CONCURRENCY", 3)
+    monkeypatch.setattr(settings, "INGEST_RETRY_DELAY", 0.0)
+    monkeypatch.setattr(settings, "VECTOR_BACKEND", "supabase")
+    return db
+
+
+def test_iter_chunks_streams_blocks():
+    """اختبار أن التقطيع التدريجي يطابق التقطيع الكامل للنص القصير ويحافظ على أرقام الصفحات عبر الكتل"""
+    short = make_book(pages=2)
+    assert list(ingestion.iter_chunks([short], block_chars=len(short) + 1)) == ingestion.chunk_text(short)
+
+    book = make_book()
+    # Read as small UTF-8 pieces: Arabic characters are split across reads
+    pieces = ingestion.iter_text(io.BytesIO(book.encode("utf-8")), read_size=999)
+    chunks = list(ingestion.iter_chunks(pieces, block_chars=4000))
+    assert [c["index"] for c in chunks] == list(range(len(chunks)))
+    assert all(len(c["text"]) <= 512 for c in chunks)
+    assert chunks[-1]["page_number"] == "40"
+    for page in (1, 17, 40):
+        assert any(c["has_page_marker"] and c["page_end"] == str(page) for c in chunks)
+        assert any(c["page_number"] == str(page) for c in chunks)
+    print(f"✅ test_iter_chunks_streams_blocks passed ({len(chunks)} chunks)")
+
+
+def test_pipeline_embeds_concurrently_and_inserts_in_order(fake_db, monkeypatch):
+    """اختبار تضمين الدفعات بالتوازي مع إعادة المحاولة وإدراجها بالترتيب"""
+    calls = {"n": 0, "active": 0, "peak": 0}
+    lock = threading.Lock()
+
+    def fake_embed(texts, is_query=False):
+        with lock:
+            calls["n"] += 1
+            first = calls["n"] == 1
+            calls["active"] += 1
+            calls["peak"] = max(calls["peak"], calls["active"])
+        time.sleep(0.02)
+        with lock:
+            calls["active"] -= 1
+        if first:
+            raise RuntimeError("429 Resource exhausted")
+        return [[float(len(t))] for t in texts]
+
+    monkeypatch.setattr(ingestion, "get_batch_embeddings", fake_embed)
+    book = make_book()
+    result = ingestion.process_file_stream(io.BytesIO(book.encode("utf-8")), "كتاب.txt")
+
+    assert result["total_chars"] == len(book)
+    assert result["total_chunks"] == len(fake_db.chunks)
+    assert fake_db.documents[result["document_id"]]["total_chunks"] == result["total_chunks"]
+    assert [row["chunk_index"] for row in fake_db.chunks] == list(range(result["total_chunks"]))
+    # The book fits in one block: same chunks as splitting it at once
+    assert [row["content"] for row in fake_db.chunks] == [c["text"] for c in ingestion.chunk_text(book)]
+    assert all(row["embedding"] == [float(len(row["content"]))] for row in fake_db.chunks)
+    assert 1 < calls["peak"] <= 3
+    print(f"✅ test_pipeline_embeds_concurrently_and_inserts_in_order passed ({result['total_chunks']} chunks)")
+
+
+def test_pipeline_failure_removes_partial_document(fake_db, monkeypatch):
+    """اختبار حذف الوثيقة الجزئية عند فشل التضمين بعد استنفاد المحاولات"""
+    monkeypatch.setattr(settings, "INGEST_RETRIES", 2)
+    calls = {"n": 0}
+
+    def failing_embed(texts, is_query=False):
+        calls["n"] += 1
+        if calls["n"] > 4:
+            raise RuntimeError("quota exceeded")
+        return [[0.0] for _ in texts]
+
+    monkeypatch.setattr(ingestion, "get_batch_embeddings", failing_embed)
+    with pytest.raises(RuntimeError):
+        ingestion.process_file_content(make_book(), "كتاب.txt")
+    assert fake_db.documents == {} and fake_db.chunks == []
+    print("✅ test_pipeline_failure_removes_partial_document passed")
+
+
+def test_reupload_is_idempotent_by_content_hash(fake_db, monkeypatch):
+    """اختبار تخطي الملف غير المعدل، وإعادة تضمين المقاطع المعدلة فقط، ومشاركة التضمين بين الوثائق"""
+    embedded = []
+
+    def fake_embed(texts, is_query=False):
+        embedded.extend(texts)
+        return [[float(len(t))] for t in texts]
+
+    monkeypatch.setattr(ingestion, "get_batch_embeddings", fake_embed)
+    book = make_book(pages=6)
+    first = ingestion.process_file_content(book, "كتاب.txt")
+    assert len(embedded) == first["total_chunks"] == len(fake_db.chunks)
+
+    # Same content again: nothing is embedded, inserted or replaced
+    embedded.clear()
+    again = ingestion.process_file_stream(io.BytesIO(book.encode("utf-8")), "كتاب.txt")
+    assert again["status"] == "unchanged" and again["document_id"] == first["document_id"]
+    assert embedded == [] and len(fake_db.documents) == 1
+
+    # Edited file: only the changed chunks are embedded and, when asked, the old version is removed
+    edited = book.replace("--- صفحة 6 ---", "--- صفحة 6 ---\nفقرة مضافة حديثا إلى الصفحة الأخيرة.")
+    result = ingestion.process_file_content(edited, "كتاب.txt", replace=True)
+    assert 0 < len(embedded) < result["total_chunks"]
+    assert result["embeddings_reused"] == result["total_chunks"] - len(embedded)
+    assert list(fake_db.documents) == [result["document_id"]]
+    assert {row["document_id"] for row in fake_db.chunks} == {result["document_id"]}
+
+    # The same text under another name shares the stored embeddings
+    embedded.clear()
+    copy = ingestion.process_file_content(edited + "\n\nخاتمة.", "نسخة.txt")
+    assert copy["embeddings_reused"] >= copy["total_chunks"] - 1 and len(fake_db.documents) == 2
+    print(f"✅ test_reupload_is_idempotent_by_content_hash passed ({result['embeddings_reused']} reused)")
+
+
+def test_same_filename_keeps_both_documents(fake_db, monkeypatch):
+    """اختبار أن ملفين مختلفين بنفس الاسم يبقيان معًا، وأن الاستبدال لا يحدث إلا عند طلبه صراحة"""
+    monkeypatch.setattr(ingestion, "get_batch_embeddings", lambda texts, is_query=False: [[1.0] for _ in texts])
+    first = ingestion.process_file_content("ملاحظات عن تاريخ الأندلس.", "notes.txt")
+    second = ingestion.process_file_stream(io.BytesIO("ملاحظات عن النحو العربي.".encode("utf-8")), "notes.txt")
+
+    assert first["document_id"] != second["document_id"]
+    assert sorted(fake_db.documents) == [first["document_id"], second["document_id"]]
+    assert {row["document_id"] for row in fake_db.chunks} == {first["document_id"], second["document_id"]}
+
+    third = ingestion.process_file_content("ملاحظات عن النحو والصرف.", "notes.txt", replace=True)
+    assert list(fake_db.documents) == [third["document_id"]]
+    print("✅ test_same_filename_keeps_both_documents passed")
+
+
+def test_token_chunks_respect_budget_and_sentences():
+    """اختبار التقطيع حسب عدد الرموز مع احترام نهايات الجمل وعلامات الترقيم العربية"""
+    sentence = "هل تحافظ اللغة العربية على الهوية في زمن العولمة؟ نعم، إذا اعتنى بها أهلها وعلموها لأبنائهم. "
+    text = "--- صفحة 1 ---\n" + sentence * 30
+    chunks = ingestion.chunk_text(text, ingestion.get_splitter("tokens", 40, 6))
+
+    assert all(estimate_tokens(c["text"]) <= 40 for c in chunks)
+    # Cut after a sentence or clause end, never inside a sentence
+    assert all(c["text"][-1] in ".؟،" for c in chunks)
+    assert all(estimate_tokens(c["text"]) >= 20 for c in chunks[:-1])
+    # Overlap is small: far less duplicated text than the 150-character default
+    chars = ingestion.chunk_text(text, ingestion.get_splitter("chars", 512, 150))
+    duplicated = sum(estimate_tokens(c["text"]) for c in chunks) / estimate_tokens(text) - 1
+    assert 0 < duplicated < 0.25
+    assert duplicated < sum(estimate_tokens(c["text"]) for c in chars) / estimate_tokens(text) - 1
+    assert all(c["page_number"] == "1" for c in chunks)
+    with pytest.raises(ValueError):
+        ingestion.get_splitter("words")
+    print(f"✅ test_token_chunks_respect_budget_and_sentences passed ({len(chunks)} chunks, {duplicated:.0%} duplicated)")
@@ -0,0 +1,158 @@
+"""
+اختبار طابور مهام الإدخال في الخلفية (التقدم، الإلغاء، الاستئناف، الاستعادة بعد إعادة التشغيل)
+"""
+import sys
+import os
+import io
+import socket
+import subprocess
+import threading
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+
+import app.services.jobs as jobs
+from app.services.ingestion import IngestionCancelled
+from app.services.jobs import JobError, JobQueue
+
+
+class FakeIngestion:
+    """Stores 10 chunks in batches of 4; `gate` holds it after each batch."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.calls = []
+        self.replace = []
+        self.stored = 0
+
+    def __call__(self, stream, filename, document_id=None, progress=None, cancelled=None, keep_partial=False,
+                 replace=False):
+        self.calls.append(document_id)
+        self.replace.append(replace)
+        document_id = document_id or 42
+        stream.read()
+        report = lambda: progress("inserting", {"document_id": document_id, "chunks_read": self.stored,
+                                                "chunks_embedded": self.stored, "chunks_inserted": self.stored})
+        report()
+        while self.stored < 10:
+            self.stored = min(10, self.stored + 4)
+            report()
+            self.gate.wait(5)
+            if cancelled():
+                raise IngestionCancelled("cancelled")
+        return {"document_id": document_id, "total_chunks": self.stored, "filename": filename}
+
+
+def wait_for(queue, job_id, *statuses):
+    for _ in range(200):
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job stayed {job['status']}")
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    fake = FakeIngestion()
+    monkeypatch.setattr(jobs, "process_file_stream", fake)
+    q = JobQueue(str(tmp_path / "jobs.sqlite3"), str(tmp_path / "uploads"), workers=1)
+    q.fake = fake
+    return q
+
+
+def test_job_runs_in_background(queue):
+    """اختبار أن الرفع يعيد معرّف المهمة فورًا وأن التقدم والنتيجة محفوظان"""
+    job = queue.submit(io.BytesIO("نص الكتاب".encode("utf-8")), "كتاب.txt")
+    assert job["status"] in ("queued", "running") and job["progress"]["total_bytes"] == len("نص الكتاب".encode("utf-8"))
+
+    done = wait_for(queue, job["id"], "completed")
+    assert done["stage"] == "done" and done["document_id"] == 42
+    assert done["result"]["total_chunks"] == 10
+    assert done["progress"]["bytes_read"] == done["progress"]["total_bytes"]
+    assert done["throughput"]["elapsed_seconds"] >= 0
+    # Without replace=True, documents with the same filename are kept
+    assert not done["replace"] and queue.fake.replace == [False]
+    assert not os.path.exists(os.path.join(queue.upload_dir, f"{job['id']}.txt"))
+    with pytest.raises(JobError):
+        queue.cancel(job["id"])
+    print("✅ test_job_runs_in_background passed")
+
+
+def test_cancel_then_resume_continues_document(queue):
+    """اختبار إلغاء مهمة جارية ثم استئنافها على نفس الوثيقة"""
+    queue.fake.gate.clear()
+    job = queue.submit(io.BytesIO(b"text"), "book.txt", replace=True)
+    wait_for(queue, job["id"], "running")
+    assert queue.cancel(job["id"])["cancel_requested"]
+    queue.fake.gate.set()
+
+    cancelled = wait_for(queue, job["id"], "cancelled")
+    assert cancelled["document_id"] == 42 and queue.fake.stored == 4
+
+    queue.resume(job["id"])
+    done = wait_for(queue, job["id"], "completed")
+    # The second run resumes the partially stored document
+    assert queue.fake.calls == [None, 42]
+    assert queue.fake.replace == [True, True]
+    assert done["progress"]["resumed_from"] == 4 and done["attempts"] == 2
+    with pytest.raises(KeyError):
+        queue.resume("missing")
+    print("✅ test_cancel_then_resume_continues_document passed")
+
+
+def test_recover_requeues_orphaned_jobs(queue, tmp_path):
+    """اختبار إعادة المهام التي توقفت بسبب إعادة تشغيل الخادم"""
+    path = tmp_path / "uploads" / "orphan.txt"
+    path.parent.mkdir()
+    path.write_bytes(b"text")
+    # Left "running" by a process that died: its heartbeat is old
+    queue._execute(
+        "INSERT INTO jobs (id, filename, path, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        ("orphan", "book.txt", str(path), "running", 0, 0),
+    )
+    restarted = JobQueue(queue.path, queue.upload_dir, workers=1, stale_seconds=60)
+    assert restarted.recover() == 1
+    done = wait_for(restarted, "orphan", "completed", "failed")
+    assert done["status"] == "completed" and done["attempts"] == 1
+
+    # A missing upload file fails the job instead of leaving it running
+    queue._execute(
+        "INSERT INTO jobs (id, filename, path, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        ("gone", "book.txt", str(tmp_path / "missing.txt"), "queued", 0, 0),
+    )
+    assert restarted.recover() == 1
+    assert "No such file" in wait_for(restarted, "gone", "failed")["error"]
+    print("✅ test_recover_requeues_orphaned_jobs passed")
+
+
+def test_recover_requeues_jobs_of_dead_workers_at_once(queue, tmp_path):
+    """اختبار أن الاستعادة عند الإقلاع لا تنتظر مهلة التقادم إذا كان العامل المالك قد توقف"""
+    host = socket.gethostname()
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    owners = {
+        "earlier-run": f"{host}:{os.getpid()}:0ld0ld00",   # same pid, earlier run of this process (container restart)
+        "dead-pid": f"{host}:{dead.pid}:deadbeef",
+        "live-pid": f"{host}:{os.getppid()}:a11ve000",      # another live worker process on this host
+        "other-host": "elsewhere:123:00000000",           # cannot be checked: waits for the stale age
+    }
+    now = time.time()
+    for job_id, worker in owners.items():
+        queue._execute(
+            "INSERT INTO jobs (id, filename, path, status, worker, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, "book.txt", str(tmp_path / f"{job_id}.txt"), "running", worker, now, now),
+        )
+
+    restarted = JobQueue(queue.path, queue.upload_dir, workers=1, stale_seconds=300)
+    assert restarted.recover() == 2
+    for job_id in ("earlier-run", "dead-pid"):
+        failed = wait_for(restarted, job_id, "failed")  # re-run at once; the upload file is missing here
+        assert failed["attempts"] == 1
+    assert restarted.get("live-pid")["status"] == "running"
+    assert restarted.get("other-host")["status"] == "running"
+    print("✅ test_recover_requeues_jobs_of_dead_workers_at_once passed")
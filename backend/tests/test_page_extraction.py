@@ -81,6 +81,27 @@ def test_chunk_text_with_pages():
     print(f"   First chunk with page: page {first_chunk_with_page['page_number']}")
 
 
+def test_chunk_pages_by_offset():
+    """اختبار إسناد أرقام الصفحات حسب موضع المقطع، دون التأثر بالإحالات داخل النص"""
+    paragraph = "هذه فقرة من الكتاب كما ورد في صفحة 45 من المرجع، وهي تتكرر للتطويل. "
+    content = "\n\n".join(f"--- صفحة {page} (OCR) ---\n" + paragraph * 6 for page in range(1, 5))
+
+    chunks = chunk_text(content)
+
+    assert all(len(c['text']) <= 512 for c in chunks)
+    # The in-text reference "صفحة 45" is not a page marker
+    assert {c['page_number'] for c in chunks} | {c['page_end'] for c in chunks} == {'1', '2', '3', '4'}
+    assert [int(c['page_number']) for c in chunks] == sorted(int(c['page_number']) for c in chunks)
+    for chunk in chunks:
+        assert int(chunk['page_number']) <= int(chunk['page_end'])
+        if chunk['page_number'] != chunk['page_end']:
+            assert chunk['has_page_marker'], "A chunk spans two pages only across a marker"
+    # Consecutive chunks overlap
+    assert chunks[1]['text'][:30] in chunks[0]['text']
+
+    print(f"✅ test_chunk_pages_by_offset passed - Found {len(chunks)} chunks")
+
+
 def run_all_tests():
     """تشغيل جميع الاختبارات"""
     print("\n" + "="*50)
@@ -94,6 +115,7 @@ def run_all_tests():
         test_extract_page_number_arabic_abbreviation()
         test_extract_page_number_none()
         test_chunk_text_with_pages()
+        test_chunk_pages_by_offset()
         
         print("\n" + "="*50)
         print("✅ ALL TESTS PASSED!")
@@ -0,0 +1,77 @@
+"""
+اختبار توسيع الاستعلام المحلي من إحصاءات المدونة (NPMI) وذاكرة توسيعات النموذج اللغوي
+"""
+import sys
+import os
+import random
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app.services.query_expansion as query_expansion
+from app.core.config import settings
+from app.services.bm25_service import bm25_service
+from app.services.fakes import FakeProvider
+from app.services.term_expansion import TermExpansion, analyze
+
+LANGUAGE = ["اللغة", "الهوية", "الثقافية", "التراث", "الذاكرة"]
+ECONOMY = ["الاقتصاد", "التجارة", "الأسواق", "الأسعار", "الاستثمار"]
+FILLER = ["الكتاب", "الفصل", "المؤلف", "الباحث", "الدراسة", "الموضوع", "النص", "القارئ"]
+
+
+def make_corpus(count=300, seed=3):
+    rng = random.Random(seed)
+    texts = []
+    for n in range(count):
+        topic = LANGUAGE if n % 2 else ECONOMY
+        words = rng.sample(topic, 3) + rng.sample(FILLER, 4) + [f"رقم{n}"]
+        rng.shuffle(words)
+        texts.append(" ".join(words) + ".")
+    return texts
+
+
+def test_expansion_terms_come_from_cooccurrence(tmp_path):
+    """اختبار أن الكلمات المقترحة هي التي ترد مع كلمات السؤال في نفس المقاطع، وحفظ الجدول وتحميله"""
+    texts = make_corpus()
+    expansion = TermExpansion.build(lambda: iter(texts), max_df_ratio=0.5)
+
+    terms = expansion.expand("ما دور اللغة في الهوية؟", limit=3)
+    assert terms and set(terms) <= set(LANGUAGE) - {"اللغة", "الهوية"}
+    assert not set(expansion.expand("أسعار الأسواق", limit=4)) & set(LANGUAGE)
+    assert expansion.expand("سؤال عن موضوع غير موجود") == []
+
+    expansion.save(str(tmp_path))
+    loaded = TermExpansion.load(str(tmp_path))
+    assert loaded.expand("ما دور اللغة في الهوية؟", limit=3) == terms
+    assert loaded.num_docs == len(texts)
+    print(f"✅ test_expansion_terms_come_from_cooccurrence passed ({terms})")
+
+
+def test_analyze_keeps_stems_next_to_their_surface_forms():
+    """اختبار أن التطويل المنفرد لا يزيح الصيغ المكتوبة عن جذورها"""
+    pairs = analyze("ـ اللُّغة ـ والهوية الثقافيـة")
+    assert [word for _, word in pairs] == ["اللغة", "والهوية", "الثقافية"]
+    assert [stem for stem, _ in pairs] == [stem for stem, _ in analyze("اللغة والهوية الثقافية")]
+    print("✅ test_analyze_keeps_stems_next_to_their_surface_forms passed")
+
+
+def test_expand_query_modes_and_llm_cache(monkeypatch):
+    """اختبار أوضاع التوسيع: محلي دون استدعاء النموذج، والرجوع إلى النموذج مع ذاكرة حسب السؤال المطبّع"""
+    provider = FakeProvider(responses=[("توسيع الاستعلامات", "1. صيغة أولى مفصلة للسؤال\n2. صيغة ثانية مفصلة للسؤال")])
+    monkeypatch.setattr(query_expansion, "get_provider", lambda: provider)
+    monkeypatch.setattr(query_expansion, "expansion_cache", query_expansion.ExpansionCache(10))
+    monkeypatch.setattr(bm25_service, "expansion", TermExpansion.build(lambda: iter(make_corpus()), max_df_ratio=0.5))
+
+    monkeypatch.setattr(settings, "QUERY_EXPANSION", "local")
+    variants = query_expansion.expand_query("دور اللغة")
+    assert variants[0] == "دور اللغة" and len(variants) > 1 and provider.calls["generate"] == 0
+
+    monkeypatch.setattr(settings, "QUERY_EXPANSION", "hybrid")
+    assert len(query_expansion.expand_query("سؤال مجهول تماما")) == 3 and provider.calls["generate"] == 1
+    # Same question with diacritics and other punctuation: served from the cache
+    assert query_expansion.expand_query("سُؤالٌ مجهول تماماً؟")[1:] == ["صيغة أولى مفصلة للسؤال", "صيغة ثانية مفصلة للسؤال"]
+    assert provider.calls["generate"] == 1 and query_expansion.expansion_cache.hits == 1
+
+    monkeypatch.setattr(settings, "QUERY_EXPANSION", "none")
+    assert query_expansion.expand_query("دور اللغة") == ["دور اللغة"]
+    print("✅ test_expand_query_modes_and_llm_cache passed")
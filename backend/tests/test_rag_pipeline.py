@@ -0,0 +1,56 @@
+"""
+اختبار مسار RAG (المتزامن وغير المتزامن) مع استبدال الخدمات الخارجية
+"""
+import sys
+import os
+import asyncio
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app.services.rag as rag
+
+
+def test_async_pipeline_matches_sync(rag_services):
+    """اختبار أن المسار غير المتزامن يعطي نفس نتيجة المسار المتزامن"""
+    hits = rag_services()
+    expected = rag.rag_pipeline("ما هو الذكاء الاصطناعي")
+    actual = asyncio.run(rag.rag_pipeline_async("ما هو الذكاء الاصطناعي"))
+    assert actual == expected
+    assert actual["context"] == [hit["content"] for hit in hits]
+    assert actual["metadatas"] == [hit["metadata"] for hit in hits]
+    print("✅ test_async_pipeline_matches_sync passed")
+
+
+def test_async_pipeline_serves_queries_concurrently(rag_services):
+    """اختبار أن عدة أسئلة تُعالج بالتوازي دون حجب حلقة الأحداث"""
+    delay = 0.05
+    rag_services(delay=delay)
+
+    async def run_many():
+        return await asyncio.gather(*(rag.rag_pipeline_async(f"سؤال {i}") for i in range(8)))
+
+    start = time.perf_counter()
+    results = asyncio.run(run_many())
+    elapsed = time.perf_counter() - start
+    assert len(results) == 8
+    # 5 sequential stages per question; running 8 questions one after another would take 8x longer
+    assert elapsed < 8 * 5 * delay / 2, f"Queries were not processed concurrently ({elapsed:.2f}s)"
+    print(f"✅ test_async_pipeline_serves_queries_concurrently passed ({elapsed:.2f}s)")
+
+
+def test_stream_pipeline_yields_sources_then_tokens(rag_services, monkeypatch):
+    """اختبار أن المسار المتدفق يرسل المصادر ثم أجزاء الإجابة ثم الإجابة الكاملة"""
+    hits = rag_services()
+    monkeypatch.setattr(rag, "generate_answer_stream", lambda q, context, metadatas: iter(["الذكاء ", "الاصطناعي", " [1]"]))
+
+    async def collect():
+        return [event async for event in rag.rag_pipeline_stream("ما هو الذكاء الاصطناعي")]
+
+    events = asyncio.run(collect())
+    names = [name for name, _ in events]
+    assert names == ["retrieval", "token", "token", "token", "done"]
+    assert events[0][1]["context"] == [hit["content"] for hit in hits]
+    assert events[-1][1]["answer"] == "الذكاء الاصطناعي [1]"
+    print("✅ test_stream_pipeline_yields_sources_then_tokens passed")
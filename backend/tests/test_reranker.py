@@ -0,0 +1,60 @@
+"""
+اختبار إعادة الترتيب المحلية (بدون استدعاء Gemini)
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+
+from app.services.reranker import LocalReranker, get_reranker, local_features, proximity_score, FEATURES
+
+
+def test_proximity_prefers_adjacent_terms():
+    """اختبار أن تقارب كلمات السؤال يرفع الدرجة"""
+    query = {"ذكاء", "اصطناع"}
+    assert proximity_score(query, ["ذكاء", "اصطناع", "عالم"]) == 1.0
+    spread = proximity_score(query, ["ذكاء", "a", "b", "c", "اصطناع"])
+    partial = proximity_score(query, ["ذكاء", "عالم"])
+    assert 0 < spread < 1.0 and partial == 0.5
+    assert proximity_score(query, ["عالم"]) == 0.0
+    print("✅ test_proximity_prefers_adjacent_terms passed")
+
+
+def test_local_reranker_orders_by_features():
+    """اختبار أن المقطع الأكثر صلة يُرتب أولاً وأن الخصائص محصورة بين 0 و1"""
+    query = "ما هو الذكاء الاصطناعي"
+    chunks = [
+        "اللغة العربية والهوية الثقافية في العالم المعاصر",
+        "الذكاء الاصطناعي هو فرع من علوم الحاسوب",
+        "تطور الذكاء البشري عبر التاريخ",
+    ]
+    ids = [31, 12, 47]
+    signals = {
+        31: {"fusion": 0.010, "bm25": 0.0, "vector": 0.55},
+        12: {"fusion": 0.008, "bm25": 7.5, "vector": 0.82},
+        47: {"fusion": 0.005, "bm25": 2.0, "vector": 0.60},
+    }
+    features = local_features(query, chunks, signals, ids)
+    assert features.shape == (3, len(FEATURES))
+    assert features.min() >= 0.0 and features.max() <= 1.0
+
+    assert features[1, FEATURES.index("bm25")] == 1.0
+
+    ranked = LocalReranker().rerank(query, chunks, top_k=2, signals=signals, ids=ids)
+    assert [(chunk_id, chunk) for chunk_id, chunk, _ in ranked] == [(12, chunks[1]), (47, chunks[2])]
+    assert ranked[0][2] >= ranked[1][2]
+    print("✅ test_local_reranker_orders_by_features passed")
+
+
+def test_reranker_registry():
+    """اختبار اختيار المُرتِّب بالاسم"""
+    assert get_reranker("local").name == "local"
+    assert get_reranker("none").rerank("q", ["a", "b", "c"], top_k=2) == [(0, "a", 0.0), (1, "b", 0.0)]
+    ranked = get_reranker("none").rerank("q", ["a", "b"], signals={9: {"fusion": 0.5}}, ids=[9, 4])
+    assert ranked == [(9, "a", 0.5), (4, "b", 0.0)]
+    with pytest.raises(ValueError):
+        get_reranker("unknown")
+    print("✅ test_reranker_registry passed")
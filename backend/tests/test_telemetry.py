@@ -0,0 +1,78 @@
+"""
+اختبار قياس زمن كل مرحلة من مراحل المسار (spans) ومقاييس Prometheus
+"""
+import sys
+import os
+import asyncio
+import time
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app.services.rag as rag
+from app.services.embedding_cache import EmbeddingCache
+from app.services.fakes import FakeProvider
+from app.services.telemetry import external_calls, render_metrics, span, stage_seconds, start_trace
+
+STAGES = {"expand", "embed", "vector", "bm25", "fusion", "rerank", "context", "generate"}
+
+
+def check_timings(timings):
+    spans = timings["spans"]
+    assert STAGES <= set(timings["stages"])
+    # Every stage nests under the root span of the same trace, including those run on worker threads
+    ids = {s["span_id"] for s in spans}
+    roots = [s for s in spans if s["parent_span_id"] is None]
+    assert len(roots) == 1 and all(s["parent_span_id"] in ids for s in spans if s is not roots[0])
+    assert {s["trace_id"] for s in spans} == {timings["trace_id"]}
+    assert timings["stages"]["generate"] >= 10 and timings["total_ms"] >= timings["stages"]["generate"]
+    # Two query variants: two vector searches, summed in the stage total
+    assert sum(s["name"] == "vector" for s in spans) == 2
+
+
+def test_pipeline_timings_cover_every_stage(rag_services):
+    """اختبار أن كتلة timings تغطي كل المراحل في المسار المتزامن وغير المتزامن والمتدفق"""
+    rag_services(delay=0.01, provider=FakeProvider(latency=0.01))
+    query = "ما هو الذكاء الاصطناعي"
+
+    result = rag.rag_pipeline(query, timings=True)
+    check_timings(result["timings"])
+    async_result = asyncio.run(rag.rag_pipeline_async(query, timings=True))
+    check_timings(async_result["timings"])
+    assert {k: v for k, v in async_result.items() if k != "timings"} == {k: v for k, v in result.items() if k != "timings"}
+    assert "timings" not in asyncio.run(rag.rag_pipeline_async(query))
+
+    async def collect():
+        return [event async for event in rag.rag_pipeline_stream(query, timings=True)]
+
+    done = asyncio.run(collect())[-1]
+    assert done[0] == "done" and "generate" in done[1]["timings"]["stages"]
+    print(f"✅ test_pipeline_timings_cover_every_stage passed ({result['timings']['stages']})")
+
+
+def test_metrics_exposition(monkeypatch, tmp_path):
+    """اختبار صيغة مقاييس Prometheus: مدرجات زمن المراحل، عدد الاستدعاءات الخارجية، نسب الذاكرة المؤقتة، حجم الفهرس"""
+    # Never touch data/ of the working tree
+    monkeypatch.setattr("app.services.embedding_cache.embedding_cache", EmbeddingCache(path=str(tmp_path / "cache.sqlite3")))
+    before = stage_seconds.count("unit_stage")
+    with start_trace("unit"):
+        with span("unit_stage"):
+            time.sleep(0.002)
+    assert stage_seconds.count("unit_stage") == before + 1
+
+    provider = FakeProvider()
+    calls = external_calls.value("fake", "generate")
+    provider.generate("سؤال")
+    assert external_calls.value("fake", "generate") == calls + 1
+
+    text = render_metrics()
+    assert "# TYPE nibrasse_stage_duration_seconds histogram" in text
+    assert 'nibrasse_stage_duration_seconds_bucket{stage="unit_stage",le="+Inf"}' in text
+    assert 'nibrasse_external_calls_total{service="fake",operation="generate"}' in text
+    assert 'nibrasse_cache_hit_ratio{cache="embedding"}' in text
+    assert "nibrasse_bm25_chunks " in text and 'nibrasse_index_memory_bytes{index="bm25"}' in text
+    # Buckets are cumulative
+    buckets = [float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+               if line.startswith('nibrasse_stage_duration_seconds_bucket{stage="unit_stage"')]
+    assert buckets == sorted(buckets) and buckets[-1] == before + 1
+    print("✅ test_metrics_exposition passed")
@@ -0,0 +1,40 @@
+"""
+اختبار وحدوي للمقطّع (tokenizer) العربي
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services.tokenizer import get_tokenizer, normalize, surface_tokens
+
+
+def test_normalize_removes_diacritics_and_variants():
+    """اختبار إزالة التشكيل والتطويل وتوحيد الهمزات والتاء المربوطة"""
+    assert normalize("يُعْتَبَرُ") == "يعتبر"
+    assert normalize("الـــذكاء") == "الذكاء"
+    assert normalize("أحمد إلى آخر") == "احمد الي اخر"
+    assert normalize("مدرسة") == "مدرسه"
+    print("✅ test_normalize_removes_diacritics_and_variants passed")
+
+
+def test_surface_tokens_keep_letters_as_written():
+    """اختبار أن الكلمات المكتوبة تُحفظ بحروفها دون تشكيل أو تطويل"""
+    assert surface_tokens("أَحْمد ـ الـــذكاء، Modèle") == ["أحمد", "الذكاء", "modèle"]
+    print("✅ test_surface_tokens_keep_letters_as_written passed")
+
+
+def test_tokenize_splits_punctuation_and_newlines():
+    """اختبار التقسيم على علامات الترقيم والأسطر الجديدة"""
+    tokens = get_tokenizer("arabic-nostem")("التأشيرة، الإقامة\nوالمرافقة؟")
+    assert tokens == ["التاشيره", "الاقامه", "والمرافقه"], tokens
+    print("✅ test_tokenize_splits_punctuation_and_newlines passed")
+
+
+def test_tokenize_matches_variants_and_drops_stopwords():
+    """اختبار أن الصيغ المختلفة لنفس الكلمة تعطي نفس الرمز"""
+    tokenizer = get_tokenizer("arabic")
+    assert tokenizer("الثقافة") == tokenizer("والثقافةُ") == tokenizer("ثقافة")
+    assert tokenizer("ما هي الهوية في اللغة") == tokenizer("الهوية اللغة")
+    print("✅ test_tokenize_matches_variants_and_drops_stopwords passed")
@@ -0,0 +1,194 @@
+"""
+اختبار فهرس المتجهات المحلي (بحث دقيق، تكميم int8، الحفظ والفتح، الحذف، IVF)
+"""
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+import app.services.vector_index as vector_index_module
+from app.services.bm25_index import BM25Index
+from app.services.chunk_registry import ChunkRegistry
+from app.services.vector_index import VectorIndex, normalize_rows
+from app.services.vector_store import LocalVectorStore
+
+
+def make_rows(n, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    chunk_ids = list(range(1, n + 1))
+    document_ids = [i // 10 for i in range(n)]
+    return vectors, chunk_ids, document_ids
+
+
+def brute_force(vectors, query, k, exclude=()):
+    scores = normalize_rows(vectors) @ normalize_rows(query)[0]
+    order = [i for i in np.argsort(-scores) if i not in exclude]
+    return order[:k], scores
+
+
+def test_exact_search_matches_brute_force():
+    """اختبار أن البحث الدقيق يطابق الحساب المباشر للتشابه"""
+    vectors, *columns = make_rows(200)
+    index = VectorIndex()
+    index.add(vectors[:120], *(c[:120] for c in columns))
+    index.add(vectors[120:], *(c[120:] for c in columns))
+    queries = np.random.default_rng(1).normal(size=(3, 32))
+
+    results = index.search(queries, k=10)
+    for query, hits in zip(queries, results):
+        expected, scores = brute_force(vectors, query[None, :], 10)
+        assert [row for row, _ in hits] == expected
+        assert np.allclose([s for _, s in hits], scores[expected], atol=1e-5)
+
+    # match_documents semantics: only rows above the threshold
+    thresholded = index.search(queries[:1], k=200, threshold=0.2)[0]
+    assert all(score > 0.2 for _, score in thresholded)
+    print("✅ test_exact_search_matches_brute_force passed")
+
+
+def test_tail_batches_are_stacked_once():
+    """اختبار أن دفعات الإضافة الصغيرة تُجمع مرة واحدة عند القراءة بدل النسخ عند كل إضافة"""
+    vectors, chunk_ids, document_ids = make_rows(100)
+    index = VectorIndex()
+    for start in range(0, 100, 4):
+        index.add(vectors[start:start + 4], chunk_ids[start:start + 4], document_ids[start:start + 4])
+    assert len(index.tail) == 100 and len(index.tail._blocks) == 25
+    assert index.chunk_table()[0].tolist() == chunk_ids
+    assert len(index.tail._blocks) == 1 and index.memory_usage() == 100 * 32 * 4
+    assert index.search(vectors[7:8], k=1)[0][0][0] == 7
+    print("✅ test_tail_batches_are_stacked_once passed")
+
+
+def test_concurrent_writers_merge_on_save(tmp_path):
+    """اختبار أن عمليتين تحفظان نفس فهرس المتجهات دون أن تحذف إحداهما صفوف الأخرى"""
+    directory = str(tmp_path / "vectors")
+    vectors, chunk_ids, document_ids = make_rows(40)
+    index = VectorIndex()
+    index.add(vectors[:20], chunk_ids[:20], document_ids[:20])
+    index.save(directory)
+
+    a, b = VectorIndex.open(directory), VectorIndex.open(directory)
+    a.add(vectors[20:30], chunk_ids[20:30], document_ids[20:30])
+    a.save(directory)
+    b.remove(b.find_document(0))
+    b.add(vectors[30:], chunk_ids[30:], document_ids[30:])
+    b.save(directory)
+
+    restored = VectorIndex.open(directory)
+    assert sorted(restored.chunk_table()[0].tolist()) == chunk_ids[10:]
+    row = restored.search(vectors[25:26], k=1)[0][0][0]
+    assert restored.chunk_id(row) == chunk_ids[25]
+    referenced = {os.path.basename(s.path) for s in restored.segments}
+    assert referenced <= set(os.listdir(directory))
+    print("✅ test_concurrent_writers_merge_on_save passed")
+
+
+def test_save_open_delete_and_quantize(tmp_path, monkeypatch):
+    """اختبار الحفظ والفتح عبر mmap والحذف والدمج وتكميم int8"""
+    monkeypatch.setattr(vector_index_module, "MAX_SEGMENTS", 2)
+    vectors, chunk_ids, document_ids = make_rows(100)
+    query = np.random.default_rng(2).normal(size=(1, 32))
+
+    for quantized in (False, True):
+        directory = str(tmp_path / f"q{int(quantized)}")
+        index = VectorIndex(quantized=quantized)
+        for start in range(0, 100, 25):
+            end = start + 25
+            index.add(vectors[start:end], chunk_ids[start:end], document_ids[start:end])
+            index.save(directory)
+        index.remove(index.find_document(3))
+        index.save(directory)
+
+        reopened = VectorIndex.open(directory)
+        assert len(reopened.segments) <= 2 and reopened.num_live == 90
+        hits = reopened.search(query, k=5)[0]
+        expected, _ = brute_force(vectors, query, 5, exclude=set(range(30, 40)))
+        if quantized:
+            assert len(set(row for row, _ in hits) & set(expected)) >= 4
+        else:
+            assert [row for row, _ in hits] == expected
+        row = hits[0][0]
+        assert reopened.chunk_id(row) == chunk_ids[row]
+    print("✅ test_save_open_delete_and_quantize passed")
+
+
+def test_ivf_recall():
+    """اختبار أن فهرس IVF يسترجع معظم النتائج الدقيقة"""
+    rng = np.random.default_rng(3)
+    centers = rng.normal(size=(20, 32))
+    vectors = (centers[rng.integers(0, 20, 2000)] + 0.3 * rng.normal(size=(2000, 32))).astype(np.float32)
+    _, chunk_ids, document_ids = make_rows(2000)
+    index = VectorIndex()
+    index.add(vectors, chunk_ids, document_ids)
+    index.build_ivf(nlist=20)
+
+    queries = vectors[:20] + 0.1 * rng.normal(size=(20, 32))
+    exact = index.search(queries, k=10)
+    approx = index.search(queries, k=10, nprobe=4)
+    recall = np.mean([len({r for r, _ in a} & {r for r, _ in e}) / 10 for a, e in zip(approx, exact)])
+    assert recall >= 0.9, recall
+    print(f"✅ test_ivf_recall passed (recall@10={recall:.2f})")
+
+
+def test_local_store_returns_match_documents_rows(tmp_path):
+    """اختبار أن المخزن المحلي يعيد نفس شكل نتائج match_documents"""
+    vectors, chunk_ids, document_ids = make_rows(30)
+    # Content and metadata are resolved from the BM25 chunk columns; chunk 30 is not indexed there
+    bm25 = BM25Index()
+    bm25.add([["مقطع"]] * 29, [f"مقطع {i}" for i in range(29)],
+             [{"document_id": d, "filename": f"doc{d}.txt"} for d in document_ids[:29]], chunk_ids[:29])
+    registry = ChunkRegistry(lambda: bm25)
+    store = LocalVectorStore(directory=str(tmp_path / "vectors"), registry=registry)
+    store.add_chunks(chunk_ids, document_ids, vectors.tolist())
+
+    rows = store.query(vectors[7].tolist(), match_threshold=0.5, match_count=3)
+    assert rows[0]["id"] == 8 and rows[0]["content"] == "مقطع 7"
+    assert rows[0]["metadata"] == {"document_id": 0, "filename": "doc0.txt"}
+    assert set(rows[0]) == {"id", "content", "metadata", "similarity"}
+    assert abs(rows[0]["similarity"] - 1.0) < 1e-5
+
+    assert store.remove_document(0) == 10
+    assert all(row["id"] != 30 for row in store.query(vectors[29].tolist(), match_threshold=-1.0, match_count=5))
+    reopened = LocalVectorStore(directory=str(tmp_path / "vectors"), registry=registry)
+    assert all(row["id"] != 8 for row in reopened.query(vectors[7].tolist(), match_threshold=-1.0, match_count=3))
+    print("✅ test_local_store_returns_match_documents_rows passed")
+
+
+def test_ivf_trains_in_background_once(tmp_path, monkeypatch):
+    """اختبار أن تدريب IVF يجري في الخلفية مرة واحدة بينما تستمر الاستعلامات بالبحث الدقيق"""
+    import threading
+    from app.services import vector_store as vector_store_module
+
+    vectors, chunk_ids, document_ids = make_rows(400)
+    bm25 = BM25Index()
+    bm25.add([["مقطع"]] * 400, [f"مقطع {i}" for i in range(400)], [{"document_id": d} for d in document_ids], chunk_ids)
+    monkeypatch.setattr(vector_store_module.settings, "VECTOR_IVF_MIN_ROWS", 100)
+    started, release, trainings = threading.Event(), threading.Event(), []
+    train = vector_index_module.IVF.train.__func__
+
+    def slow_train(cls, *args, **kwargs):
+        trainings.append(1)
+        started.set()
+        release.wait(5)
+        return train(cls, *args, **kwargs)
+
+    monkeypatch.setattr(vector_index_module.IVF, "train", classmethod(slow_train))
+    store = LocalVectorStore(directory=str(tmp_path / "vectors"), registry=ChunkRegistry(lambda: bm25))
+    store.add_chunks(chunk_ids, document_ids, vectors.tolist())
+
+    # Training is blocked: queries answer from the exact scan and do not start a second training
+    assert started.wait(5)
+    for _ in range(3):
+        assert store.query(vectors[7].tolist(), match_count=1)[0]["id"] == 8
+    assert store.index.ivf is None and len(trainings) == 1
+
+    store.add_chunks([401], [99], vectors[:1].tolist(), save=False)  # added during training
+    release.set()
+    store._ivf_thread.join(5)
+    assert store.index.ivf is not None and store.index.ivf.assignment[400] >= 0
+    assert len(trainings) == 1
+    print("✅ test_ivf_trains_in_background_once passed")
@@ -280,7 +280,7 @@ async function sendMessage() {
     chatMessages.appendChild(loadingDiv);
 
     try {
-        const response = await fetch(`${API_URL}/query`, {
+        const response = await fetch(`${API_URL}/query/stream`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -288,20 +288,65 @@ async function sendMessage() {
             body: JSON.stringify({ query: text }),
         });
 
-        chatMessages.removeChild(loadingDiv);
-
-        if (!response.ok) throw new Error('Erreur réseau');
+        if (!response.ok || !response.body) throw new Error('Erreur réseau');
+
+        // Show the answer as it is generated, then replace it with the persisted message
+        const answerContent = loadingDiv.querySelector('.message-content');
+        let answer = '';
+        let finalAnswer = null;
+
+        await readServerSentEvents(response, (event, data) => {
+            if (event === 'retrieval') {
+                answerContent.innerHTML = '<i class="fa-solid fa-circle-notch fa-spin"></i> Rédaction de la réponse... / جاري كتابة الإجابة...';
+            } else if (event === 'token') {
+                answer += data.text;
+                answerContent.innerHTML = answer.replace(/\n/g, '<br>');
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            } else if (event === 'done') {
+                finalAnswer = data.answer;
+            } else if (event === 'error') {
+                throw new Error(data.detail);
+            }
+        });
 
-        const data = await response.json();
-        addMessage(data.answer);
+        if (finalAnswer === null) throw new Error('Réponse incomplète');
+        chatMessages.removeChild(loadingDiv);
+        addMessage(finalAnswer);
 
     } catch (error) {
-        chatMessages.removeChild(loadingDiv);
+        if (loadingDiv.parentNode) chatMessages.removeChild(loadingDiv);
         addMessage("Désolé, une erreur est survenue. Veuillez vérifier que le backend est lancé. / عذراً، حدث خطأ. يرجى التأكد من تشغيل الخادم.", false);
         console.error(error);
     }
 }
 
+// Reads a text/event-stream response and calls onEvent(event, data) for each frame
+async function readServerSentEvents(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            const dataLines = [];
+            for (const line of frame.split('\n')) {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+            }
+            if (dataLines.length) onEvent(event, JSON.parse(dataLines.join('\n')));
+        }
+    }
+}
+
 sendBtn.addEventListener('click', sendMessage);
 userInput.addEventListener('keypress', (e) => {
     if (e.key === 'Enter' && !e.shiftKey) {
@@ -365,6 +410,12 @@ async function handleFiles(e) {
             });
 
             if (response.ok) {
+                // Ingestion runs in the background: follow the job until it finishes
+                const { job_id } = await response.json();
+                const job = await waitForJob(job_id, file.name);
+                if (job.status !== 'completed') {
+                    throw new Error(job.error || `Job ${job.status}`);
+                }
                 uploadStatus.innerHTML = `<span style="color: var(--success-color)"><i class="fa-solid fa-check"></i> ${file.name} téléchargé avec succès! / تم التحميل بنجاح</span>`;
                 loadDocuments(); // Refresh list
             } else {
@@ -390,6 +441,22 @@ async function handleFiles(e) {
     }, 3000);
 }
 
+// Poll an ingestion job, showing its progress, until it completes, fails or is cancelled
+async function waitForJob(jobId, filename) {
+    while (true) {
+        const response = await fetch(`${API_URL}/jobs/${jobId}`);
+        if (!response.ok) throw new Error('Failed to fetch job status');
+        const job = await response.json();
+        if (['completed', 'failed', 'cancelled'].includes(job.status)) {
+            return job;
+        }
+        const { chunks_inserted, bytes_read, total_bytes } = job.progress;
+        const percent = total_bytes ? Math.round(100 * bytes_read / total_bytes) : 0;
+        uploadStatus.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> ${filename}: ${percent}% lu, ${chunks_inserted} chunks / جاري المعالجة...`;
+        await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+}
+
 // Load Documents
 async function loadDocuments() {
     try {